@@ -29,6 +29,65 @@ __config__ = {
     # 实时策略在盘中handle_bar间隔多少秒触发一次
     "futu_bar_fps": 1.0,
 
+    # 实时策略触发handle_bar的方式: "fps" 按 futu_bar_fps 定时触发, "push" 收到股票池的K线推送时才触发
+    "futu_bar_mode": "fps",
+
+    # 本地数据存储目录, 历史K线按 code/ktype/复权类型 落盘, 重启后只补拉缺失的部分; 设为空字符串则不落盘
+    "futu_data_store": "~/.rqalpha/futu_data",
+
+    # 日K历史的同步方式: "incremental" 只补拉最后一条已有数据之后的部分, "full" 每次按年全量拉取
+    "futu_history_sync": "incremental",
+
+    # 本地股票列表的有效期(秒), 过期后重新从futu拉取
+    "futu_instrument_ttl": {
+        "CN": 86400,
+        "HK": 86400,
+        "US": 86400,
+    },
+
+    # 是否在股票池变化时及每个交易日开始前, 批量预取整个股票池的日K
+    "futu_history_prefetch": True,
+
+    # 实时策略中是否把股票池的逐笔和摆盘推送记录到本地数据存储, 供tick频率回测回放; 需要设置 futu_data_store
+    "futu_tick_record": False,
+
+    # 市场快照缓存的有效期(秒), is_suspended 和 current_snapshot 共用, 过期后整个股票池分批刷新
+    "futu_snapshot_ttl": 3,
+
+    # OpenD 各接口的限频 (次数, 秒), 请求按此限速发出; 未列出的接口不限速
+    "futu_request_quota": {
+        "get_history_kline": (20, 1),
+        "get_multi_points_history_kline": (10, 1),
+        "get_market_snapshot": (10, 30),
+        "get_stock_basicinfo": (10, 30),
+        "get_trading_days": (10, 30),
+    },
+    # 并发请求OpenD的线程数
+    "futu_request_workers": 4,
+
+    # 日K历史缓存的预算, 超出时按股票淘汰最久没有访问的; 分钟K线按天分块缓存, 单独使用同样的 max_bytes; 0 表示不限制
+    "futu_cache_budget": {
+        "max_instruments": 0,
+        "max_bytes": 0,
+    },
+
+    # 港股订单状态由订单推送驱动, 每隔多少秒再全量查询一次订单列表, 兜底推送丢失的情况
+    "futu_order_reconcile_interval": 30,
+
+    # 是否把订单的提交、成交、撤单记录到本地订单日志, 重启后恢复未完成的订单并与futu对账; 需要设置 futu_data_store
+    "futu_order_journal": True,
+
+    # 每隔多少秒用futu的持仓校正一次本地持仓, 只校正数量不一致且没有未完成订单的股票; 0 表示不校正
+    "futu_position_reconcile_interval": 60,
+
+    # 下单和改单前的本地风控, 在提交到futu之前检查; 买单的委托数量按每手股数向下取整, 卖单不取整
+    "futu_order_risk": {
+        "max_notional": 0,  # 单笔订单的最大金额, 0 表示不限制
+        "max_open_orders": 0,  # 最多同时存在的未完成订单数, 0 表示不限制
+        "account_rate": (20, 1),  # 帐户的下单频率 (次数, 秒), 超出时拒单; None 表示不限制
+        "symbol_rate": (5, 1),  # 单只股票的下单频率 (次数, 秒), 超出时拒单; None 表示不限制
+    },
+
     "rqalpha_broker_config":
     {
         # 是否开启信号模式
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2017 Futu, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# 提供给策略脚本的扩展API, FUTUMod.start_up 时导入注册
+
+from rqalpha.api.api_base import export_as_api
+from rqalpha.const import EXECUTION_PHASE
+from rqalpha.environment import Environment
+from rqalpha.execution_context import ExecutionContext
+
+
+@export_as_api
+@ExecutionContext.enforce_phase(EXECUTION_PHASE.ON_BAR,
+                                EXECUTION_PHASE.ON_TICK,
+                                EXECUTION_PHASE.SCHEDULED)
+def change_order(order, price=None, quantity=None):
+    """
+    改单: 修改未完成订单的限价和委托数量, 直接调用futu的改单接口, 不需要先撤单再重新下单
+    成功后原订单对象被原地更新, order_id 不变
+
+    :param order: 需要修改的订单
+    :type order: :class:`~Order`
+    :param float price: 新的限价, None 表示不变
+    :param int quantity: 新的委托数量(含已成交部分), None 表示不变
+    :return: bool 改单是否成功
+    """
+    broker = Environment.get_instance().broker
+    if not hasattr(broker, 'change_order'):
+        raise RuntimeError("change_order is only supported by futu realtime broker")
+    return broker.change_order(order, price, quantity)
+
+
+@export_as_api
+@ExecutionContext.enforce_phase(EXECUTION_PHASE.BEFORE_TRADING,
+                                EXECUTION_PHASE.ON_BAR,
+                                EXECUTION_PHASE.ON_TICK,
+                                EXECUTION_PHASE.AFTER_TRADING,
+                                EXECUTION_PHASE.SCHEDULED)
+def cancel_all_orders(order_book_id=None, side=None):
+    """
+    批量撤单: 撤销全部未完成的订单, 或只撤指定股票、指定买卖方向的订单
+    撤单请求并发发出, 全部返回后只对账一次
+
+    :param str order_book_id: 股票代码, None 表示全部
+    :param side: SIDE.BUY | SIDE.SELL, None 表示全部
+    :return: list[:class:`~Order`] 发出撤单的订单
+    """
+    broker = Environment.get_instance().broker
+    if not hasattr(broker, 'cancel_orders'):
+        raise RuntimeError("cancel_all_orders is only supported by futu realtime broker")
+    return broker.cancel_orders(order_book_id, side)
+
+
+@export_as_api
+@ExecutionContext.enforce_phase(EXECUTION_PHASE.BEFORE_TRADING,
+                                EXECUTION_PHASE.ON_BAR,
+                                EXECUTION_PHASE.ON_TICK,
+                                EXECUTION_PHASE.AFTER_TRADING,
+                                EXECUTION_PHASE.SCHEDULED)
+def get_position_reconcile_metrics():
+    """
+    持仓对账统计: 定时用futu的持仓校正本地持仓时发现的偏差, 见配置 futu_position_reconcile_interval
+
+    :return: dict, reconcile_count 对账次数, drift_count 累计校正的股票次数, drift_quantity 累计校正的股数,
+             last_drift 最近一次校正的明细 DataFrame(order_book_id, local_qty, remote_qty), 没有校正过时为 None
+    """
+    broker = Environment.get_instance().broker
+    if not hasattr(broker, 'get_position_reconcile_metrics'):
+        raise RuntimeError("get_position_reconcile_metrics is only supported by futu realtime broker")
+    return broker.get_position_reconcile_metrics()
@@ -0,0 +1,639 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2017 Futu, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from rqalpha.interface import AbstractBroker
+from rqalpha.const import DEFAULT_ACCOUNT_TYPE
+from rqalpha.events import EVENT, Event
+from rqalpha.model.order import *
+from rqalpha.model.base_position import Positions
+from rqalpha.model.portfolio import Portfolio
+from rqalpha.model.trade import *
+from rqalpha.utils.i18n import gettext as _
+from rqalpha.utils.logger import system_log
+from .futu_utils import *
+
+from time import sleep
+import numpy as np
+import pandas as pd
+from threading import Thread, RLock, Timer
+from concurrent.futures import ThreadPoolExecutor
+from .futu_order_submitter import FUTUOrderSubmitter
+from .futu_order_registry import FUTUOrderRegistry
+from .futu_order_journal import FUTUOrderJournal
+from .futu_risk_gate import FUTURiskGate
+from .futu_position_reconciler import FUTUPositionReconciler
+
+# 批量撤单时并发发出撤单请求的线程数
+CANCEL_WORKERS = 8
+
+# 批量撤单对账前等待下单请求返回的最长时间(秒)
+INFLIGHT_WAIT_TIMEOUT = 10
+
+# 订单已经终结但成交推送还没到时, 等待成交推送的最长时间(秒), 超时后查询一次成交列表补齐
+DEAL_WAIT_TIMEOUT = 2
+
+# futu订单的终结状态: 3=全部成交 4=已失效 5=下单失败 6=已撤单 7=已删除
+FUTU_ORDER_FINAL_STATUS = [3, 4, 5, 6, 7]
+
+
+class FUTUBrokerBase(AbstractBroker):
+    """
+    FUTUBrokerHK 和 FUTUBrokerCN 共用的下单、撤单、改单、订单状态和成交记账
+    子类只需要提供:
+    1. MARKET: 订单日志的市场前缀; ORDER_PUSH: 是否有订单推送, 有的话单笔撤单不需要对账
+    2. _create_trade_context: 创建futu交易接口, 并订阅需要的推送
+    3. _thread_order_check: 定时检查订单状态的方式
+    """
+
+    MARKET = None
+    ORDER_PUSH = False
+
+    def __init__(self, env, mod_config):
+        self._env = env
+        self._mod_config = mod_config
+        self._portfolio = None
+        self._open_orders = FUTUOrderRegistry()
+        self._deal_ids = set()  # 已经记账的futu成交号
+        self._deferred = {}  # 已经终结但成交还没记齐的订单 futu订单号 -> (futu状态, futu成交数量)
+        self._deal_check_timer = None
+        self._risk_gate = FUTURiskGate(self._mod_config.futu_order_risk)
+        self._order_lock = RLock()  # 推送线程、定时查询线程、下单线程和策略线程都会更新订单
+
+        self._env.event_bus.add_listener(EVENT.PRE_BEFORE_TRADING, self._pre_before_trading)
+        self._env.event_bus.add_listener(EVENT.PRE_AFTER_TRADING, self._pre_after_trading)
+
+        # futu api创建及参数
+        self._trade_envtype = 1  # futu交易 envtype : 0 = 实盘  1 = 仿真
+        if IsRuntype_RealTrade():
+            self._trade_envtype = 0
+        self._trade_context = self._create_trade_context()
+
+        # 订单日志, 重启后恢复上次运行中未完成的订单
+        self._journal = None
+        if self._mod_config.futu_order_journal and self._mod_config.futu_data_store:
+            self._journal = FUTUOrderJournal(self._mod_config.futu_data_store,
+                                             "{}_{}".format(self.MARKET, self._trade_envtype))
+            self._restore_open_orders()
+
+        # 批量撤单的请求并发发出
+        self._cancel_executor = ThreadPoolExecutor(max_workers=CANCEL_WORKERS)
+
+        # 下单请求在工作线程中按顺序发出, submit_order 不阻塞策略线程
+        self._submitter = FUTUOrderSubmitter(self._place_order, self._reject_order,
+                                             "{}Submitter".format(self.__class__.__name__))
+
+        thread_order_check = Thread(target=self._thread_order_check)
+        thread_order_check.setDaemon(True)
+        thread_order_check.start()
+
+        # 定时用futu的持仓校正本地持仓
+        self._position_reconciler = FUTUPositionReconciler(
+            lambda: self._trade_context.position_list_query(envtype=self._trade_envtype), self._order_lock)
+        if self._mod_config.futu_position_reconcile_interval > 0:
+            thread_position_check = Thread(target=self._thread_position_check)
+            thread_position_check.setDaemon(True)
+            thread_position_check.start()
+
+    def _create_trade_context(self):
+        """创建futu交易接口并订阅推送, 返回的对象需要启动完成"""
+        raise NotImplementedError
+
+    def _thread_order_check(self):
+        raise NotImplementedError
+
+    def get_portfolio(self):
+        """
+        获取投资组合。系统初始化时，会调用此接口，获取包含账户信息、净值、份额等内容的投资组合
+        :return: Portfolio
+        """
+        if self._portfolio is not None:
+            return self._portfolio
+        self._portfolio = self._init_portfolio()
+
+        if not self._portfolio._accounts:
+            raise RuntimeError("accout config error")
+
+        self._freeze_restored_orders()
+        return self._portfolio
+
+    def submit_order(self, order):
+        """
+        提交订单。在当前版本，RQAlpha 会生成 :class:`~Order` 对象，再通过此接口提交到 Broker。
+        TBD: 由 Broker 对象生成 Order 并返回？
+        """
+
+        print("{}.submit_order:{}".format(self.__class__.__name__, order))
+        if order.type == ORDER_TYPE.MARKET:
+            raise RuntimeError("submit_order not support ORDER_TYPE.MARKET")
+
+        account = self._get_account(order.order_book_id)
+        self._risk_gate.round_lot(order, self._env.get_instrument(order.order_book_id).round_lot)
+        self._env.event_bus.publish_event(Event(EVENT.ORDER_PENDING_NEW, account=account, order=order))
+
+        # 本地风控, 不通过的直接拒单, 不发到futu
+        reason = self._risk_gate.check(order, len(self._open_orders) + len(self._submitter))
+        if reason is not None:
+            order.mark_rejected(reason)
+            self._env.event_bus.publish_event(Event(EVENT.ORDER_CREATION_REJECT, account=account, order=order))
+            return
+
+        order.active()
+        self._submitter.put(order)
+
+    def _place_order(self, order):
+        """下单队列的工作线程中调用, 发起futu下单请求并发出 ORDER_CREATION_PASS/REJECT 事件"""
+        account = self._get_account(order.order_book_id)
+
+        # 发起futu api接口请求
+        futu_order_side = 0 if order.side == SIDE.BUY else 1
+        futu_order_type = 0  # 港股增强限价单
+        ret_code, ret_data = self._trade_context.place_order(order.price, order.quantity, order.order_book_id,
+                                                             futu_order_side, futu_order_type,
+                                                             envtype=self._trade_envtype, order_deal_push=True)
+
+        # 事件通知
+        if ret_code != 0:
+            order.mark_rejected("futu api req err:{} ".format(ret_code))
+            self._env.event_bus.publish_event(Event(EVENT.ORDER_CREATION_REJECT, account=account, order=order))
+        else:
+            futu_order_id = ret_data.loc[0, 'orderid']
+            with self._order_lock:
+                self._open_orders.add(futu_order_id, order)
+                cancel_requested = self._submitter.take_cancel_request(order)
+                self._journal_record('submit', order, futu_order_id)
+                self._env.event_bus.publish_event(Event(EVENT.ORDER_CREATION_PASS, account=account, order=order))
+                # 下单返回中已带有订单状态, 先更新一次; 之后的变化由推送或定时查询更新
+                self._update_open_orders(ret_data, futu_order_id)
+
+            # 下单请求返回前策略已经撤单, 拿到futu订单号后立即发出撤单
+            if cancel_requested and not order.is_final():
+                self._request_cancel(futu_order_id, order)
+                if not self.ORDER_PUSH:
+                    self._check_open_orders(futu_order_id)
+
+    def _reject_order(self, order, reason):
+        """_place_order 抛出异常时在下单队列的工作线程中调用; 还没拿到futu订单号的订单按拒单处理, 释放冻结的资金"""
+        with self._order_lock:
+            if order.is_final() or self._open_orders.get_futu_order_id(order) is not None:
+                return  # 已经在futu下单成功的, 状态交给推送或定时查询更新
+            order.mark_rejected(reason)
+            self._env.event_bus.publish_event(Event(EVENT.ORDER_CREATION_REJECT,
+                                                    account=self._get_account(order.order_book_id), order=order))
+
+    def cancel_order(self, order):
+        """
+        撤单。
+        :param order: 订单
+        :type order: :class:`~Order`
+        """
+        # 有订单推送时单笔撤单的结果由推送通知, 不需要对账
+        self._cancel_orders([order], reconcile=not self.ORDER_PUSH)
+
+    def cancel_orders(self, order_book_id=None, side=None):
+        """
+        批量撤单: 撤销全部未完成的订单, 或只撤指定股票、指定买卖方向的订单
+        :param order_book_id: 股票代码, None 表示全部
+        :param side: SIDE.BUY | SIDE.SELL, None 表示全部
+        :return: list[:class:`~Order`] 发出撤单的订单
+        """
+        orders = [order for order in self.get_open_orders(order_book_id) if side is None or order.side == side]
+        self._cancel_orders(orders)
+        return orders
+
+    def _cancel_orders(self, orders, reconcile=True):
+        """
+        还在下单队列中的订单直接从队列撤销; 下单请求还没返回的订单记下撤单请求, 拿到futu订单号后再撤;
+        已发到futu的订单并发发出撤单请求, 全部返回后只对账一次, 撤单成功与否以对账结果为准
+        """
+        pending = []
+        inflight = False
+        with self._order_lock:  # 与 _place_order 登记futu订单号互斥, 订单不会既不在队列中又没有登记
+            for order in orders:
+                account = self._get_account(order.order_book_id)
+                futu_order_id = self._open_orders.get_futu_order_id(order)
+                if futu_order_id is None and self._submitter.cancel(order):
+                    self._env.event_bus.publish_event(Event(EVENT.ORDER_PENDING_CANCEL, account=account, order=order))
+                    order.mark_cancelled(_(u"{order_id} order has been cancelled by user.").format(
+                        order_id=order.order_id))
+                    self._env.event_bus.publish_event(Event(EVENT.ORDER_CANCELLATION_PASS, account=account,
+                                                            order=order))
+                elif futu_order_id is None and self._submitter.cancel_inflight(order):
+                    # 下单请求还没返回, 由 _place_order 拿到futu订单号后发出撤单
+                    self._env.event_bus.publish_event(Event(EVENT.ORDER_PENDING_CANCEL, account=account, order=order))
+                    inflight = True
+                elif futu_order_id is not None and not order.is_final():
+                    self._env.event_bus.publish_event(Event(EVENT.ORDER_PENDING_CANCEL, account=account, order=order))
+                    pending.append((futu_order_id, order))
+
+        futures = [self._cancel_executor.submit(self._request_cancel, futu_order_id, order)
+                   for futu_order_id, order in pending]
+        for future in futures:
+            future.result()
+
+        if reconcile and (pending or inflight):
+            # 等下单请求还没返回的订单拿到futu订单号并发出撤单, 对账时才能看到它们
+            if inflight and not self._submitter.wait_inflight(INFLIGHT_WAIT_TIMEOUT):
+                system_log.warn("{}: place order still in flight after cancel".format(self.__class__.__name__))
+            self._check_open_orders()
+
+    def _request_cancel(self, futu_order_id, order):
+        """向futu发出撤单请求, 失败时发出 ORDER_CANCELLATION_REJECT, 撤单结果由推送或对账更新"""
+        ret_code, ret_data = self._trade_context.set_order_status(0, futu_order_id,
+                                                                  envtype=self._trade_envtype)  # 0 = 撤单
+        if ret_code != 0:
+            account = self._get_account(order.order_book_id)
+            self._env.event_bus.publish_event(Event(EVENT.ORDER_CANCELLATION_REJECT, account=account, order=order))
+        else:
+            self._journal_record('cancel', order, futu_order_id)
+
+    def change_order(self, order, price=None, quantity=None):
+        """
+        改单: 调用futu的改单接口修改未完成订单的限价和委托数量, 成功后原地更新 Order
+        :param order: 订单
+        :param price: 新的限价, None 表示不变
+        :param quantity: 新的委托数量, 含已成交部分, None 表示不变
+        :return: bool
+        """
+        price = order.price if price is None else float(price)
+        quantity = order.quantity if quantity is None else int(quantity)
+        quantity = self._risk_gate.lot_quantity(order.side, quantity,
+                                                self._env.get_instrument(order.order_book_id).round_lot)
+        if order.is_final() or quantity <= order.filled_quantity:
+            return False
+        if price == order.price and quantity == order.quantity:
+            return True
+
+        # 改单与下单一样经过本地风控, 不通过的保持原订单不变
+        reason = self._risk_gate.check(order, len(self._open_orders) + len(self._submitter) - 1, price, quantity)
+        if reason is not None:
+            print("{}.change_order rejected:{} {}".format(self.__class__.__name__, order, reason))
+            return False
+
+        # 还在下单队列中没有发出的订单, 直接修改, 工作线程按新的价格和数量下单
+        if self._open_orders.get_futu_order_id(order) is None and \
+                self._submitter.amend(order, lambda o: self._amend_order(o, price, quantity)):
+            return True
+
+        futu_order_id = self._open_orders.get_futu_order_id(order)
+        if futu_order_id is None:
+            return False
+        ret_code, ret_data = self._trade_context.change_order(price, quantity, futu_order_id,
+                                                              envtype=self._trade_envtype)
+        if ret_code != 0:
+            print("{}.change_order fail:{} {}".format(self.__class__.__name__, order, ret_data))
+            return False
+
+        with self._order_lock:
+            if order.is_final():  # 改单返回前订单已经终结
+                return False
+            self._amend_order(order, price, quantity)
+            self._journal_record('change', order, futu_order_id)
+        return True
+
+    def _amend_order(self, order, price, quantity):
+        """
+        原地修改订单的价格和数量
+        冻结的资金和持仓只按修改前后未成交部分的差额调整, 已成交的部分已经在记账时解冻, 不能再冻结一次
+        """
+        account = self._get_account(order.order_book_id)
+        unfilled_quantity = order.unfilled_quantity
+        frozen_cash = self._frozen_cash_of_order(account, order)
+        state = order.get_state()
+        state['frozen_price'] = price
+        state['quantity'] = quantity
+        order.set_state(state)
+        if order.side == SIDE.BUY:
+            account._frozen_cash += self._frozen_cash_of_order(account, order) - frozen_cash
+        else:
+            position = account.positions.get(order.order_book_id, None)
+            if position is not None:
+                position.on_order_amend_(order, unfilled_quantity)
+
+    @staticmethod
+    def _frozen_cash_of_order(account, order):
+        """
+        买单当前冻结的资金, 与帐户在撤单/拒单时解冻的算法一致:
+        帐户有 _frozen_cash_of_order 的 rqalpha 版本含预估交易费用(env.get_order_transaction_cost), 直接用帐户的算法;
+        没有的版本按 冻结价格*未成交数量
+        """
+        frozen_cash_of_order = getattr(account, '_frozen_cash_of_order', None)
+        if frozen_cash_of_order is not None:
+            return frozen_cash_of_order(order)
+        return order.frozen_price * order.unfilled_quantity
+
+    def get_open_orders(self, order_book_id=None):
+        """
+        [Required]
+        获得当前未完成的订单。
+        :return: list[:class:`~Order`]
+        """
+        # 已发到futu的未完成订单, 加上还在下单队列中和下单请求还没返回的订单
+        with self._order_lock:
+            orders = self._open_orders.orders(order_book_id)
+            return orders + [order for order in self._submitter.orders(order_book_id)
+                             if self._open_orders.get_futu_order_id(order) is None]
+
+    def _pre_before_trading(self, event):
+        print("broker before_trading")
+
+    def _pre_after_trading(self, event):
+        # 收盘时先在futu撤掉全部未完成的订单并对账一次, 补齐还没到的成交, 仍未完成的再在本地清掉
+        self._cancel_orders(self.get_open_orders())
+        if self._deferred:
+            self._check_deferred_orders()
+
+        for order in self._open_orders.orders():
+            order.mark_rejected(_(u"Order Rejected: {order_book_id} can not match. Market close.").format(
+                order_book_id=order.order_book_id
+            ))
+            account = self._env.get_account(order.order_book_id)
+            self._env.event_bus.publish_event(Event(EVENT.ORDER_UNSOLICITED_UPDATE, account=account, order=order))
+            self._journal_record('market_close', order, self._open_orders.get_futu_order_id(order))
+        self._open_orders.clear()
+        self._deal_ids.clear()
+        self._deferred.clear()
+        print("broker after_trading")
+
+    def _check_open_orders(self, futu_order_id=None):
+        if len(self._open_orders) == 0:
+            return
+        ret_code, pd_data = self._trade_context.order_list_query(envtype=self._trade_envtype)
+        if ret_code != 0:
+            return
+        with self._order_lock:
+            self._update_open_orders(pd_data, futu_order_id)
+
+    def _update_open_orders(self, pd_data, futu_order_id=None):
+        """
+        用futu返回的订单数据(查询结果或推送)更新本地未完成的订单, 产生对应的事件
+        本地未完成订单与返回数据按订单号做一次连接, 只有成交数量或状态有变化的订单才会处理;
+        成交由成交推送按笔记账, 这里只处理订单状态
+        """
+        if futu_order_id is not None:
+            futu_order_ids = [futu_order_id]
+        else:
+            futu_order_ids = self._open_orders.futu_order_ids()
+        tracked = [(fid, self._open_orders.get_order(fid)) for fid in futu_order_ids]
+        tracked = [(fid, order) for fid, order in tracked if order is not None]
+        if len(tracked) == 0 or len(pd_data) == 0:
+            return
+
+        local = pd.DataFrame({
+            'key': [str(fid) for fid, __ in tracked],
+            'pos': np.arange(len(tracked)),
+            'local_qty': [order.filled_quantity for __, order in tracked],
+        })
+        remote = pd.DataFrame({
+            'key': pd_data['orderid'].astype(str).values,
+            'status': pd_data['status'].astype(int).values,
+            'dealt_qty': pd_data['dealt_qty'].astype(int).values,
+        })
+        remote = remote.drop_duplicates('key', keep=False)  # 同一订单号有多条的无法确定状态, 跳过
+        merged = local.merge(remote, on='key', how='inner')
+        changed = merged[merged['status'].isin(FUTU_ORDER_FINAL_STATUS).values |
+                         (merged['dealt_qty'] != merged['local_qty']).values]
+
+        # 成交推送通常晚于订单推送: 已终结但成交没有记齐的订单先不终结, 等成交推送记齐后由 _apply_deals 终结;
+        # 等待超时或全量对账发现成交缺口时, 由定时器在锁外查询一次成交列表补齐
+        missing = (changed['dealt_qty'] > changed['local_qty']).values
+        final = changed['status'].isin(FUTU_ORDER_FINAL_STATUS).values
+        if (missing & final).any() or (futu_order_id is None and missing.any()):
+            self._schedule_deal_check()
+
+        for row, deferred in zip(changed.itertuples(index=False), missing & final):
+            fid, order = tracked[row.pos]
+            if deferred:
+                self._deferred[str(fid)] = (int(row.status), int(row.dealt_qty))
+            else:
+                self._apply_order_status(fid, order, int(row.status))
+
+    def _apply_order_status(self, fid, order, ft_status):
+        account = self._get_account(order.order_book_id)
+
+        if ft_status == 3:  # 全部成交, 等成交全部记上后由 _apply_deals 移除
+            if order.unfilled_quantity == 0:
+                self._open_orders.remove(fid)
+
+        elif ft_status == 5:  # 下单失败
+            self._env.event_bus.publish_event(Event(EVENT.ORDER_CREATION_REJECT, account=account, order=order))
+            self._open_orders.remove(fid)
+
+        elif ft_status == 6:  # 6=已撤单
+            order.mark_cancelled(_(u"{order_id} order has been cancelled by user.").format(order_id=order.order_id))
+            self._env.event_bus.publish_event(Event(EVENT.ORDER_CANCELLATION_PASS, account=account, order=order))
+            self._open_orders.remove(fid)
+
+        elif ft_status == 4 or ft_status == 7:  # 4=已失效  	7=已删除
+            reason = _(u"Order Cancelled:  code = {order_book_id} ft_status = {ft_status} ").format(
+                order_book_id=order.order_book_id, ft_status=ft_status)
+            order.mark_rejected(reason)
+            self._env.event_bus.publish_event(Event(EVENT.ORDER_CREATION_REJECT, account=account, order=order))
+            self._open_orders.remove(fid)
+
+        # 2 = 部分成交 8 = 等待开盘 21= 本地已发送 22=本地已发送，服务器返回下单失败、没产生订单 23=本地已发送，等待服务器返回超时
+
+        self._journal_record('status_{}'.format(ft_status), order, fid)
+
+    def _on_deal_push(self, pd_data):
+        """成交推送线程中调用"""
+        with self._order_lock:
+            self._apply_deals(pd_data)
+
+    def _schedule_deal_check(self):
+        if self._deal_check_timer is None:
+            self._deal_check_timer = Timer(DEAL_WAIT_TIMEOUT, self._check_deferred_orders)
+            self._deal_check_timer.setDaemon(True)
+            self._deal_check_timer.start()
+
+    def _check_deferred_orders(self):
+        """查询一次成交列表补齐缺失的成交, 仍然没有记齐的订单不再等待, 按futu的状态终结"""
+        with self._order_lock:
+            self._deal_check_timer = None
+        self._check_deals()
+        with self._order_lock:
+            for fid, (ft_status, dealt_qty) in list(self._deferred.items()):
+                del self._deferred[fid]
+                order = self._open_orders.get_order(fid)
+                if order is not None:
+                    system_log.warn("{}: order {} deals missing, futu dealt {} local filled {}".format(
+                        self.__class__.__name__, fid, dealt_qty, order.filled_quantity))
+                    self._apply_order_status(fid, order, ft_status)
+
+    def _check_deals(self):
+        ret_code, pd_data = self._trade_context.deal_list_query(envtype=self._trade_envtype)
+        if ret_code != 0:
+            return
+        with self._order_lock:
+            self._apply_deals(pd_data)
+
+    def _apply_deals(self, pd_data):
+        """
+        用futu的成交数据(推送或查询结果)给本地未完成的订单记账, 每笔成交按 dealid 只记一次,
+        Trade 使用该笔成交的实际数量和价格
+        """
+        if len(pd_data) == 0 or len(self._open_orders) == 0:
+            return
+        deal_ids = pd_data['dealid'].astype(str).values
+        order_ids = pd_data['orderid'].astype(str).values
+        for i in np.flatnonzero(np.isin(order_ids, self._open_orders.futu_order_ids())):
+            fid = order_ids[i]
+            order = self._open_orders.get_order(fid)
+            if order is None or deal_ids[i] in self._deal_ids:
+                continue
+            self._deal_ids.add(deal_ids[i])
+            amount = min(int(pd_data['qty'].iloc[i]), order.unfilled_quantity)
+            if amount <= 0:
+                continue
+
+            account = self._get_account(order.order_book_id)
+            trade = Trade.__from_create__(
+                order_id=order.order_id,
+                price=float(pd_data['price'].iloc[i]),
+                amount=amount,
+                side=order.side,
+                position_effect=order.position_effect,
+                order_book_id=order.order_book_id,
+                frozen_price=order.frozen_price,
+                close_today_amount=0,  # 期货用的，期货分平当天的仓位和以前的仓位
+                commission=0.,
+                tax=0., trade_id=None
+            )
+            trade._commission = 0
+            trade._tax = 0
+            order.fill(trade)
+            self._env.event_bus.publish_event(Event(EVENT.TRADE, account=account, trade=trade, order=order))
+            self._journal_record('deal_{}'.format(deal_ids[i]), order, fid)
+            if fid in self._deferred and order.filled_quantity >= self._deferred[fid][1]:
+                # 等待成交的订单已经记齐, 按之前收到的终结状态终结
+                self._apply_order_status(fid, order, self._deferred.pop(fid)[0])
+            elif order.unfilled_quantity == 0:
+                self._open_orders.remove(fid)
+
+    def _journal_record(self, event, order, futu_order_id=None):
+        if self._journal is not None:
+            self._journal.record(event, order, futu_order_id)
+
+    def _restore_open_orders(self):
+        """
+        从订单日志恢复上次运行中未完成的订单, 按futu当前的订单状态对账
+        停机期间的成交已体现在初始化时同步的持仓中, 这里只校正订单的成交数量, 不再产生 TRADE 事件;
+        已经终结或不在当天订单列表中的订单直接丢弃, 其余的重新登记, 之后的变化照常更新;
+        这些订单已有的成交号一并登记, 避免推送重发时重复记账
+        """
+        restored = self._journal.replay()
+        if not restored:
+            return
+        ret_code, pd_data = self._trade_context.order_list_query(envtype=self._trade_envtype)
+        if ret_code != 0:
+            raise RuntimeError("_restore_open_orders fail: {}".format(pd_data))
+        remote = {}
+        for fid, status, dealt_qty in zip(pd_data['orderid'].astype(str), pd_data['status'].astype(int),
+                                          pd_data['dealt_qty'].astype(int)):
+            remote[fid] = (status, dealt_qty)
+
+        for futu_order_id, order in restored:
+            if futu_order_id not in remote or remote[futu_order_id][0] in FUTU_ORDER_FINAL_STATUS:
+                print("{}: drop journal order {} futu_order_id={}".format(self.__class__.__name__,
+                                                                         order.order_id, futu_order_id))
+                continue
+            dealt_qty = remote[futu_order_id][1]
+            if dealt_qty > order.filled_quantity:
+                state = order.get_state()
+                state['filled_quantity'] = dealt_qty
+                order.set_state(state)
+            self._open_orders.add(futu_order_id, order)
+            self._journal_record('restore', order, futu_order_id)
+
+        # 已经体现在成交数量中的成交, 之后收到推送时不再重复记账
+        ret_code, pd_data = self._trade_context.deal_list_query(envtype=self._trade_envtype)
+        if ret_code != 0:
+            raise RuntimeError("_restore_open_orders fail: {}".format(pd_data))
+        restored_ids = self._open_orders.futu_order_ids()
+        for deal_id, order_id in zip(pd_data['dealid'].astype(str), pd_data['orderid'].astype(str)):
+            if order_id in restored_ids:
+                self._deal_ids.add(deal_id)
+
+    def _freeze_restored_orders(self):
+        """
+        恢复的订单在帐户创建之前登记, 没有经过 ORDER_PENDING_NEW, 这里补上买单未成交部分冻结的资金,
+        之后的成交和撤单照常解冻; 卖单未成交部分的冻结量已经包含在同步的futu持仓中(qty - can_sell_qty)
+        """
+        account = self._portfolio.accounts[DEFAULT_ACCOUNT_TYPE.STOCK.name]
+        for order in self._open_orders.orders():
+            if order.side == SIDE.BUY:
+                account._frozen_cash += self._frozen_cash_of_order(account, order)
+
+    def _get_futu_positions(self, env):
+        StockPosition = env.get_position_model(DEFAULT_ACCOUNT_TYPE.STOCK.name)
+        positions = Positions(StockPosition)
+        ret, pd_data = self._trade_context.position_list_query(envtype=self._trade_envtype)
+        if ret != 0:
+            return None
+        for i in range(len(pd_data)):
+            row = pd_data.iloc[i]
+            code_str = str(row['code'])
+            pos_state = {}
+            pos_state['order_book_id'] = code_str
+            pos_state['quantity'] = int(row['qty'])
+            pos_state['avg_price'] = float(row['cost_price'])
+            pos_state['non_closable'] = 0
+            pos_state['frozen'] = int(row['qty']) - int(row['can_sell_qty'])
+            pos_state['transaction_cost'] = 0
+            item = positions.get_or_create(code_str)
+            item.set_state(pos_state)
+        return positions
+
+    def _init_portfolio(self):
+        accounts = {}
+        config = self._env.config
+        start_date = config.base.start_date
+        total_cash = 0
+        for account_type, stock_starting_cash in six.iteritems(config.base.accounts):
+            if account_type == DEFAULT_ACCOUNT_TYPE.STOCK.name:
+                # stock_starting_cash = config.base.accounts
+                if stock_starting_cash == 0:
+                    raise RuntimeError(_(u"stock starting cash can not be 0, using `--stock-starting-cash 1000`"))
+                all_positons = self._get_futu_positions(self._env)
+                if all_positons is None:
+                    raise RuntimeError("_init_portfolio fail")
+                StockAccount = self._env.get_account_model(DEFAULT_ACCOUNT_TYPE.STOCK.name)
+                accounts[DEFAULT_ACCOUNT_TYPE.STOCK.name] = StockAccount(stock_starting_cash, all_positons)
+                total_cash += stock_starting_cash
+            else:
+                raise NotImplementedError
+
+        return Portfolio(start_date, 1, total_cash, accounts)
+
+    def _get_account(self, order_book_id):
+        # account = self._env.get_account(order_book_id)
+        # for debug
+        account = self._env.portfolio.accounts[DEFAULT_ACCOUNT_TYPE.STOCK.name]
+        return account
+
+    def get_position_reconcile_metrics(self):
+        """持仓对账的偏差统计, 见 FUTUPositionReconciler.get_metrics"""
+        return self._position_reconciler.get_metrics()
+
+    def _thread_position_check(self):
+        """持仓对账在后台线程中进行, 不占用策略线程"""
+        while True:
+            sleep(self._mod_config.futu_position_reconcile_interval)
+            if self._portfolio is None:
+                continue
+            positions = self._portfolio.accounts[DEFAULT_ACCOUNT_TYPE.STOCK.name].positions
+            skip_ids = set(order.order_book_id for order in self.get_open_orders())
+            self._position_reconciler.reconcile(positions, skip_ids)
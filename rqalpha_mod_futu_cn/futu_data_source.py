@@ -17,15 +17,25 @@
 
 
 from .futu_utils import *
+from .futu_data_store import KlineStore, InstrumentStore, TickStore, KLINE_DTYPE, frame_to_kline_array, \
+    time_key_to_int, merge_tick_streams, tick_to_dict
+from .futu_tick_recorder import TickRecorder, TickerRecordHandler, OrderBookRecordHandler
+from .futu_request_scheduler import FUTURequestScheduler
 
 from rqalpha.interface import AbstractDataSource
 from rqalpha.model.instrument import Instrument
+from rqalpha.model.snapshot import SnapshotObject
+from rqalpha.model.tick import Tick
 from rqalpha.environment import Environment
 from rqalpha.events import EVENT
 from rqalpha.utils.i18n import gettext as _
 
 from futuquant.open_context import CurKlineHandlerBase
+from collections import OrderedDict
+from functools import partial
+from six.moves.queue import Queue, Full
 from datetime import date, timedelta, datetime
+import numpy as np
 import pandas as pd
 import time
 import six
@@ -33,16 +43,57 @@ import six
 RET_OK = 0
 RET_ERROR = -1
 
+# 每次请求快照的最大股票数
+SNAPSHOT_MAX_CODES = 200
+
+# rqalpha 的分钟周期与futu K线类型的对应关系
+MINUTE_KTYPES = {'1m': 'K_1M', '5m': 'K_5M', '15m': 'K_15M', '60m': 'K_60M'}
+# 分钟K线按天分块, 某天缺失时一次请求到该天为止的 MINUTE_FETCH_DAYS 个自然日, 再拆成按天的块
+MINUTE_FETCH_DAYS = 10
+# 往前逐天凑分钟K线时每天至少的bar数(按A股每天4小时计), 用来估算最多往前找多少天, 另加覆盖长假的自然日
+MINUTE_BARS_PER_DAY = {'K_1M': 240, 'K_5M': 48, 'K_15M': 16, 'K_60M': 4}
+MINUTE_WALK_BACK_MARGIN = 30
+# 连续这么多个工作日没有分钟K线(长期停牌或已退市)时不再往前找
+MINUTE_MAX_EMPTY_DAYS = 20
+# 当天盘中的分钟K线不落盘, 在内存中缓存的有效期(秒)
+CUR_MINUTE_TTL = 3
+
+# 各市场需要拉取的futu证券类型, 及其对应的rqalpha Instrument.type, None 表示沿用futu返回的类型
+BASICINFO_STOCK_TYPES = {
+    "CN": [("STOCK", "CS"), ("IDX", "INDX"), ("ETF", None), ("WARRANT", "CS"), ("BOND", None)],
+    "HK": [("STOCK", "CS"), ("IDX", "INDX"), ("ETF", None), ("WARRANT", "CS"), ("BOND", None)],
+    "US": [("STOCK", "CS"), ("IDX", "INDX"), ("ETF", None)],
+}
+
 
 class FUTUDataSource(AbstractDataSource):
-    def __init__(self, env, quote_context, data_cache):
+    def __init__(self, env, mod_config, quote_context, data_cache):
         self._env = env
+        self._mod_config = mod_config
         self._quote_context = quote_context
         # 订阅，得到cache的时候，订阅，拉历史，得到当前数据，push动态更新，去重
         self._quote_context.subscribe(stock_code=self._env.config.base.benchmark, data_type='K_DAY', push=False)
         self._cache = data_cache._cache
         self._today = None
         self._data_cache = data_cache
+        self._kline_store = None
+        self._instrument_store = None
+        self._tick_store = None
+        if self._mod_config.futu_data_store:
+            self._kline_store = KlineStore(self._mod_config.futu_data_store)
+            self._instrument_store = InstrumentStore(self._mod_config.futu_data_store)
+            self._tick_store = TickStore(self._mod_config.futu_data_store)
+        self._tick_record = bool(self._mod_config.futu_tick_record) and self._tick_store is not None \
+            and IsRuntype_RealtimeStrategy()
+        self._tick_replay_date = None
+        self._tick_replay_pos = {}  # 回放当天各股票下一条要产出的tick位置, 股票池变化后从这里继续
+        if self._tick_record:
+            recorder = TickRecorder(self._tick_store)
+            self._quote_context.set_handler(TickerRecordHandler(recorder))
+            self._quote_context.set_handler(OrderBookRecordHandler(recorder))
+        self._incremental_sync = self._mod_config.futu_history_sync == "incremental"
+        self._scheduler = FUTURequestScheduler(self._mod_config.futu_request_quota, self._mod_config.futu_request_workers)
+        self._register_event()
 
     def get_all_instruments(self):
         """
@@ -50,210 +101,71 @@ class FUTUDataSource(AbstractDataSource):
         :return: list[:class:`~Instrument`]
         """
         if IsFutuMarket_CNStock() is True:
-            if self._cache['basicinfo_cn'] is None:
-                ret_code, ret_data = self._get_cn_cache()
-            else:
-                ret_code, ret_data = 0, self._cache['basicinfo_cn']
-
-        if IsFutuMarket_HKStock() is True:
-            if self._cache['basicinfo_hk'] is None:
-                ret_code, ret_data = self._get_hk_cache()
-            else:
-                ret_code, ret_data = 0, self._cache['basicinfo_hk']
-
+            ret_code, ret_data = self._get_instrument_cache("CN")
+        elif IsFutuMarket_HKStock() is True:
+            ret_code, ret_data = self._get_instrument_cache("HK")
         elif IsFutuMarket_USStock() is True:
-            if self._cache['basicinfo_us'] is None:
-                ret_code, ret_data_cs = self._get_us_cache()
-            else:
-                ret_code, ret_data = 0, self._cache['basicinfo_us']
+            ret_code, ret_data = self._get_instrument_cache("US")
         else:
             raise ValueError
 
-        if ret_code == RET_ERROR or ret_data is None:
+        if ret_data is None:
             raise NotImplementedError
 
         all_instruments = [Instrument(i) for i in ret_data]
         return all_instruments
 
-    def _get_cn_cache(self):
-        for i in range(3):
-            ret_code, ret_data_cs = self._quote_context.get_stock_basicinfo(market="CN", stock_type="STOCK")
-            if ret_code != RET_ERROR and ret_data_cs is not None:
-                break
-            else:
-                time.sleep(0.1)
-        if ret_code == RET_ERROR or ret_data_cs is None:
-            print("get instrument cache error")
-        else:
-            ret_data_cs.at[ret_data_cs.index, 'stock_type'] = 'CS'
-
-        for i in range(3):
-            ret_code, ret_data_idx = self._quote_context.get_stock_basicinfo("CN", "IDX")
-            if ret_code != RET_ERROR and ret_data_idx is not None:
-                break
-            else:
-                time.sleep(0.1)
-        if ret_code == RET_ERROR or ret_data_idx is None:
-            print("get instrument cache error")
-        else:
-            ret_data_idx.at[ret_data_idx.index, 'stock_type'] = 'INDX'
-
-        for i in range(3):
-            ret_code, ret_data_etf = self._quote_context.get_stock_basicinfo("CN", "ETF")
-            if ret_code != RET_ERROR and ret_data_etf is not None:
-                break
-            else:
-                time.sleep(0.1)
-        if ret_code == RET_ERROR or ret_data_etf is None:
-            print("get instrument cache error")
-
-        for i in range(3):
-            ret_code, ret_data_war = self._quote_context.get_stock_basicinfo("CN", "WARRANT")
-            if ret_code != RET_ERROR and ret_data_war is not None:
-                break
-            else:
-                time.sleep(0.1)
-        if ret_code == RET_ERROR or ret_data_war is None:
-            print("get instrument cache error")
-        else:
-            ret_data_war.at[ret_data_war.index, 'stock_type'] = 'CS'
-
-        for i in range(3):
-            ret_code, ret_data_bond = self._quote_context.get_stock_basicinfo("CN", "BOND")
-            if ret_code != RET_ERROR and ret_data_bond is not None:
-                break
-            else:
-                time.sleep(0.1)
-        if ret_code == RET_ERROR or ret_data_bond is None:
-            print("get instrument cache error")
-
-        frames = [ret_data_cs, ret_data_idx, ret_data_etf, ret_data_war, ret_data_bond]
-        ret_data = pd.concat(frames).reset_index(drop=True)
-
-        del ret_data['stock_child_type'], ret_data['owner_stock_code']  # 删除多余的列
-        ret_data.reset_index(drop=True)
-
-        ret_data['de_listed_date'] = str("2999-12-31")  # 增加一列退市日期
-
-        ret_data.rename(columns={'code': 'order_book_id', 'name': 'symbol', 'stock_type': 'type', 'listing_date':
-                        'listed_date', 'lot_size': 'round_lot'}, inplace=True)  # 修改列名
-        ret_data = ret_data.to_dict(orient='records')  # 转置并转为字典格式
-        self._cache['basicinfo_hk'] = ret_data
-
-        return ret_code, ret_data
-
-
-    def _get_hk_cache(self):
-        for i in range(3):
-            ret_code, ret_data_cs = self._quote_context.get_stock_basicinfo(market="HK", stock_type="STOCK")
-            if ret_code != RET_ERROR and ret_data_cs is not None:
-                break
-            else:
-                time.sleep(0.1)
-        if ret_code == RET_ERROR or ret_data_cs is None:
-            print("get instrument cache error")
-        else:
-            ret_data_cs.at[ret_data_cs.index, 'stock_type'] = 'CS'
-
-        for i in range(3):
-            ret_code, ret_data_idx = self._quote_context.get_stock_basicinfo("HK", "IDX")
-            if ret_code != RET_ERROR and ret_data_idx is not None:
-                break
-            else:
-                time.sleep(0.1)
-        if ret_code == RET_ERROR or ret_data_idx is None:
-            print("get instrument cache error")
-        else:
-            ret_data_idx.at[ret_data_idx.index, 'stock_type'] = 'INDX'
-
-        for i in range(3):
-            ret_code, ret_data_etf = self._quote_context.get_stock_basicinfo("HK", "ETF")
-            if ret_code != RET_ERROR and ret_data_etf is not None:
-                break
-            else:
-                time.sleep(0.1)
-        if ret_code == RET_ERROR or ret_data_etf is None:
-            print("get instrument cache error")
-
-        for i in range(3):
-            ret_code, ret_data_war = self._quote_context.get_stock_basicinfo("HK", "WARRANT")
-            if ret_code != RET_ERROR and ret_data_war is not None:
-                break
-            else:
-                time.sleep(0.1)
-        if ret_code == RET_ERROR or ret_data_war is None:
-            print("get instrument cache error")
-        else:
-            ret_data_war.at[ret_data_war.index, 'stock_type'] = 'CS'
-
-        for i in range(3):
-            ret_code, ret_data_bond = self._quote_context.get_stock_basicinfo("HK", "BOND")
-            if ret_code != RET_ERROR and ret_data_bond is not None:
-                break
-            else:
-                time.sleep(0.1)
-        if ret_code == RET_ERROR or ret_data_bond is None:
-            print("get instrument cache error")
-
-        frames = [ret_data_cs, ret_data_idx, ret_data_etf, ret_data_war, ret_data_bond]
-        ret_data = pd.concat(frames).reset_index(drop=True)
-
-        del ret_data['stock_child_type'], ret_data['owner_stock_code']  # 删除多余的列
-        ret_data.reset_index(drop=True)
-
-        ret_data['de_listed_date'] = str("2999-12-31")  # 增加一列退市日期
-
-        ret_data.rename(columns={'code': 'order_book_id', 'name': 'symbol', 'stock_type': 'type', 'listing_date':
-                        'listed_date', 'lot_size': 'round_lot'}, inplace=True)  # 修改列名
-        ret_data = ret_data.to_dict(orient='records')  # 转置并转为字典格式
-        self._cache['basicinfo_hk'] = ret_data
-
+    def _get_instrument_cache(self, market):
+        """优先使用本地未过期的股票列表, 没有或已过期时再从futu拉取并落盘"""
+        cache_key = 'basicinfo_' + market.lower()
+        if self._cache[cache_key] is not None:
+            return RET_OK, self._cache[cache_key]
+
+        if self._instrument_store is not None:
+            ret_data = self._instrument_store.load(market, getattr(self._mod_config.futu_instrument_ttl, market))
+            if ret_data is not None:
+                self._cache[cache_key] = ret_data
+                return RET_OK, ret_data
+
+        ret_code, ret_data = self._get_basicinfo_cache(market)
+        if ret_code != RET_ERROR and self._instrument_store is not None:  # 有证券类型拉取失败的不落盘
+            self._instrument_store.save(market, ret_data)
         return ret_code, ret_data
 
-    def _get_us_cache(self):
-        for i in range(3):
-            ret_code, ret_data_cs = self._quote_context.get_stock_basicinfo(market="US", stock_type="STOCK")
-            if ret_code != RET_ERROR and ret_data_cs is not None:
-                break
-            else:
-                time.sleep(0.1)
-        if ret_code == RET_ERROR or ret_data_cs is None:
-            print("get instrument cache error")
-        else:
-            ret_data_cs.at[ret_data_cs.index, 'stock_type'] = 'CS'
-
-        for i in range(3):
-            ret_code, ret_data_idx = self._quote_context.get_stock_basicinfo("US", "IDX")
-            if ret_code != RET_ERROR and ret_data_idx is not None:
-                break
-            else:
-                time.sleep(0.1)
-        if ret_code == RET_ERROR or ret_data_idx is None:
-            print("get instrument cache error")
-        else:
-            ret_data_idx.at[ret_data_idx.index, 'stock_type'] = 'INDX'
-
-        for i in range(3):
-            ret_code, ret_data_etf = self._quote_context.get_stock_basicinfo("US", "ETF")
-            if ret_code != RET_ERROR and ret_data_etf is not None:
-                break
-            else:
-                time.sleep(0.1)
-        if ret_code == RET_ERROR or ret_data_etf is None:
-            print("get instrument cache error")
+    def _get_basicinfo_cache(self, market):
+        """
+        拉取一个市场的全部股票列表: 各证券类型的请求并发发出, 全部返回后一次合并
+        :return: (ret, data) 有证券类型拉取失败时 ret 为 RET_ERROR, data 为其余类型合并的结果
+        """
+        futures = [(stock_type, rq_type, self._scheduler.submit('get_stock_basicinfo',
+                                                                self._quote_context.get_stock_basicinfo,
+                                                                market, stock_type))
+                   for stock_type, rq_type in BASICINFO_STOCK_TYPES[market]]
+
+        ret_code = RET_OK
+        frames = []
+        for stock_type, rq_type, future in futures:
+            ret, ret_data = future.result()
+            if ret == RET_ERROR or ret_data is None or isinstance(ret_data, str):
+                print("get instrument cache error:{} {}".format(stock_type, ret_data))
+                ret_code = RET_ERROR
+                continue
+            if rq_type is not None:
+                ret_data['stock_type'] = rq_type
+            frames.append(ret_data)
+        if not frames:
+            return RET_ERROR, None
 
-        frames = [ret_data_cs, ret_data_idx, ret_data_etf]
         ret_data = pd.concat(frames).reset_index(drop=True)
 
         del ret_data['stock_child_type'], ret_data['owner_stock_code']  # 删除多余的列
-        ret_data.reset_index(drop=True)
 
         ret_data['de_listed_date'] = str("2999-12-31")  # 增加一列退市日期
 
         ret_data.rename(columns={'code': 'order_book_id', 'name': 'symbol', 'stock_type': 'type', 'listing_date':
                         'listed_date', 'lot_size': 'round_lot'}, inplace=True)  # 修改列名
         ret_data = ret_data.to_dict(orient='records')  # 转置并转为字典格式
-        self._cache['basicinfo_us'] = ret_data
+        self._cache['basicinfo_' + market.lower()] = ret_data
 
         return ret_code, ret_data
 
@@ -271,48 +183,45 @@ class FUTUDataSource(AbstractDataSource):
 
         :return: `numpy.ndarray` | `dict`
         """
-        if frequency != '1d':
-            raise NotImplementedError
         if dt is None:
             dt = datetime.now()
+        if frequency in MINUTE_KTYPES:
+            ret_code, bar_data = self._get_minute_chunk(instrument, MINUTE_KTYPES[frequency], dt.date())
+            if ret_code == RET_ERROR:
+                raise NotImplementedError
+            pos = bar_data['datetime'].searchsorted(int(dt.strftime("%Y%m%d%H%M%S")), side='right')
+            if pos == 0:
+                return None
+            return bar_data[pos - 1]
+        if frequency != '1d':
+            raise NotImplementedError
 
         current_time = time.strftime("%Y%m%d", time.localtime())
         dt_time = dt.strftime("%Y%m%d")
 
         if dt_time == current_time:  # 判断时间是否是当天，每天都是要清空缓存，所以要先获取历史
-            if self._cache['history_kline'] is None or instrument.order_book_id not in self._cache['history_kline'].keys():
+            if instrument.order_book_id not in self._cache['history_kline']:
                 ret_code, bar_data = self._get_cur_cache(instrument)
             else:
                 ret_code, bar_data = 0, self._cache['history_kline'][instrument.order_book_id]
         elif dt_time != current_time:
-            if self._cache['history_kline'] is None or instrument.order_book_id not in self._cache['history_kline'].keys():
-                ret_code, bar_data = self._get_history_cache(instrument)
-            else:
-                ret_code, bar_data = 0, self._cache['history_kline'][instrument.order_book_id]
+            ret_code, bar_data = self._get_history_data(instrument)
 
         if ret_code == RET_ERROR or bar_data is None:
             raise NotImplementedError
 
-        ret_dict = bar_data[bar_data.datetime <= int(dt_time + "000000")].iloc[0].to_dict()
-
-        return ret_dict
+        # bar_data 为按时间升序排列的结构化数组, 二分查找 dt 当天及之前的最后一条
+        pos = bar_data['datetime'].searchsorted(int(dt_time + "235959"), side='right')
+        if pos == 0:
+            return None
+        return bar_data[pos - 1]
 
     def _fill_cur_kline_cache_data(self, instrument):
         order_book_id = instrument.order_book_id
-        for x in range(3):
-            ret_code, ret_data = self._quote_context.get_cur_kline(order_book_id, 1, 'K_DAY')
-            if ret_code == 0 and len(ret_data) >= 1:
-                bar_data = ret_data.iloc[-1:].copy()
-                # 时间转换
-                for i in range(len(bar_data['time_key'])):  # 时间转换
-                    bar_data.loc[i, 'time_key'] = int(
-                        bar_data['time_key'][i].replace('-', '').replace(' ', '').replace(':', ''))
-
-                bar_data.rename(columns={'time_key': 'datetime', 'turnover': 'total_turnover'},
-                                inplace=True)  # 将字段名称改为一致的
-                bar_data['volume'] = bar_data['volume'].astype('float64')  # 把成交量的数据类型转为float
-                self._cache['cur_kline'][order_book_id] = bar_data
-                break
+        ret_code, ret_data = self._scheduler.call('get_cur_kline', self._quote_context.get_cur_kline,
+                                                  order_book_id, 1, 'K_DAY')
+        if ret_code == 0 and len(ret_data) >= 1:
+            self._cache['cur_kline'][order_book_id] = frame_to_kline_array(ret_data.iloc[-1:])
 
     def _get_cur_cache(self, instrument):
         ret_code = 0
@@ -330,41 +239,319 @@ class FUTUDataSource(AbstractDataSource):
             return ret_code, self._cache['cur_kline'][instrument.order_book_id]
         return ret_code, self._cache['cur_kline'][instrument.order_book_id]
 
-    def _get_history_cache(self, instrument):
+    def _get_history_data(self, instrument):
+        """取日K历史缓存: 没有缓存时拉取, 增量模式下每天第一次访问时补齐尾部"""
+        order_book_id = instrument.order_book_id
+        if order_book_id not in self._cache['history_kline']:
+            return self._get_history_cache(instrument)
+        if self._incremental_sync and self._cache['history_kline_synced'].get(order_book_id) != date.today():
+            return self._sync_history_tail(instrument)
+        return RET_OK, self._cache['history_kline'][order_book_id]
+
+    def _get_history_cache(self, instrument, use_store=True):
+        order_book_id = instrument.order_book_id
+
+        # 增量模式下先读本地存储, 只补拉缺失的尾部
+        if use_store and self._incremental_sync:
+            stored_data = self._load_history_store(order_book_id)
+            if stored_data is not None:
+                self._set_history_data(order_book_id, stored_data)
+                return self._sync_history_tail(instrument)
+
+        # 按年切分 [上市日期, 今年年底], 各年的请求并发发出
         end_date = date.today().replace(month=12, day=31)
         last_year = timedelta(days=365)
-        bar_data = pd.DataFrame()
-        if self._cache['history_kline'] is None:
-            self._cache['history_kline'] = {}
-        self._cache['history_kline'][instrument.order_book_id] = pd.DataFrame()
-        while bar_data is not None:
+        listed_date = max(instrument.listed_date.date(), self.available_data_range('1d')[0])
+        futures = []
+        while end_date >= listed_date:
             begin_date = end_date - last_year
-            for i in range(3):
-                ret_code, bar_data = self._quote_context.get_history_kline(instrument.order_book_id,
-                                                                           start=begin_date.strftime('%Y-%m-%d'),
-                                                                           end=end_date.strftime('%Y-%m-%d'),
-                                                                           ktype='K_DAY')
-                if ret_code != RET_ERROR:
-                    break
-                else:
-                    time.sleep(0.1)
-            if ret_code == RET_ERROR or isinstance(bar_data, str):
-                print("get history kline error")
-
-            if bar_data.empty:
-                return ret_code, self._cache['history_kline'][instrument.order_book_id]
+            futures.append(self._scheduler.submit('get_history_kline', self._request_history_kline,
+                                                  order_book_id, begin_date, end_date))
             end_date = begin_date
 
-            # 对数据做处理先做处理再存
-            del bar_data['code']  # 去掉code
-            for i in range(len(bar_data)):  # 时间转换
-                bar_data.loc[i, 'time_key'] = int(
-                    bar_data['time_key'][i].replace('-', '').replace(' ', '').replace(':', ''))
-            bar_data['volume'] = bar_data['volume'].astype('float64')    # 把成交量的数据类型转为float
-            bar_data.rename(columns={'time_key': 'datetime', 'turnover': 'total_turnover'}, inplace=True)  # 将字段名称改为一致的
-            bar_data = bar_data[::-1]
-
-            self._cache['history_kline'][instrument.order_book_id] = self._cache['history_kline'][instrument.order_book_id].append(bar_data)
+        ret_code = RET_OK
+        frames = []
+        for future in futures:
+            ret, bar_data = future.result()
+            if ret == RET_ERROR:
+                print("get history kline error:{}".format(bar_data))
+                ret_code = RET_ERROR
+            elif len(bar_data) > 0:
+                frames.append(bar_data)
+
+        if not frames:
+            return ret_code, None
+        # 按年拉取的区间首尾相接, 边界那天会重复, np.unique 去重的同时按时间排好序
+        history_data = np.concatenate(frames)
+        history_data = history_data[np.unique(history_data['datetime'], return_index=True)[1]]
+        self._set_history_data(order_book_id, history_data)
+        if ret_code != RET_ERROR:  # 中途出错的不完整历史不落盘
+            self._cache['history_kline_synced'][order_book_id] = date.today()
+            self._save_history_store(order_book_id, history_data)
+        return RET_OK, history_data
+
+    def _sync_history_tail(self, instrument):
+        """
+        增量同步: 只请求 [最后一条已收盘数据, 今天] 一段日K, 合并进已有缓存
+        重叠的那一条用来校验复权价格是否变化, 变化了就重新全量拉取
+        """
+        order_book_id = instrument.order_book_id
+        history_data = self._cache['history_kline'][order_book_id]
+        last_dt = self._cache['history_kline_last'].get(order_book_id)
+        if last_dt is None:
+            return self._get_history_cache(instrument, use_store=False)
+        today = date.today()
+
+        ret_code, bar_data = self._scheduler.call('get_history_kline', self._request_history_kline, order_book_id,
+                                                  datetime.strptime(str(last_dt)[:8], '%Y%m%d').date(), today)
+        if ret_code == RET_ERROR:
+            print("get history kline error:{}".format(bar_data))
+            return RET_OK, history_data  # 同步失败先用已有数据, 下次访问再重试
+
+        if not self._merge_history_tail(order_book_id, bar_data):
+            self._drop_minute_history(order_book_id)
+            return self._get_history_cache(instrument, use_store=False)
+        return RET_OK, self._cache['history_kline'][order_book_id]
+
+    def _merge_history_tail(self, order_book_id, bar_data):
+        """
+        把从最后一条已收盘数据开始的日K合并进缓存
+        :return: 复权价格发生变化时返回 False, 需要重新全量拉取
+        """
+        history_data = self._cache['history_kline'][order_book_id]
+        last_dt = self._cache['history_kline_last'][order_book_id]
+        new_pos = bar_data['datetime'].searchsorted(last_dt, side='right')
+        last_pos = history_data['datetime'].searchsorted(last_dt, side='right')
+        if new_pos > 0 and bar_data['datetime'][new_pos - 1] == last_dt \
+                and bar_data['close'][new_pos - 1] != history_data['close'][last_pos - 1]:
+            return False
+
+        new_data = bar_data[new_pos:]
+        if len(new_data) > 0:
+            # 当天盘中的bar也会被新数据替换掉
+            history_data = np.concatenate([history_data[:last_pos], new_data])
+            self._set_history_data(order_book_id, history_data)
+            self._save_history_store(order_book_id, history_data)
+        self._cache['history_kline_synced'][order_book_id] = date.today()
+        return True
+
+    def _set_history_data(self, order_book_id, history_data):
+        """更新缓存, 同时记录最后一条已收盘数据的时间, 作为下次增量同步的起点"""
+        self._cache['history_kline'][order_book_id] = history_data
+        today_dt = int(date.today().strftime('%Y%m%d') + '000000')
+        closed_pos = history_data['datetime'].searchsorted(today_dt)
+        if closed_pos == 0:
+            self._cache['history_kline_last'].pop(order_book_id, None)
+        else:
+            self._cache['history_kline_last'][order_book_id] = int(history_data['datetime'][closed_pos - 1])
+
+    def _request_history_kline(self, order_book_id, start, end, ktype='K_DAY'):
+        """请求 [start, end] 的K线, 转为按时间升序排列的结构化数组; 通过 self._scheduler 限频调用"""
+        ret_code, bar_data = self._quote_context.get_history_kline(order_book_id,
+                                                                   start=start.strftime('%Y-%m-%d'),
+                                                                   end=end.strftime('%Y-%m-%d'),
+                                                                   ktype=ktype)
+        if ret_code == RET_ERROR or isinstance(bar_data, str):
+            return RET_ERROR, bar_data
+        return RET_OK, frame_to_kline_array(bar_data)
+
+    def _load_history_store(self, order_book_id):
+        """读取本地存储的日K, 直接使用 mmap 的结构化数组"""
+        if self._kline_store is None:
+            return None
+        stored = self._kline_store.load(order_book_id, 'K_DAY', 'qfq')
+        if stored is None or len(stored) == 0:
+            return None
+        return stored
+
+    def _save_history_store(self, order_book_id, history_data):
+        """只落盘已经收盘的交易日, 当天盘中的bar还会变化"""
+        if self._kline_store is None:
+            return
+        today_dt = int(date.today().strftime('%Y%m%d') + '000000')
+        closed_pos = history_data['datetime'].searchsorted(today_dt)
+        self._kline_store.save(order_book_id, 'K_DAY', 'qfq', history_data[:closed_pos])
+
+    def _get_minute_chunk(self, instrument, ktype, day):
+        """
+        取一只股票某一天的分钟K线块: 内存 -> 本地存储 -> 从futu拉取
+        缺失时一次请求到该天为止的 MINUTE_FETCH_DAYS 个自然日, 拆成按天的块分别缓存和落盘
+        """
+        order_book_id = instrument.order_book_id
+        if day.weekday() >= 5 or day < instrument.listed_date.date():
+            return RET_OK, np.empty(0, dtype=KLINE_DTYPE)
+        if day >= date.today():
+            return self._get_cur_minute_chunk(order_book_id, ktype)
+
+        key = (order_book_id, ktype, day)
+        if key in self._cache['minute_kline']:
+            return RET_OK, self._cache['minute_kline'][key]
+        if self._kline_store is not None:
+            chunk = self._kline_store.load_day(order_book_id, ktype, 'qfq', day)
+            if chunk is not None:
+                self._cache['minute_kline'][key] = chunk
+                return RET_OK, chunk
+
+        start = max(day - timedelta(days=MINUTE_FETCH_DAYS - 1), instrument.listed_date.date())
+        ret_code, bar_data = self._scheduler.call('get_history_kline', self._request_history_kline,
+                                                  order_book_id, start, day, ktype)
+        if ret_code == RET_ERROR:
+            print("get minute kline error:{}".format(bar_data))
+            return ret_code, bar_data
+
+        # 按天拆分, 节假日或停牌没有数据的工作日也存一个空块, 避免重复请求; 最后写入的是 day 当天, 不会被LRU淘汰
+        day_keys = bar_data['datetime'] // 1000000
+        chunk_day = start
+        while chunk_day <= day:
+            chunk_key = (order_book_id, ktype, chunk_day)
+            if chunk_day.weekday() < 5 and (chunk_key not in self._cache['minute_kline'] or chunk_day == day):
+                day_int = int(chunk_day.strftime('%Y%m%d'))
+                chunk = bar_data[day_keys.searchsorted(day_int):day_keys.searchsorted(day_int, side='right')].copy()
+                self._cache['minute_kline'][chunk_key] = chunk
+                if self._kline_store is not None:
+                    self._kline_store.save_day(order_book_id, ktype, 'qfq', chunk_day, chunk)
+            chunk_day += timedelta(days=1)
+        return RET_OK, self._cache['minute_kline'][key]
+
+    def _get_cur_minute_chunk(self, order_book_id, ktype):
+        """当天的分钟K线盘中还在变化, 不落盘, 在内存中缓存 CUR_MINUTE_TTL 秒"""
+        cached = self._cache['minute_kline_today'].get((order_book_id, ktype))
+        if cached is not None and time.time() - cached[0] <= CUR_MINUTE_TTL:
+            return RET_OK, cached[1]
+
+        today = date.today()
+        ret_code, bar_data = self._scheduler.call('get_history_kline', self._request_history_kline,
+                                                  order_book_id, today, today, ktype)
+        if ret_code == RET_ERROR:
+            print("get minute kline error:{}".format(bar_data))
+            return ret_code, bar_data
+        self._cache['minute_kline_today'][(order_book_id, ktype)] = (time.time(), bar_data)
+        return RET_OK, bar_data
+
+    def _get_minute_bars(self, instrument, ktype, dt, bar_count):
+        """
+        从 dt 当天往前逐天取分钟K线块, 凑够 bar_count 条为止, 只加载用到的那几天
+        往前找的天数按 MINUTE_BARS_PER_DAY 估算出上限, 连续 MINUTE_MAX_EMPTY_DAYS 个工作日没有数据时提前结束
+        """
+        datetime_dt = int(dt.strftime("%Y%m%d%H%M%S"))
+        max_days = bar_count // MINUTE_BARS_PER_DAY[ktype] + 1
+        earliest = max(instrument.listed_date.date(), self.available_data_range('1m')[0],
+                       dt.date() - timedelta(days=max_days * 7 // 5 + MINUTE_WALK_BACK_MARGIN))
+        chunks = []
+        count = 0
+        empty_days = 0
+        day = dt.date()
+        while count < bar_count and day >= earliest and empty_days < MINUTE_MAX_EMPTY_DAYS:
+            ret_code, chunk = self._get_minute_chunk(instrument, ktype, day)
+            if ret_code == RET_ERROR:
+                return ret_code, chunk
+            if day == dt.date():
+                chunk = chunk[:chunk['datetime'].searchsorted(datetime_dt, side='right')]
+            if day.weekday() < 5:
+                empty_days = 0 if len(chunk) > 0 else empty_days + 1
+            chunks.append(chunk)
+            count += len(chunk)
+            day -= timedelta(days=1)
+
+        if not chunks:
+            return RET_OK, np.empty(0, dtype=KLINE_DTYPE)
+        bar_data = np.concatenate(chunks[::-1])
+        return RET_OK, bar_data[max(len(bar_data) - bar_count, 0):]
+
+    def _drop_minute_history(self, order_book_id):
+        """日K发现复权价格变化时, 已缓存和落盘的分钟K线也一起作废"""
+        for key in [k for k in self._cache['minute_kline'] if k[0] == order_book_id]:
+            self._cache['minute_kline'].pop(key)
+        if self._kline_store is not None:
+            self._kline_store.remove_days(order_book_id)
+
+    def prefetch_history(self, order_book_ids):
+        """
+        批量预取日K: 用多股票多时间点的K线接口一次请求多只股票, 代替逐只按年拉取
+        已同步过的股票跳过, 有缓存或本地存储的股票只补拉尾部; 失败的股票留给 history_bars 按需拉取
+        """
+        today = date.today()
+
+        # 按起始日期分组, 有本地数据的从最后一条已收盘数据开始, 没有的从数据源最早日期开始
+        groups = {}
+        tail_codes = set()  # 只请求了尾部的股票, 结果只能合并进已有历史, 不能单独落盘
+        for order_book_id in set(order_book_ids):
+            if self._cache['history_kline_synced'].get(order_book_id) == today:
+                continue
+            if order_book_id not in self._cache['history_kline'] and self._incremental_sync:
+                stored_data = self._load_history_store(order_book_id)
+                if stored_data is not None:
+                    self._set_history_data(order_book_id, stored_data)
+            if order_book_id in self._cache['history_kline'] and not self._incremental_sync:
+                continue
+            last_dt = self._cache['history_kline_last'].get(order_book_id)
+            if order_book_id in self._cache['history_kline'] and last_dt is not None:
+                begin_date = datetime.strptime(str(last_dt)[:8], '%Y%m%d').date()
+                tail_codes.add(order_book_id)
+            else:
+                self._cache['history_kline'].pop(order_book_id, None)
+                begin_date = self.available_data_range('1d')[0]
+            groups.setdefault((order_book_id.split('.')[0], begin_date), []).append(order_book_id)
+
+        # 各组并发请求, 结果回到当前线程再合并进缓存
+        futures = [self._scheduler.run(self._request_multi_points_kline, market, begin_date, today, codes)
+                   for (market, begin_date), codes in six.iteritems(groups)]
+        for future in futures:
+            ret_code, kline_data = future.result()
+            if ret_code == RET_ERROR:
+                print("prefetch history kline error:{}".format(kline_data))
+                continue
+
+            kline_data = kline_data[kline_data['data_valid'] != 0]  # 停牌或未上市的时间点没有数据
+            for order_book_id, code_data in kline_data.groupby('code'):
+                bar_data = frame_to_kline_array(code_data)
+                if order_book_id in tail_codes and order_book_id not in self._cache['history_kline']:
+                    # 合并前面的结果时被LRU淘汰了, 重新读取本地存储再合并尾部
+                    stored_data = self._load_history_store(order_book_id) if self._incremental_sync else None
+                    if stored_data is None:
+                        continue  # 留给 history_bars 按需拉取
+                    self._set_history_data(order_book_id, stored_data)
+                if order_book_id in tail_codes:
+                    if not self._merge_history_tail(order_book_id, bar_data):
+                        self._cache['history_kline'].pop(order_book_id)  # 复权价格变化, 留给按需全量拉取
+                        self._drop_minute_history(order_book_id)
+                else:
+                    self._set_history_data(order_book_id, bar_data)
+                    self._cache['history_kline_synced'][order_book_id] = today
+                    self._save_history_store(order_book_id, bar_data)
+
+    def _request_multi_points_kline(self, market, start, end, codes):
+        """以 [start, end] 间的每个交易日为时间点, 批量请求多只股票的日K; 分段和翻页的每次请求各自限频"""
+        ret_code, trading_days = self._scheduler.call('get_trading_days', self._quote_context.get_trading_days,
+                                                      market, start_date=start.strftime("%Y-%m-%d"),
+                                                      end_date=end.strftime("%Y-%m-%d"))
+        if ret_code == RET_ERROR:
+            return ret_code, trading_days
+        return self._quote_context.get_multi_points_history_kline(
+            codes, sorted(trading_days), ktype='K_DAY', autype='qfq',
+            call=partial(self._scheduler.call, 'get_multi_points_history_kline'))
+
+    def _on_universe_changed(self, event):
+        if self._mod_config.futu_history_prefetch:
+            self.prefetch_history(event.universe)
+        if self._tick_record:
+            self._subscribe_ticks(event.universe)
+        if self._mod_config.futu_bar_mode == "push" and IsRuntype_RealtimeStrategy():
+            self._subscribe_bars(event.universe)
+
+    def _subscribe_bars(self, order_book_ids):
+        """push 模式下订阅股票池的K线推送, DataCache 收到推送后通知 event source 触发 handle_bar"""
+        for order_book_id in order_book_ids:
+            self._quote_context.subscribe(order_book_id, "K_DAY", push=True)
+        self._quote_context.set_handler(self._data_cache)
+        self._quote_context.start()
+
+    def _subscribe_ticks(self, order_book_ids):
+        """订阅股票池的逐笔和摆盘推送, 由 TickRecorder 记录到本地"""
+        for order_book_id in order_book_ids:
+            self._quote_context.subscribe(order_book_id, "TICKER", push=True)
+            self._quote_context.subscribe(order_book_id, "ORDER_BOOK", push=True)
+        self._quote_context.start()
 
     def history_bars(self, instrument, bar_count, frequency, fields, dt, skip_suspended=True,
                      include_now=False, adjust_type='pre', adjust_orig=None):
@@ -404,29 +591,26 @@ class FUTUDataSource(AbstractDataSource):
         :return: `numpy.ndarray`
 
         """
-        if frequency != '1d' or not skip_suspended:
+        if not skip_suspended:
+            raise NotImplementedError
+        if frequency in MINUTE_KTYPES:
+            ret_code, bar_data = self._get_minute_bars(instrument, MINUTE_KTYPES[frequency], dt, bar_count)
+            if ret_code == RET_ERROR:
+                raise NotImplementedError
+            return bar_data if fields is None else bar_data[fields]
+        if frequency != '1d':
             raise NotImplementedError
 
         datetime_dt = int(dt.strftime("%Y%m%d%H%M%S"))
 
-        if self._cache['history_kline'] is None or instrument.order_book_id not in self._cache['history_kline'].keys():
-            ret_code, bar_data = self._get_history_cache(instrument)
-            datetime_rows = self._cache['history_kline'][instrument.order_book_id]
-            if skip_suspended:
-                bar_data = datetime_rows[datetime_rows['datetime'] <= datetime_dt].sort_values(['datetime'])[-bar_count:]
-        else:  # 不为空的时候，在历史缓存里寻找对应范围的数据就可以了
-            datetime_rows = self._cache['history_kline'][instrument.order_book_id]
-            if skip_suspended:
-                ret_code = 0
-                bar_data = datetime_rows[datetime_rows['datetime'] <= datetime_dt].sort_values(['datetime'])[-bar_count:]
-
-        if ret_code == RET_ERROR or bar_data is None:
+        ret_code, datetime_rows = self._get_history_data(instrument)
+        if ret_code == RET_ERROR or datetime_rows is None:
             raise NotImplementedError
-        else:
-            if isinstance(fields, str):
-                return bar_data if fields is None else bar_data[fields].as_matrix()
-            else:
-                raise NotImplementedError
+
+        # 缓存按时间升序排列, 二分查找后切片, 返回的是缓存数组的视图而不是拷贝
+        end_pos = datetime_rows['datetime'].searchsorted(datetime_dt, side='right')
+        bar_data = datetime_rows[max(end_pos - bar_count, 0):end_pos]
+        return bar_data if fields is None else bar_data[fields]
 
     def get_trading_calendar(self):
         """
@@ -444,18 +628,14 @@ class FUTUDataSource(AbstractDataSource):
 
     def _get_calendar_cache(self):
         base = self._env.config.base
-        for i in range(3):
-            ret_code, calendar_list = self._quote_context.get_trading_days(market="HK",
-                                                                           start_date=base.start_date.strftime(
-                                                                               "%Y-%m-%d"),
-                                                                           end_date=base.end_date.strftime(
-                                                                               "%Y-%m-%d"))
-            if ret_code != RET_ERROR and len(calendar_list) == 0:
-                break
-            else:
-                time.sleep(0.1)
-
-        if ret_code == RET_ERROR or len(calendar_list) == 0:
+        ret_code, calendar_list = self._scheduler.call('get_trading_days', self._quote_context.get_trading_days,
+                                                       market="HK",
+                                                       start_date=base.start_date.strftime("%Y-%m-%d"),
+                                                       end_date=base.end_date.strftime("%Y-%m-%d"))
+        if ret_code == RET_ERROR:
+            print("get trading days error:{}".format(calendar_list))
+            return ret_code, None
+        if len(calendar_list) == 0:
             print("get trading days error")
 
         calendar = pd.Index(pd.Timestamp(str(d)) for d in calendar_list)
@@ -478,7 +658,23 @@ class FUTUDataSource(AbstractDataSource):
 
         :return: :class:`~Snapshot`
         """
-        raise NotImplementedError
+        if IsRuntype_Backtest() is True:
+            raise NotImplementedError
+
+        snapshot = self._get_snapshot(instrument.order_book_id)
+        if snapshot is None:
+            return None
+        data = {
+            'datetime': int(time_key_to_int([snapshot['update_time']])[0]),
+            'open': snapshot['open_price'],
+            'high': snapshot['high_price'],
+            'low': snapshot['low_price'],
+            'last': snapshot['last_price'],
+            'prev_close': snapshot['prev_close_price'],
+            'volume': snapshot['volume'],
+            'total_turnover': snapshot['turnover'],
+        }
+        return SnapshotObject(instrument, data, dt)
 
     def available_data_range(self, frequency):
         """
@@ -504,48 +700,67 @@ class FUTUDataSource(AbstractDataSource):
                 if i.date() != date.today():
                     result.append(False)
                 else:
-                    if self._cache["market_snapshot"] is None or order_book_id not in self._cache["market_snapshot"].keys():
-                        ret_code, ret_data = self._get_snapshot_cache(order_book_id)
-                    else:
-                        ret_code, ret_data = 0, self._cache["market_snapshot"][order_book_id]
-
-                    if ret_data is not None:
-                        if str(ret_data['suspension'])[5:10] == 'False':
-                            result.append(False)
-                        elif str(ret_data['suspension'])[5:10] == 'True':
-                            result.append(True)
+                    snapshot = self._get_snapshot(order_book_id)
+                    if snapshot is not None:
+                        result.append(bool(snapshot['suspension']))
                     else:
                         result.append(True)
         return result
 
-    def _get_snapshot_cache(self, order_book_id):
-        self._cache["market_snapshot"] = {}
-
-        for i in range(3):
-            ret_code, ret_data = self._quote_context.get_market_snapshot([order_book_id])
-            if ret_code != RET_ERROR and ret_data.empty:
-                break
-            else:
-                time.sleep(5)
-        if ret_code == RET_ERROR or ret_data.empty:
-            print("get market snapshot error")
-
-        self._cache["market_snapshot"][order_book_id] = ret_data
-
-        self._cache["market_snapshot"][order_book_id] = self._cache["market_snapshot"][order_book_id].append(ret_data)
-        return ret_code, self._cache["market_snapshot"][order_book_id]
+    def _get_snapshot(self, order_book_id):
+        """
+        取快照缓存, 超过 futu_snapshot_ttl 秒的视为过期, 过期时整个股票池一起刷新
+        futu没有返回快照的股票(停牌或已退市)同样缓存到过期, 返回 None
+        """
+        snapshot = self._cache["market_snapshot"].get(order_book_id)
+        if snapshot is None or time.time() - snapshot['fetch_time'] > self._mod_config.futu_snapshot_ttl:
+            self._refresh_snapshot_cache(order_book_id)
+            snapshot = self._cache["market_snapshot"].get(order_book_id)
+        if snapshot is None or snapshot.get('missing'):
+            return None
+        return snapshot
+
+    def _refresh_snapshot_cache(self, order_book_id):
+        """按每次最多 SNAPSHOT_MAX_CODES 只分批并发请求整个股票池的快照"""
+        codes = set(self._env.get_universe())
+        codes.add(order_book_id)
+        codes = sorted(codes)
+        batches = [codes[i:i + SNAPSHOT_MAX_CODES] for i in range(0, len(codes), SNAPSHOT_MAX_CODES)]
+        futures = [self._scheduler.submit('get_market_snapshot', self._quote_context.get_market_snapshot, batch)
+                   for batch in batches]
+
+        for batch, future in zip(batches, futures):
+            ret_code, ret_data = future.result()
+            if ret_code == RET_ERROR or isinstance(ret_data, str):
+                print("get market snapshot error:{}".format(ret_data))
+                continue
+            fetch_time = time.time()
+            # 请求了但没有返回快照的股票记为缺失, 过期前不再因为它刷新整个股票池
+            for code in batch:
+                self._cache["market_snapshot"][code] = {'code': code, 'fetch_time': fetch_time, 'missing': True}
+            for snapshot in ret_data.to_dict(orient='records'):
+                snapshot['fetch_time'] = fetch_time
+                self._cache["market_snapshot"][snapshot['code']] = snapshot
 
     def _clear_cache(self, dt):
         if dt == date.today():
-            self._cache.remove_all()
+            # 增量模式下保留日K历史, 当天第一次访问时只补齐尾部
+            self._data_cache.remove_all(keep_history=self._incremental_sync)
 
-    def on_before_trading(self):
+    def on_before_trading(self, event):
         self._today = Environment.get_instance().trading_dt.date()
         self._clear_cache(self._today)
+        # 第一个bar之前把整个股票池的日K一次性预取好
+        if self._mod_config.futu_history_prefetch:
+            universe = set(self._env.get_universe())
+            if self._env.config.base.benchmark:
+                universe.add(self._env.config.base.benchmark)
+            self.prefetch_history(universe)
 
     def _register_event(self):
-        event_bus = Environment.get_instance().event_bus
+        event_bus = self._env.event_bus
         event_bus.add_listener(EVENT.PRE_BEFORE_TRADING, self.on_before_trading)
+        event_bus.add_listener(EVENT.POST_UNIVERSE_CHANGED, self._on_universe_changed)
 
     def get_trading_minutes_for(self, order_book_id, trading_dt):
         """
@@ -619,7 +834,10 @@ class FUTUDataSource(AbstractDataSource):
 
     def get_merge_ticks(self, order_book_id_list, trading_date, last_dt=None):
         """
-        获取合并的 ticks---不支持逐笔---不实现
+        获取合并的 ticks---回放实时策略中记录的逐笔和摆盘推送
+        各股票的tick以 mmap 方式读取, 用k路归并按时间顺序逐条产出, 不会把当天全部tick读入内存
+        股票池变化后带 last_dt 重新调用时, 已产出过的股票从上次的位置继续, 新加入(含移出后再加入)的股票从 last_dt 所在的毫秒开始,
+        同一毫秒内的tick不会因为只按时间定位而丢失或重复
 
         :param list order_book_id_list: 合约名列表
         :param datetime.date trading_date: 交易日
@@ -627,26 +845,139 @@ class FUTUDataSource(AbstractDataSource):
 
         :return: Tick
         """
-        raise NotImplementedError
+        if self._tick_store is None:
+            return
+        start_dt = -1 if last_dt is None else int(last_dt.strftime('%Y%m%d%H%M%S%f')[:-3])
+        if last_dt is None or self._tick_replay_date != trading_date:
+            self._tick_replay_date = trading_date
+            self._tick_replay_pos = {}
+        replay_pos = self._tick_replay_pos
+        # 移出股票池的股票不再保留位置, 之后重新加入时和新股票一样从 last_dt 开始, 不会产出更早的tick
+        for order_book_id in set(replay_pos) - set(order_book_id_list):
+            del replay_pos[order_book_id]
+        codes = []
+        streams = []
+        for order_book_id in order_book_id_list:
+            ticks = self._tick_store.load_day(order_book_id, trading_date)
+            if ticks is None or len(ticks) == 0:
+                continue
+            codes.append(order_book_id)
+            pos = replay_pos.get(order_book_id)
+            if pos is None:
+                pos = ticks['datetime'].searchsorted(start_dt, side='left')
+            streams.append((ticks, pos))
+
+        for stream_no, pos in merge_tick_streams(streams):
+            replay_pos[codes[stream_no]] = pos + 1
+            yield Tick(codes[stream_no], tick_to_dict(streams[stream_no][0][pos]))
 
 # DataCache实现股票数据的存储和调用；
+class LRUKlineCache(OrderedDict):
+    """
+    按股票做LRU淘汰的K线缓存, 超出股票数或内存预算时淘汰最久没有访问的股票
+    max_instruments, max_bytes 为 0 时不限制
+    """
+
+    def __init__(self, max_instruments=0, max_bytes=0, on_evict=None):
+        super(LRUKlineCache, self).__init__()
+        self._max_instruments = max_instruments
+        self._max_bytes = max_bytes
+        self._on_evict = on_evict
+        self._nbytes = 0
+
+    @property
+    def nbytes(self):
+        return self._nbytes
+
+    def __getitem__(self, key):
+        value = super(LRUKlineCache, self).__getitem__(key)
+        self.move_to_end(key)
+        return value
+
+    def get(self, key, default=None):
+        """与 [] 一样更新访问顺序; 只判断 in 不算访问"""
+        if key not in self:
+            return default
+        return self[key]
+
+    def __setitem__(self, key, value):
+        self.pop(key, None)
+        super(LRUKlineCache, self).__setitem__(key, value)
+        self._nbytes += value.nbytes
+        self._evict()
+
+    def pop(self, key, *default):
+        # 不用 OrderedDict.pop, 它会调用上面带 move_to_end 的 __getitem__
+        if key in self:
+            value = super(LRUKlineCache, self).__getitem__(key)
+            super(LRUKlineCache, self).__delitem__(key)
+            self._nbytes -= value.nbytes
+            return value
+        if default:
+            return default[0]
+        raise KeyError(key)
+
+    def clear(self):
+        super(LRUKlineCache, self).clear()
+        self._nbytes = 0
+
+    def _over_budget(self):
+        if self._max_instruments and len(self) > self._max_instruments:
+            return True
+        return bool(self._max_bytes) and self._nbytes > self._max_bytes
+
+    def _evict(self):
+        # 刚写入的股票在队尾, 至少保留它
+        while len(self) > 1 and self._over_budget():
+            key = next(iter(self))
+            self.pop(key)
+            if self._on_evict is not None:
+                self._on_evict(key)
+
+
 class DataCache(CurKlineHandlerBase):
-    def __init__(self):
+    def __init__(self, max_instruments=0, max_bytes=0):
         super(CurKlineHandlerBase, self).__init__()
         self._cache = {}
-        self._cache["basicinfo_SZ"] = None
-        self._cache["basicinfo_SH"] = None
+        self._cache["basicinfo_cn"] = None
         self._cache["basicinfo_hk"] = None
         self._cache["basicinfo_us"] = None
-        self._cache["history_kline"] = None
+        self._cache["history_kline"] = LRUKlineCache(max_instruments, max_bytes, self._on_history_evicted)
+        self._cache["history_kline_last"] = {}  # 每只股票最后一条已收盘日K的时间, 增量同步的起点
+        self._cache["history_kline_synced"] = {}  # 每只股票最近一次同步的日期
+        # 已收盘交易日的分钟K线, 按 (code, ktype, 日期) 分块缓存, 按内存预算淘汰
+        self._cache["minute_kline"] = LRUKlineCache(0, max_bytes)
+        self._cache["minute_kline_today"] = {}  # 当天盘中的分钟K线 (code, ktype) -> (拉取时间, 数据)
         self._cache["trading_days"] = None
-        self._cache["market_snapshot"] = None
+        self._cache["market_snapshot"] = {}
         self._cache['cur_kline'] = {}
+        # 收到K线推送时放入一个标记; 容量为1, event source 还没取走时的后续推送合并成同一个 BAR 事件
+        self._bar_queue = Queue(maxsize=1)
 
-    def remove_all(self):
-        """删除全部"""
+    @property
+    def bar_queue(self):
+        return self._bar_queue
+
+    def remove_all(self, keep_history=False):
+        """删除全部, keep_history 为 True 时保留日K及已收盘的分钟K线缓存, 由LRU按预算淘汰"""
+        history_keys = ("history_kline", "history_kline_last", "history_kline_synced", "minute_kline")
         for key in self._cache:
+            if key in history_keys:
+                continue
             self._cache[key] = None
+        self._cache['cur_kline'] = {}
+        self._cache["market_snapshot"] = {}
+        self._cache["minute_kline_today"] = {}
+        if not keep_history:
+            self._cache["history_kline"].clear()
+            self._cache["minute_kline"].clear()
+            self._cache["history_kline_last"] = {}
+            self._cache["history_kline_synced"] = {}
+
+    def _on_history_evicted(self, order_book_id):
+        """被LRU淘汰的股票, 同步状态一起删除, 下次访问时重新从本地存储加载"""
+        self._cache["history_kline_last"].pop(order_book_id, None)
+        self._cache["history_kline_synced"].pop(order_book_id, None)
 
     def on_recv_rsp(self, rsp_str):
         # 调用父类的方法见rsp_str数据解析为需要的内容
@@ -657,15 +988,10 @@ class DataCache(CurKlineHandlerBase):
             if ret_data.empty:
                 self._cache['cur_kline'] = {}
             else:
-                bar_data = ret_data.iloc[-1:].copy()
-                del bar_data['code'], bar_data['k_type']  # 删除推送数据多出来的字段
-                for i in range(len(bar_data['time_key'])):  # 时间转换
-                    bar_data.loc[i, 'time_key'] = int(
-                        bar_data['time_key'][i].replace('-', '').replace(' ', '').replace(':', ''))
-
-                bar_data.rename(columns={'time_key': 'datetime', 'turnover': 'total_turnover'},
-                                inplace=True)  # 将字段名称改为一致的
-                bar_data['volume'] = bar_data['volume'].astype('float64')  # 把成交量的数据类型转为float
-
-                self._cache['cur_kline'][ret_data['code'][0]]=bar_data
-                return ret_code, self._cache['cur_kline'][ret_data['code'][0]]
+                code = ret_data['code'].iloc[-1]
+                self._cache['cur_kline'][code] = frame_to_kline_array(ret_data.iloc[-1:])
+                try:
+                    self._bar_queue.put_nowait(code)
+                except Full:
+                    pass
+                return ret_code, self._cache['cur_kline'][code]
@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2017 Futu, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from rqalpha.utils.logger import system_log
+
+import heapq
+import numpy as np
+import os
+import pickle
+import shutil
+import time
+
+# 本地K线存储的字段, 与rqalpha的bar字段保持一致
+KLINE_FIELDS = ['datetime', 'open', 'high', 'low', 'close', 'volume', 'total_turnover']
+KLINE_DTYPE = np.dtype([
+    ('datetime', '<i8'),
+    ('open', '<f8'),
+    ('high', '<f8'),
+    ('low', '<f8'),
+    ('close', '<f8'),
+    ('volume', '<f8'),
+    ('total_turnover', '<f8'),
+])
+
+# 本地tick存储的字段, datetime 为 YYYYMMDDHHMMSSmmm 形式, 成交量和成交额为当天累计值, 摆盘为买卖各5档
+TICK_BOOK_LEVELS = 5
+TICK_FIELDS = ['datetime', 'open', 'high', 'low', 'last', 'volume', 'total_turnover'] + \
+              ['{}{}{}'.format(side, level, suffix) for suffix in ('', '_v') for side in ('b', 'a')
+               for level in range(1, TICK_BOOK_LEVELS + 1)]
+TICK_DTYPE = np.dtype([(field, '<i8' if field == 'datetime' else '<f8') for field in TICK_FIELDS])
+
+# 归并tick时每次从 mmap 中读出的时间戳条数
+TICK_READ_BLOCK = 4096
+
+
+# futu K线字段与rqalpha bar字段的对应关系
+FUTU_KLINE_COLUMNS = {
+    'datetime': 'time_key',
+    'open': 'open',
+    'high': 'high',
+    'low': 'low',
+    'close': 'close',
+    'volume': 'volume',
+    'total_turnover': 'turnover',
+}
+
+# 'YYYY-MM-DD HH:MM:SS' 中各位数字所在的下标及其权重
+_TIME_KEY_DIGITS = [0, 1, 2, 3, 5, 6, 8, 9, 11, 12, 14, 15, 17, 18]
+_TIME_KEY_WEIGHTS = 10 ** np.arange(len(_TIME_KEY_DIGITS) - 1, -1, -1, dtype=np.int64)
+
+
+def time_key_to_int(time_keys):
+    """
+    把futu的 time_key 字符串批量转为 YYYYMMDDHHMMSS 形式的 int64, 整列一次完成, 不逐行处理
+    不是 'YYYY-MM-DD HH:MM:SS' 格式(如只有日期)时抛出 ValueError
+    """
+    raw = np.asarray(time_keys, dtype='S')
+    if len(raw) == 0:
+        return np.empty(0, dtype=np.int64)
+    if raw.dtype.itemsize == 19:
+        # 短于19个字符的在末尾补 \0, 同样会落在数字位上, 一起由数字检查发现
+        digits = raw.view(np.uint8).reshape(-1, 19)[:, _TIME_KEY_DIGITS].astype(np.int64) - ord('0')
+        invalid = np.any((digits < 0) | (digits > 9), axis=1)
+    else:
+        invalid = np.char.str_len(raw) != 19
+    if np.any(invalid):
+        raise ValueError("invalid time_key:{}".format(raw[invalid][0].decode()))
+    return digits.dot(_TIME_KEY_WEIGHTS)
+
+
+def frame_to_kline_array(kline_data):
+    """把futu返回的K线DataFrame转为按 datetime 升序排列的结构化数组, 历史、当前和推送K线共用"""
+    bars = np.empty(len(kline_data), dtype=KLINE_DTYPE)
+    for field, column in FUTU_KLINE_COLUMNS.items():
+        if field == 'datetime':
+            bars[field] = time_key_to_int(kline_data[column].values)
+        else:
+            bars[field] = kline_data[column].values
+    return bars[np.argsort(bars['datetime'], kind='mergesort')]
+
+
+class KlineStore(object):
+    """
+    本地K线存储
+    日K每个 code/ktype/复权类型 对应一个 .npy 文件, 分钟K线数据量大, 按天分块, 每天一个 .npy 文件,
+    内容均为按 datetime 升序排列的结构化数组
+    日K每次同步尾部都会整体重写, 读取时直接读入内存; Windows 下被 mmap 映射的文件无法被替换
+    分钟K线的按天分块写入后不再改写, 读取时以 mmap 方式打开, 不会把整段历史读入内存
+    """
+
+    def __init__(self, root):
+        self._root = os.path.join(os.path.expanduser(root), 'kline')
+
+    def _path(self, code, ktype, autype):
+        return os.path.join(self._root, code, "{}_{}.npy".format(ktype, autype))
+
+    def _day_path(self, code, ktype, autype, day):
+        return os.path.join(self._root, code, "{}_{}".format(ktype, autype), "{}.npy".format(day.strftime('%Y%m%d')))
+
+    def load(self, code, ktype='K_DAY', autype='qfq'):
+        return self._load(self._path(code, ktype, autype), mmap_mode=None)
+
+    def save(self, code, ktype, autype, bars):
+        self._save(self._path(code, ktype, autype), bars)
+
+    def load_day(self, code, ktype, autype, day):
+        """读取某一天的分钟K线块, 没有落盘过时返回 None, 空数组表示当天没有数据"""
+        return self._load(self._day_path(code, ktype, autype, day), mmap_mode='r')
+
+    def save_day(self, code, ktype, autype, day, bars):
+        """已经收盘的一天的分钟K线不会再变, 已落盘的不改写, 这个文件可能正被 mmap 映射"""
+        path = self._day_path(code, ktype, autype, day)
+        if not os.path.exists(path):
+            self._save(path, bars)
+
+    def remove_days(self, code):
+        """删除一只股票全部按天分块的K线, 复权价格变化后需要重新拉取"""
+        code_root = os.path.join(self._root, code)
+        if not os.path.isdir(code_root):
+            return
+        for name in os.listdir(code_root):
+            path = os.path.join(code_root, name)
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+
+    def _load(self, path, mmap_mode):
+        if not os.path.exists(path):
+            return None
+        try:
+            bars = np.load(path, mmap_mode=mmap_mode)
+        except (IOError, ValueError) as e:
+            system_log.warn("kline store load error:{} {}".format(path, e))
+            return None
+        if bars.dtype != KLINE_DTYPE:
+            return None
+        return bars
+
+    def _save(self, path, bars):
+        tmp_path = path + '.tmp'
+        try:
+            if not os.path.exists(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(tmp_path, 'wb') as f:
+                np.save(f, np.asarray(bars, dtype=KLINE_DTYPE))
+            os.replace(tmp_path, path)  # 先写临时文件再替换, 避免进程中断留下半个文件
+        except (IOError, OSError) as e:
+            system_log.warn("kline store save error:{} {}".format(path, e))
+
+
+class TickStore(object):
+    """
+    本地tick存储
+    每只股票每天一个文件, 内容为 TICK_DTYPE 记录直接拼接, 实时推送到来时追加写入;
+    同一只股票的tick按时间升序追加, 读取时以 mmap 方式打开, 进程中断留下的半条记录会被忽略
+    """
+
+    def __init__(self, root):
+        self._root = os.path.join(os.path.expanduser(root), 'tick')
+
+    def _path(self, code, day):
+        return os.path.join(self._root, code, "{}.tick".format(day.strftime('%Y%m%d')))
+
+    def load_day(self, code, day):
+        path = self._path(code, day)
+        if not os.path.exists(path):
+            return None
+        count = os.path.getsize(path) // TICK_DTYPE.itemsize
+        if count == 0:
+            return np.empty(0, dtype=TICK_DTYPE)
+        try:
+            return np.memmap(path, dtype=TICK_DTYPE, mode='r', shape=(count,))
+        except (IOError, ValueError) as e:
+            system_log.warn("tick store load error:{} {}".format(path, e))
+            return None
+
+    def append_day(self, code, day, ticks):
+        path = self._path(code, day)
+        try:
+            if not os.path.exists(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'ab') as f:
+                f.write(np.asarray(ticks, dtype=TICK_DTYPE).tobytes())
+        except (IOError, OSError) as e:
+            system_log.warn("tick store append error:{} {}".format(path, e))
+
+
+def _iter_tick_datetime(stream_no, ticks, pos):
+    """逐条产出一只股票的 (时间, 序号, 位置), 时间戳按块从 mmap 中读出"""
+    for begin in range(pos, len(ticks), TICK_READ_BLOCK):
+        block = np.asarray(ticks['datetime'][begin:begin + TICK_READ_BLOCK]).tolist()
+        for offset, dt_int in enumerate(block):
+            yield dt_int, stream_no, begin + offset
+
+
+def merge_tick_streams(streams):
+    """
+    k路归并多只股票的tick, 按时间顺序产出 (stream_no, 位置)
+    :param streams: [(ticks, pos)], ticks 为按时间升序的tick数组, 从 pos 开始归并
+    堆中每只股票只有一条记录, 不会把当天全部tick读入内存; 时间相同时按 streams 的顺序产出
+    """
+    for dt_int, stream_no, pos in heapq.merge(*[_iter_tick_datetime(i, ticks, pos)
+                                                for i, (ticks, pos) in enumerate(streams)]):
+        yield stream_no, pos
+
+
+def tick_to_dict(tick):
+    """把一条tick记录转为 rqalpha Tick 使用的字典, futu推送中没有的字段为 nan"""
+    data = {field: float(tick[field]) for field in TICK_FIELDS[1:]}
+    data['date'], data['time'] = divmod(int(tick['datetime']), 1000000000)
+    for field in ('prev_close', 'open_interest', 'prev_settlement', 'limit_up', 'limit_down'):
+        data[field] = np.nan
+    return data
+
+
+class InstrumentStore(object):
+    """
+    本地股票列表存储
+    每个市场一个文件, 保存整理好字段名的股票列表, 文件修改时间超过 ttl 秒即视为过期
+    """
+
+    def __init__(self, root):
+        self._root = os.path.join(os.path.expanduser(root), 'instruments')
+
+    def _path(self, market):
+        return os.path.join(self._root, "{}.pkl".format(market))
+
+    def load(self, market, ttl):
+        path = self._path(market)
+        if not os.path.exists(path) or time.time() - os.path.getmtime(path) > ttl:
+            return None
+        try:
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+        except (IOError, ValueError, pickle.UnpicklingError, EOFError) as e:
+            system_log.warn("instrument store load error:{} {}".format(path, e))
+            return None
+
+    def save(self, market, records):
+        path = self._path(market)
+        tmp_path = path + '.tmp'
+        try:
+            if not os.path.exists(self._root):
+                os.makedirs(self._root)
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(records, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except (IOError, OSError) as e:
+            system_log.warn("instrument store save error:{} {}".format(path, e))
@@ -27,6 +27,31 @@ from rqalpha.utils.exception import CustomException, CustomError, patch_user_exc
 from rqalpha.utils.logger import system_log
 
 from datetime import timedelta, date, datetime
+from six.moves.queue import Empty
+from bisect import bisect_left
+import numpy as np
+
+# push 模式下等待K线推送的超时时间(秒), 超时后重新检查市场状态
+PUSH_BAR_WAIT = 0.5
+# 等待市场状态变化的超时时间(秒)
+STATE_WAIT_TIMEOUT = 60
+
+# 各市场股票分钟bar的时间点 [(开始, 结束)], 与futu分钟K线的时间一致, bar的时间为该分钟结束的时刻
+STOCK_TRADING_SESSIONS = {
+    "HK": [((9, 30), (12, 0)), ((13, 1), (16, 0))],
+    "CN": [((9, 31), (11, 30)), ((13, 1), (15, 0))],
+    "US": [((9, 31), (16, 0))],
+}
+
+
+def _session_minute_offsets(sessions):
+    """把交易时段转为距当天零点的分钟偏移数组, 每个市场只算一次"""
+    return np.concatenate([np.arange(start_h * 60 + start_m, end_h * 60 + end_m + 1)
+                           for (start_h, start_m), (end_h, end_m) in sessions]).astype('timedelta64[m]')
+
+
+STOCK_MINUTE_OFFSETS = {market: _session_minute_offsets(sessions)
+                        for market, sessions in STOCK_TRADING_SESSIONS.items()}
 
 
 class FUTUEventForBacktest(AbstractEventSource):
@@ -37,6 +62,15 @@ class FUTUEventForBacktest(AbstractEventSource):
         self._universe_changed = False
         self._env.event_bus.add_listener(
             EVENT.POST_UNIVERSE_CHANGED, self._on_universe_changed)
+        if IsFutuMarket_CNStock():
+            self._minute_offsets = STOCK_MINUTE_OFFSETS["CN"]
+        elif IsFutuMarket_USStock():
+            self._minute_offsets = STOCK_MINUTE_OFFSETS["US"]
+        else:
+            self._minute_offsets = STOCK_MINUTE_OFFSETS["HK"]
+        # 只缓存当前交易日的分钟时间点, 股票池变化后重新生成事件时直接复用
+        self._trading_minutes_date = None
+        self._trading_minutes = None
 
     def _on_universe_changed(self, event):
         self._universe_changed = True
@@ -51,24 +85,10 @@ class FUTUEventForBacktest(AbstractEventSource):
         return universe
 
     # [BEGIN] minute event helper
-    @staticmethod
-    def _get_stock_trading_minutes(trading_date):
-        trading_minutes = set()
-        # current_dt = datetime.combine(trading_date, time(9, 30))
-        current_dt = trading_date.replace(hour=9, minute=30)
-        am_end_dt = current_dt.replace(hour=12, minute=00)
-        pm_start_dt = current_dt.replace(hour=13, minute=1)
-        pm_end_dt = current_dt.replace(hour=16, minute=0)
-        delta_minute = timedelta(minutes=1)
-        while current_dt <= am_end_dt:
-            trading_minutes.add(current_dt)
-            current_dt += delta_minute
-
-        current_dt = pm_start_dt
-        while current_dt <= pm_end_dt:
-            trading_minutes.add(current_dt)
-            current_dt += delta_minute
-        return trading_minutes
+    def _get_stock_trading_minutes(self, trading_date):
+        """当天零点加上预先算好的分钟偏移, 一次得到升序排列的全部分钟时间点"""
+        minutes = np.datetime64(trading_date.date(), 'm') + self._minute_offsets
+        return minutes.astype('datetime64[us]').tolist()
 
     def _get_future_trading_minutes(self, trading_date):
         trading_minutes = set()
@@ -81,15 +101,23 @@ class FUTUEventForBacktest(AbstractEventSource):
         return set([convert_int_to_datetime(minute) for minute in trading_minutes])
 
     def _get_trading_minutes(self, trading_date):
-        trading_minutes = set()
-        for account_type in self._config.base.accounts:
-            if account_type == DEFAULT_ACCOUNT_TYPE.STOCK.name:
-                trading_minutes = trading_minutes.union(
-                    self._get_stock_trading_minutes(trading_date))
-            elif account_type == DEFAULT_ACCOUNT_TYPE.FUTURE.name:
-                trading_minutes = trading_minutes.union(
-                    self._get_future_trading_minutes(trading_date))
-        return sorted(list(trading_minutes))
+        if self._trading_minutes_date == trading_date.date():
+            return self._trading_minutes
+
+        accounts = self._config.base.accounts
+        if DEFAULT_ACCOUNT_TYPE.FUTURE.name not in accounts:
+            trading_minutes = self._get_stock_trading_minutes(trading_date) \
+                if DEFAULT_ACCOUNT_TYPE.STOCK.name in accounts else []
+        else:
+            trading_minutes = set(self._get_future_trading_minutes(trading_date))
+            if DEFAULT_ACCOUNT_TYPE.STOCK.name in accounts:
+                trading_minutes.update(self._get_stock_trading_minutes(trading_date))
+            trading_minutes = sorted(trading_minutes)
+            return trading_minutes  # 期货的交易时段随股票池变化, 不缓存
+
+        self._trading_minutes_date = trading_date.date()
+        self._trading_minutes = trading_minutes
+        return trading_minutes
     # [END] minute event helper
 
     def events(self, start_date, end_date, frequency):
@@ -120,10 +148,8 @@ class FUTUEventForBacktest(AbstractEventSource):
                         break
                     exit_loop = True
                     trading_minutes = self._get_trading_minutes(_date)
-                    for calendar_dt in trading_minutes:
-                        if last_dt is not None and calendar_dt < last_dt:
-                            continue
-
+                    start_pos = 0 if last_dt is None else bisect_left(trading_minutes, last_dt)
+                    for calendar_dt in trading_minutes[start_pos:]:
                         if calendar_dt < dt_before_day_trading:
                             trading_dt = calendar_dt.replace(year=_date.year,
                                                              month=_date.month,
@@ -151,7 +177,6 @@ class FUTUEventForBacktest(AbstractEventSource):
                 dt = _date.replace(hour=17, minute=0)
                 yield Event(EVENT.SETTLEMENT, calendar_dt=dt, trading_dt=dt)
         elif frequency == "tick":
-            raise NotImplementedError()
             data_proxy = self._env.data_proxy
             for day in data_proxy.get_trading_dates(start_date, end_date):
                 _date = day.to_pydatetime()
@@ -205,9 +230,11 @@ class TimePeriod(Enum):
 
 class FUTUEventForRealtime(AbstractEventSource):
     """ 实时策略的event """
-    def __init__(self, env, mod_config, market_state_source):
+    def __init__(self, env, mod_config, market_state_source, bar_queue=None):
         self._env = env
         self._mod_config = mod_config
+        # push 模式下由 DataCache 收到K线推送时放入, 没有推送的时候不触发 handle_bar
+        self._bar_queue = bar_queue if self._mod_config.futu_bar_mode == "push" else None
         fps = int(float(self._mod_config.futu_bar_fps) * 1000)  # 转成毫秒
         self._fps_delta_dt = timedelta(
             days=0, seconds=fps//1000, microseconds=fps % 1000)
@@ -218,58 +245,30 @@ class FUTUEventForRealtime(AbstractEventSource):
         self._market_state_source = market_state_source
         self._last_onbar_dt = None
 
-    def mark_time_period(self, start_date, end_date):
-        trading_days = self._env.data_proxy.get_trading_dates(
-            start_date, end_date)
-
-        def in_before_trading_time(time):
-            return self._market_state_source.get_futu_market_state() == Futu_Market_State.MARKET_PRE_OPEN
-
-        def in_after_trading(time):
-            return self._market_state_source.get_futu_market_state() == Futu_Market_State.MARKET_CLOSE
-
-        def in_rest_trading(time):
-            return self._market_state_source.get_futu_market_state() == Futu_Market_State.MARKET_REST
-
-        def in_trading_time(time):
-            return self._market_state_source.get_futu_market_state() == Futu_Market_State.MARKET_OPEN
-
-        def in_trading_day(time):
-            if time.date() in trading_days:
-                return True
-            return False
-
-        while True:
-            now = datetime.now()
-            if in_trading_time(now):
-                self._time_period = TimePeriod.TRADING
-                continue
-            if in_rest_trading(now):
-                self._time_period = TimePeriod.REST
-                continue
-            if not in_trading_day(now):
-                self._time_period = TimePeriod.CLOSING
-                continue
-            if in_before_trading_time(now):
-                self._time_period = TimePeriod.BEFORE_TRADING
-                continue
-            if in_after_trading(now):
-                self._time_period = TimePeriod.AFTER_TRADING
-                continue
-            else:
-                self._time_period = TimePeriod.CLOSING
-                continue
+    def _get_time_period(self, trading_days):
+        market_state = self._market_state_source.get_futu_market_state()
+        if market_state == Futu_Market_State.MARKET_OPEN:
+            return TimePeriod.TRADING
+        if market_state == Futu_Market_State.MARKET_REST:
+            return TimePeriod.REST
+        if datetime.now().date() not in trading_days:
+            return TimePeriod.CLOSING
+        if market_state == Futu_Market_State.MARKET_PRE_OPEN:
+            return TimePeriod.BEFORE_TRADING
+        if market_state == Futu_Market_State.MARKET_CLOSE:
+            return TimePeriod.AFTER_TRADING
+        return TimePeriod.CLOSING
 
     def events(self, start_date, end_date, frequency):
+        # 开始日期的前一天才开始运行, 直接睡到那天零点
+        start_dt = datetime.combine(start_date - timedelta(days=1), datetime.min.time())
+        if datetime.now() < start_dt:
+            sleep((start_dt - datetime.now()).total_seconds())
 
-        while datetime.now().date() < start_date - timedelta(days=1):
-            continue
-
-        mark_time_thread = Thread(target=self.mark_time_period, args=(
-            start_date, date.fromtimestamp(2147483647)))
-        mark_time_thread.setDaemon(True)
-        mark_time_thread.start()
+        trading_days = self._env.data_proxy.get_trading_dates(start_date, date.fromtimestamp(2147483647))
+        state_version = None
         while True:
+            self._time_period = self._get_time_period(trading_days)
             if self._time_period == TimePeriod.BEFORE_TRADING:
                 if self._after_trading_processed:
                     self._after_trading_processed = False
@@ -279,25 +278,28 @@ class FUTUEventForRealtime(AbstractEventSource):
                     yield Event(EVENT.BEFORE_TRADING, calendar_dt=datetime.now(), trading_dt=datetime.now())
                     self._before_trading_processed = True
                     continue
-                else:
-                    sleep(0.01)
-                    continue
             elif self._time_period == TimePeriod.TRADING:
                 now_dt = datetime.now()
                 if not self._before_trading_processed:
                     yield Event(EVENT.BEFORE_TRADING, calendar_dt=now_dt, trading_dt=now_dt)
                     self._before_trading_processed = True
                     continue
+                elif self._bar_queue is not None:
+                    try:
+                        self._bar_queue.get(timeout=PUSH_BAR_WAIT)
+                    except Empty:
+                        continue
+                    now_dt = datetime.now()
+                    system_log.debug("FUTUEventForRealtime: push BAR event")
+                    yield Event(EVENT.BAR, calendar_dt=now_dt, trading_dt=now_dt)
+                    continue
                 else:
-                    fire_bar = False
                     if not self._last_onbar_dt or (now_dt > (self._last_onbar_dt + self._fps_delta_dt)):
                         self._last_onbar_dt = now_dt
-                        fire_bar = True
-                    if fire_bar:
                         system_log.debug("FUTUEventForRealtime: BAR event")
                         yield Event(EVENT.BAR, calendar_dt=now_dt, trading_dt=now_dt)
                     else:
-                        sleep(0.01)
+                        sleep((self._last_onbar_dt + self._fps_delta_dt - now_dt).total_seconds())
                     continue
             elif self._time_period == TimePeriod.AFTER_TRADING:
                 if self._before_trading_processed:
@@ -307,6 +309,7 @@ class FUTUEventForRealtime(AbstractEventSource):
                         "FUTUEventForRealtime: after trading event")
                     yield Event(EVENT.AFTER_TRADING, calendar_dt=datetime.now(), trading_dt=datetime.now())
                     self._after_trading_processed = True
-                else:
-                    sleep(0.01)
                     continue
+
+            # 没有要处理的事件, 睡到市场状态变化; 交易日的判断随日期变化, 所以等待带超时
+            state_version = self._market_state_source.wait_state_change(state_version, STATE_WAIT_TIMEOUT)
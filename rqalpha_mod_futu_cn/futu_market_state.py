@@ -21,7 +21,7 @@ from rqalpha.utils.logger import system_log
 
 from enum import Enum
 from time import sleep
-from threading import Thread
+from threading import Thread, Condition
 
 
 # 富途的市场状态
@@ -38,6 +38,9 @@ class FUTUMarketStateSource(object):
         self._env = env
         self._quote_context = quote_context
         self._market_state = None
+        # 市场状态每变化一次版本号加一, 等待方阻塞在条件变量上, 状态变化时才被唤醒
+        self._state_cond = Condition()
+        self._state_version = 0
         self._mkt_key = ""
         self._mkt_dic = {
             0: Futu_Market_State.MARKET_NONE,  # 未开盘
@@ -85,13 +88,29 @@ class FUTUMarketStateSource(object):
         # return Futu_Market_State.MARKET_OPEN
         return self._market_state
 
+    def wait_state_change(self, version, timeout=None):
+        """
+        阻塞到市场状态的版本号不再是 version, 或者超时
+        :param version: 上一次拿到的版本号, 为 None 时立即返回
+        :return: 当前的版本号
+        """
+        with self._state_cond:
+            if version is not None and version == self._state_version:
+                self._state_cond.wait(timeout)
+            return self._state_version
+
     def _query_futu_market_state(self):
         print("请求当前市场状态")
         ret, state_dict = self._quote_context.get_global_state()
         if ret == 0:
             mkt_val = int(state_dict[self._mkt_key])
             if mkt_val in self._mkt_dic.keys():
-                self._market_state = self._mkt_dic[mkt_val]
+                market_state = self._mkt_dic[mkt_val]
+                with self._state_cond:
+                    if market_state != self._market_state:
+                        self._market_state = market_state
+                        self._state_version += 1
+                        self._state_cond.notify_all()
             else:
                 err_log = "Unknown market state: {}".format(mkt_val)
                 system_log.error(err_log)
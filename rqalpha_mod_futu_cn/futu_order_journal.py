@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2017 Futu, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from rqalpha.model.order import Order
+from rqalpha.utils.logger import system_log
+
+from six.moves.queue import Queue, Empty
+from threading import Thread
+import os
+import pickle
+import sqlite3
+import time
+
+# 写日志的线程攒一批记录后一次提交, 一次提交只做一次 fsync
+JOURNAL_FLUSH_INTERVAL = 0.2
+
+
+class FUTUOrderJournal(object):
+    """
+    订单日志: 下单、成交、撤单等每次状态变化追加一条记录, 保存当时订单的完整状态
+    使用 SQLite 的 WAL 模式, 由单独的线程按批写入, 不占用下单的关键路径;
+    重启时取每个订单最后一条记录, 恢复出还没有完成的订单
+    """
+
+    def __init__(self, root, name):
+        root = os.path.join(os.path.expanduser(root), 'journal')
+        if not os.path.exists(root):
+            os.makedirs(root)
+        self._path = os.path.join(root, '{}.db'.format(name))
+        self._queue = Queue()
+
+        conn = self._connect()
+        conn.execute("CREATE TABLE IF NOT EXISTS journal ("
+                     "seq INTEGER PRIMARY KEY AUTOINCREMENT, time REAL, event TEXT, "
+                     "order_id INTEGER, futu_order_id TEXT, state BLOB)")
+        conn.commit()
+        conn.close()
+
+        thread = Thread(target=self._run, name="FUTUOrderJournal")
+        thread.setDaemon(True)
+        thread.start()
+
+    def _connect(self):
+        conn = sqlite3.connect(self._path)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=FULL")
+        return conn
+
+    def record(self, event, order, futu_order_id=None):
+        """记录订单当前的状态, 只放入队列, 立即返回"""
+        state = pickle.dumps(order.get_state(), pickle.HIGHEST_PROTOCOL)
+        self._queue.put((time.time(), event, order.order_id,
+                         None if futu_order_id is None else str(futu_order_id), sqlite3.Binary(state)))
+
+    def replay(self):
+        """
+        取每个订单最后一条记录, 恢复还没有完成的订单, 同时删除已完成订单的记录
+        :return: [(futu_order_id, Order)]
+        """
+        conn = self._connect()
+        try:
+            rows = conn.execute("SELECT seq, futu_order_id, state FROM journal WHERE seq IN "
+                                "(SELECT MAX(seq) FROM journal GROUP BY order_id) ORDER BY seq").fetchall()
+            open_orders = []
+            closed_seqs = []
+            for seq, futu_order_id, state in rows:
+                order = Order()
+                order.set_state(pickle.loads(bytes(state)))
+                if futu_order_id is None or order.is_final():
+                    closed_seqs.append((seq, ))
+                    continue
+                open_orders.append((futu_order_id, order))
+
+            # 压缩: 只保留未完成订单的最后一条记录
+            conn.execute("DELETE FROM journal WHERE seq NOT IN (SELECT MAX(seq) FROM journal GROUP BY order_id)")
+            conn.executemany("DELETE FROM journal WHERE seq = ?", closed_seqs)
+            conn.commit()
+            return open_orders
+        except (sqlite3.Error, pickle.UnpicklingError, KeyError) as e:
+            system_log.warn("order journal replay error:{} {}".format(self._path, e))
+            return []
+        finally:
+            conn.close()
+
+    def _run(self):
+        conn = self._connect()
+        while True:
+            rows = [self._queue.get()]
+            deadline = time.time() + JOURNAL_FLUSH_INTERVAL
+            while True:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    break
+                try:
+                    rows.append(self._queue.get(timeout=timeout))
+                except Empty:
+                    break
+            try:
+                conn.executemany("INSERT INTO journal (time, event, order_id, futu_order_id, state) "
+                                 "VALUES (?, ?, ?, ?, ?)", rows)
+                conn.commit()
+            except sqlite3.Error as e:
+                system_log.warn("order journal write error:{} {}".format(self._path, e))
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2017 Futu, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from collections import OrderedDict
+from threading import RLock
+
+
+class FUTUOrderRegistry(object):
+    """
+    未完成订单的双向索引, 港股和A股的 broker 共用
+    futu订单号 -> rqalpha Order, rqalpha order_id -> futu订单号, 两个方向的查找和删除都是 O(1);
+    推送线程、查询线程和策略线程会同时访问, 所有操作都在锁内完成, 遍历时返回快照;
+    futu订单号统一按字符串保存, 下单返回、推送和从订单日志恢复的订单号类型不一定相同
+    """
+
+    def __init__(self):
+        self._orders = OrderedDict()  # futu订单号 -> Order, 保持下单的顺序
+        self._futu_order_ids = {}  # order_id -> futu订单号
+        self._lock = RLock()
+
+    def __len__(self):
+        return len(self._orders)
+
+    def add(self, futu_order_id, order):
+        with self._lock:
+            self._orders[str(futu_order_id)] = order
+            self._futu_order_ids[order.order_id] = str(futu_order_id)
+
+    def get_order(self, futu_order_id):
+        with self._lock:
+            return self._orders.get(str(futu_order_id))
+
+    def get_futu_order_id(self, order):
+        with self._lock:
+            return self._futu_order_ids.get(order.order_id)
+
+    def remove(self, futu_order_id):
+        with self._lock:
+            order = self._orders.pop(str(futu_order_id), None)
+            if order is not None:
+                self._futu_order_ids.pop(order.order_id, None)
+            return order
+
+    def futu_order_ids(self):
+        with self._lock:
+            return list(self._orders.keys())
+
+    def orders(self, order_book_id=None):
+        with self._lock:
+            if order_book_id is None:
+                return list(self._orders.values())
+            return [order for order in self._orders.values() if order.order_book_id == order_book_id]
+
+    def clear(self):
+        with self._lock:
+            self._orders.clear()
+            self._futu_order_ids.clear()
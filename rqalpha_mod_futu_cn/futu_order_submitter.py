@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2017 Futu, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from rqalpha.utils.logger import system_log
+
+from six.moves.queue import Queue
+from threading import Thread, Lock, Condition
+
+
+class FUTUOrderSubmitter(object):
+    """
+    异步下单队列
+    策略线程只把订单放入队列就返回, 由一个工作线程按提交的顺序逐个调用 place_func 下单;
+    ORDER_CREATION_PASS/REJECT 事件由 place_func 在工作线程中发出, 只有一个工作线程, 事件顺序与提交顺序一致;
+    已经取出、下单请求还没返回的订单仍算作未完成订单, 期间的撤单先记下, 由 place_func 拿到futu订单号后发出;
+    place_func 抛出异常时调用 reject_func(order, reason), 由它决定是否按拒单处理
+    """
+
+    def __init__(self, place_func, reject_func, name="FUTUOrderSubmitter"):
+        self._place_func = place_func
+        self._reject_func = reject_func
+        self._queue = Queue()
+        self._queued = {}  # 还在队列中的订单 order_id -> Order
+        self._cancelled = set()  # 在队列中被撤销的 order_id, 工作线程取到时直接丢弃
+        self._inflight = {}  # 已经取出, 下单请求还没返回的订单 order_id -> Order
+        self._cancel_requested = set()  # 下单请求返回前被撤销的 order_id
+        self._lock = Lock()
+        self._inflight_done = Condition(self._lock)
+
+        thread = Thread(target=self._run, name=name)
+        thread.setDaemon(True)
+        thread.start()
+
+    def __len__(self):
+        """还在队列中没有被撤销的, 加上下单请求还没返回的订单数"""
+        with self._lock:
+            return len(self._queued) - len(self._cancelled) + len(self._inflight)
+
+    def put(self, order):
+        with self._lock:
+            self._queued[order.order_id] = order
+        self._queue.put(order)
+
+    def cancel(self, order):
+        """撤销还在队列中的订单, 已经取出下单的返回 False"""
+        with self._lock:
+            if order.order_id not in self._queued:
+                return False
+            self._cancelled.add(order.order_id)
+            return True
+
+    def cancel_inflight(self, order):
+        """撤销下单请求还没返回的订单, 只记下撤单请求, 由 place_func 拿到futu订单号后调用 take_cancel_request 发出"""
+        with self._lock:
+            if order.order_id not in self._inflight:
+                return False
+            self._cancel_requested.add(order.order_id)
+            return True
+
+    def take_cancel_request(self, order):
+        """place_func 中拿到futu订单号后调用, 返回下单期间是否有撤单请求"""
+        with self._lock:
+            if order.order_id not in self._cancel_requested:
+                return False
+            self._cancel_requested.discard(order.order_id)
+            return True
+
+    def wait_inflight(self, timeout=None):
+        """等待下单请求还没返回的订单全部返回, 期间记下的撤单届时已经发出; 超时返回 False"""
+        with self._lock:
+            if self._inflight:
+                self._inflight_done.wait(timeout)
+            return not self._inflight
+
+    def amend(self, order, func):
+        """修改还在队列中的订单, 在锁内调用 func(order), 工作线程取出订单前一定能看到修改; 已经取出下单的返回 False"""
+        with self._lock:
+            if order.order_id not in self._queued or order.order_id in self._cancelled:
+                return False
+            func(order)
+            return True
+
+    def is_queued(self, order):
+        with self._lock:
+            return order.order_id in self._queued and order.order_id not in self._cancelled
+
+    def orders(self, order_book_id=None):
+        """还在队列中没有被撤销的, 加上下单请求还没返回的订单"""
+        with self._lock:
+            orders = [order for order_id, order in self._queued.items() if order_id not in self._cancelled]
+            orders += list(self._inflight.values())
+            return [order for order in orders if order_book_id is None or order.order_book_id == order_book_id]
+
+    def _run(self):
+        while True:
+            order = self._queue.get()
+            with self._lock:
+                self._queued.pop(order.order_id, None)
+                if order.order_id in self._cancelled:
+                    self._cancelled.discard(order.order_id)
+                    continue
+                self._inflight[order.order_id] = order
+            try:
+                self._place_func(order)
+            except Exception as e:
+                system_log.exception("place order error:{} {}".format(order, e))
+                self._reject_func(order, "place order error:{}".format(e))
+            finally:
+                with self._lock:
+                    self._inflight.pop(order.order_id, None)
+                    self._cancel_requested.discard(order.order_id)
+                    self._inflight_done.notify_all()
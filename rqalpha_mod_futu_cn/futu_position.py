@@ -112,6 +112,11 @@ class FUTUStockPosition(BasePosition):
         if order.side == SIDE.SELL:
             self._frozen -= order.unfilled_quantity
 
+    def on_order_amend_(self, order, unfilled_quantity):
+        """改单后按未成交数量的差额调整冻结量, unfilled_quantity 为改单前的未成交数量"""
+        if order.side == SIDE.SELL:
+            self._frozen += order.unfilled_quantity - unfilled_quantity
+
     @property
     def quantity(self):
         """
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2017 Futu, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from rqalpha.utils.logger import system_log
+
+import numpy as np
+import pandas as pd
+import six
+
+
+class FUTUPositionReconciler(object):
+    """
+    用 position_list_query 的结果校正本地持仓, 港股和A股的 broker 共用
+    本地持仓与futu持仓按股票代码做一次外连接, 只处理数量不一致的股票, 只修改数量和均价, 冻结量仍由本地订单维护;
+    有未完成订单的股票持仓正在变化, 跳过; 同一偏差连续两次出现才校正, 避免成交推送与持仓查询的先后造成误判
+    """
+
+    def __init__(self, query_func, lock):
+        self._query_func = query_func  # () -> (ret_code, pd_data)
+        self._lock = lock  # 与成交记账共用的锁
+        self._pending = {}  # 上一次发现偏差的股票 -> futu持仓数量
+
+        # 偏差统计
+        self.reconcile_count = 0  # 对账次数
+        self.drift_count = 0  # 累计校正的股票次数
+        self.drift_quantity = 0  # 累计校正的股数(绝对值)
+        self.last_drift = None  # 最近一次校正的明细
+
+    def reconcile(self, positions, skip_order_book_ids=()):
+        """
+        :param positions: 本地持仓 Positions
+        :param skip_order_book_ids: 不校正的股票, 一般是有未完成订单的股票
+        :return: 本次校正的明细 DataFrame(order_book_id, local_qty, remote_qty), 查询失败时返回 None
+        """
+        ret_code, pd_data = self._query_func()
+        if ret_code != 0:
+            return None
+        remote = pd.DataFrame({
+            'order_book_id': pd_data['code'].astype(str).values,
+            'remote_qty': pd_data['qty'].astype(int).values,
+            'cost_price': pd_data['cost_price'].astype(float).values,
+        })
+
+        with self._lock:
+            local = pd.DataFrame([(order_book_id, position.quantity)
+                                  for order_book_id, position in six.iteritems(positions)],
+                                 columns=['order_book_id', 'local_qty'])
+            merged = local.merge(remote, on='order_book_id', how='outer')
+            merged[['local_qty', 'remote_qty']] = merged[['local_qty', 'remote_qty']].fillna(0).astype(int)
+            drift = merged[(merged['local_qty'] != merged['remote_qty']).values &
+                           ~merged['order_book_id'].isin(list(skip_order_book_ids)).values]
+
+            confirmed = drift[np.array([self._pending.get(order_book_id) == remote_qty for order_book_id, remote_qty
+                                        in zip(drift['order_book_id'], drift['remote_qty'])], dtype=bool)]
+            self._pending = dict(zip(drift['order_book_id'], drift['remote_qty']))
+
+            for row in confirmed.itertuples(index=False):
+                position = positions.get_or_create(row.order_book_id)
+                state = position.get_state()
+                state['quantity'] = int(row.remote_qty)
+                if not np.isnan(row.cost_price):
+                    state['avg_price'] = float(row.cost_price)
+                position.set_state(state)
+                self._pending.pop(row.order_book_id, None)
+                system_log.warn("position drift {}: local {} futu {}".format(
+                    row.order_book_id, row.local_qty, row.remote_qty))
+
+            self.reconcile_count += 1
+            if len(confirmed) > 0:
+                self.drift_count += len(confirmed)
+                self.drift_quantity += int(np.abs(confirmed['remote_qty'] - confirmed['local_qty']).sum())
+                self.last_drift = confirmed[['order_book_id', 'local_qty', 'remote_qty']]
+        return confirmed[['order_book_id', 'local_qty', 'remote_qty']]
+
+    def get_metrics(self):
+        """
+        偏差统计的快照
+        :return: dict, reconcile_count 对账次数, drift_count 累计校正的股票次数, drift_quantity 累计校正的股数,
+                 last_drift 最近一次校正的明细 DataFrame(order_book_id, local_qty, remote_qty), 没有校正过时为 None
+        """
+        with self._lock:
+            return {
+                'reconcile_count': self.reconcile_count,
+                'drift_count': self.drift_count,
+                'drift_quantity': self.drift_quantity,
+                'last_drift': None if self.last_drift is None else self.last_drift.copy(),
+            }
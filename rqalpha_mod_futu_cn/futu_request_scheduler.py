@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2017 Futu, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from rqalpha.utils.logger import system_log
+
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+import time
+import six
+
+RET_ERROR = -1
+
+# 出错重试的次数及退避时间(秒)
+MAX_RETRY = 3
+BACKOFF_BASE = 0.1
+BACKOFF_MAX = 5.0
+
+
+def is_freq_limit_error(msg):
+    """OpenD 的限频错误, 需要等待令牌桶重新积累后再请求"""
+    msg = six.text_type(msg).lower()
+    return u'频率' in msg or u'freq' in msg
+
+
+class TokenBucket(object):
+    """令牌桶: 每 period 秒最多 capacity 次请求, 允许短时间内用完积累的令牌"""
+
+    def __init__(self, capacity, period):
+        self._capacity = float(capacity)
+        self._rate = float(capacity) / float(period)
+        self._tokens = self._capacity
+        self._last = time.monotonic()
+        self._lock = Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self._capacity, self._tokens + (now - self._last) * self._rate)
+        self._last = now
+
+    def acquire(self):
+        """取一个令牌, 没有令牌时阻塞到下一个令牌生成"""
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self._rate
+            time.sleep(wait)
+
+    def try_acquire(self):
+        """取一个令牌, 没有令牌时立即返回 False, 不阻塞"""
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+    def available(self):
+        """是否有可用的令牌, 不消耗令牌"""
+        with self._lock:
+            self._refill()
+            return self._tokens >= 1
+
+    def drain(self):
+        """触发了OpenD的限频, 清空令牌, 所有使用这个接口的请求一起等待"""
+        with self._lock:
+            self._refill()
+            self._tokens = min(self._tokens, 0)
+
+
+class FUTURequestScheduler(object):
+    """
+    OpenD 请求调度器
+    1. 每个接口一个令牌桶, 按 OpenD 的接口限频发出请求, 充分利用额度又不触发限频
+    2. 有界线程池, 历史K线、快照等请求可以并发发出
+    3. 出错时按指数退避重试, 遇到限频错误时清空该接口的令牌
+    """
+
+    def __init__(self, quotas, max_workers):
+        self._buckets = {}
+        for api_name, (capacity, period) in six.iteritems(quotas):
+            self._buckets[api_name] = TokenBucket(capacity, period)
+        self._executor = ThreadPoolExecutor(max_workers=max(int(max_workers), 1))
+
+    def call(self, api_name, func, *args, **kwargs):
+        """
+        按接口限频同步调用 func, 出错时退避重试
+        :return: (ret_code, ret_data) 与futu api的返回一致
+        """
+        bucket = self._buckets.get(api_name)
+        backoff = BACKOFF_BASE
+        for i in range(MAX_RETRY):
+            if bucket is not None:
+                bucket.acquire()
+            ret_code, ret_data = func(*args, **kwargs)
+            if ret_code != RET_ERROR:
+                return ret_code, ret_data
+            if bucket is not None and is_freq_limit_error(ret_data):
+                bucket.drain()
+            if i == MAX_RETRY - 1:  # 最后一次失败直接返回, 不再等待
+                break
+            system_log.debug("futu api {} error:{}, retry after {}s".format(api_name, ret_data, backoff))
+            time.sleep(backoff)
+            backoff = min(backoff * 2, BACKOFF_MAX)
+        return ret_code, ret_data
+
+    def submit(self, api_name, func, *args, **kwargs):
+        """在线程池中执行 call, 返回 Future"""
+        return self._executor.submit(self.call, api_name, func, *args, **kwargs)
+
+    def run(self, func, *args, **kwargs):
+        """在线程池中执行 func, 本身不限频也不重试, 用于一次调用会发出多个请求的场景, 由 func 内部逐次 call"""
+        return self._executor.submit(func, *args, **kwargs)
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2017 Futu, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from rqalpha.const import SIDE
+
+from .futu_request_scheduler import TokenBucket
+
+from threading import Lock
+
+
+class FUTURiskGate(object):
+    """
+    下单和改单前的本地风控, 港股和A股的 broker 共用
+    1. 买单的委托数量按每手股数向下取整, 卖单不取整, 零股只能卖出
+    2. 单笔金额上限、未完成订单数上限
+    3. 帐户和单只股票各一个令牌桶限制下单频率, 超出时直接拒单, 避免触发 OpenD 的限频
+    所有检查只访问内存中的数据, 每笔订单 O(1), 不发网络请求
+    """
+
+    def __init__(self, risk_config):
+        self._max_notional = float(risk_config.max_notional)
+        self._max_open_orders = int(risk_config.max_open_orders)
+        self._account_bucket = TokenBucket(*risk_config.account_rate) if risk_config.account_rate else None
+        self._symbol_rate = risk_config.symbol_rate
+        self._symbol_buckets = {}
+        self._lock = Lock()
+
+    @staticmethod
+    def lot_quantity(side, quantity, round_lot):
+        """买单数量按每手股数向下取整; 卖单原样返回, 持仓中的零股只能通过卖单清掉"""
+        round_lot = int(round_lot)
+        if side == SIDE.BUY and round_lot > 1:
+            return quantity // round_lot * round_lot
+        return quantity
+
+    @staticmethod
+    def round_lot(order, round_lot):
+        """委托数量按 lot_quantity 取整, 需要在冻结资金(ORDER_PENDING_NEW)之前调用"""
+        quantity = FUTURiskGate.lot_quantity(order.side, order.quantity, round_lot)
+        if quantity != order.quantity:
+            state = order.get_state()
+            state['quantity'] = quantity
+            order.set_state(state)
+
+    def check(self, order, open_order_count, price=None, quantity=None):
+        """
+        :param order: 待提交或待修改的订单
+        :param open_order_count: 除 order 以外未完成的订单数
+        :param price: 改单后的价格, None 表示订单当前的价格
+        :param quantity: 改单后的数量, None 表示订单当前的数量
+        :return: 拒单原因, 通过时返回 None
+        """
+        price = order.price if price is None else price
+        quantity = order.quantity if quantity is None else quantity
+        if quantity <= 0:
+            return "Order Rejected: {} quantity less than one lot".format(order.order_book_id)
+        if self._max_notional > 0 and price * quantity > self._max_notional:
+            return "Order Rejected: {} notional {:.2f} exceeds max_notional {:.2f}".format(
+                order.order_book_id, price * quantity, self._max_notional)
+        if self._max_open_orders > 0 and open_order_count >= self._max_open_orders:
+            return "Order Rejected: open orders {} reach max_open_orders".format(open_order_count)
+
+        # 两个令牌桶都有令牌时才各取一个, 被单只股票限频拒掉的订单不占用帐户的额度
+        symbol_bucket = self._get_symbol_bucket(order.order_book_id) if self._symbol_rate else None
+        with self._lock:
+            if self._account_bucket is not None and not self._account_bucket.available():
+                return "Order Rejected: account order rate exceeded"
+            if symbol_bucket is not None and not symbol_bucket.available():
+                return "Order Rejected: {} order rate exceeded".format(order.order_book_id)
+            if self._account_bucket is not None:
+                self._account_bucket.try_acquire()
+            if symbol_bucket is not None:
+                symbol_bucket.try_acquire()
+        return None
+
+    def _get_symbol_bucket(self, order_book_id):
+        with self._lock:
+            bucket = self._symbol_buckets.get(order_book_id)
+            if bucket is None:
+                bucket = TokenBucket(*self._symbol_rate)
+                self._symbol_buckets[order_book_id] = bucket
+            return bucket
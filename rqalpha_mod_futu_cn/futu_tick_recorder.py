@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2017 Futu, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from .futu_data_store import TICK_DTYPE, TICK_BOOK_LEVELS, time_key_to_int
+
+from futuquant.open_context import TickerHandlerBase, OrderBookHandlerBase
+from datetime import datetime
+from threading import Lock
+import numpy as np
+import six
+
+RET_ERROR = -1
+
+
+class TickRecorder(object):
+    """
+    把OpenD的逐笔和摆盘推送记录为tick, 追加写入 TickStore, 供tick频率回测回放
+    每只股票维护当天的累计成交和最新摆盘, 每收到一次推送就记录一条完整的tick;
+    逐笔用推送中的成交时间, 摆盘没有时间字段, 用收到推送的本地时间, 同一只股票的时间只增不减
+    """
+
+    def __init__(self, tick_store):
+        self._tick_store = tick_store
+        self._ticks = {}
+        self._lock = Lock()
+
+    def _get_tick(self, code, dt_int):
+        tick = self._ticks.get(code)
+        if tick is None or tick['datetime'] // 1000000000 != dt_int // 1000000000:  # 新的一天重新累计
+            tick = np.zeros(1, dtype=TICK_DTYPE)[0]
+            self._ticks[code] = tick
+        tick['datetime'] = max(tick['datetime'], dt_int)
+        return tick
+
+    def _append(self, code, ticks):
+        day = datetime.strptime(str(ticks[0]['datetime'])[:8], '%Y%m%d').date()
+        self._tick_store.append_day(code, day, ticks)
+
+    def on_ticker(self, ticker_data):
+        """逐笔推送: 一次推送可能包含多笔成交, 每笔记录一条"""
+        dt_ints = time_key_to_int(ticker_data['time'].values) * 1000
+        with self._lock:
+            records = {}
+            for dt_int, row in zip(dt_ints.tolist(), ticker_data.to_dict(orient='records')):
+                code = row['code']
+                tick = self._get_tick(code, dt_int)
+                price = float(row['price'])
+                if tick['open'] == 0:
+                    tick['open'] = tick['high'] = tick['low'] = price
+                tick['high'] = max(tick['high'], price)
+                tick['low'] = min(tick['low'], price)
+                tick['last'] = price
+                tick['volume'] += row['volume']
+                tick['total_turnover'] += row['turnover']
+                records.setdefault(code, []).append(tick.copy())
+            for code, ticks in six.iteritems(records):
+                self._append(code, np.array(ticks, dtype=TICK_DTYPE))
+
+    def on_order_book(self, order_book):
+        """摆盘推送: 更新买卖各档后记录一条"""
+        code = order_book.get('code', order_book.get('stock_code'))
+        dt_int = int(datetime.now().strftime('%Y%m%d%H%M%S%f')[:-3])
+        with self._lock:
+            tick = self._get_tick(code, dt_int)
+            for side, key in (('b', 'Bid'), ('a', 'Ask')):
+                levels = order_book.get(key, [])
+                for level in range(TICK_BOOK_LEVELS):
+                    price, volume = levels[level][:2] if level < len(levels) else (0, 0)
+                    tick['{}{}'.format(side, level + 1)] = price
+                    tick['{}{}_v'.format(side, level + 1)] = volume
+            self._append(code, np.array([tick], dtype=TICK_DTYPE))
+
+
+class TickerRecordHandler(TickerHandlerBase):
+    def __init__(self, recorder):
+        super(TickerRecordHandler, self).__init__()
+        self._recorder = recorder
+
+    def on_recv_rsp(self, rsp_str):
+        ret_code, ret_data = super(TickerRecordHandler, self).on_recv_rsp(rsp_str)
+        if ret_code == RET_ERROR or isinstance(ret_data, str):
+            print("push ticker data error:{}".format(ret_data))
+        elif not ret_data.empty:
+            self._recorder.on_ticker(ret_data)
+        return ret_code, ret_data
+
+
+class OrderBookRecordHandler(OrderBookHandlerBase):
+    def __init__(self, recorder):
+        super(OrderBookRecordHandler, self).__init__()
+        self._recorder = recorder
+
+    def on_recv_rsp(self, rsp_str):
+        ret_code, ret_data = super(OrderBookRecordHandler, self).on_recv_rsp(rsp_str)
+        if ret_code == RET_ERROR or isinstance(ret_data, str):
+            print("push order book data error:{}".format(ret_data))
+        else:
+            self._recorder.on_order_book(ret_data)
+        return ret_code, ret_data
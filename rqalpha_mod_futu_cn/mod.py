@@ -28,7 +28,7 @@ from .futu_utils import *
 from rqalpha.interface import AbstractMod
 from rqalpha.const import DEFAULT_ACCOUNT_TYPE
 
-from futuquant import OpenQuoteContext
+from .open_context_cn import OpenCNQuoteContext
 
 
 class FUTUMod(AbstractMod):
@@ -48,7 +48,8 @@ class FUTUMod(AbstractMod):
     def start_up(self, env, mod_config):
         self._env = env
         self._mod_config = mod_config
-        self._data_cache = DataCache()
+        budget = self._mod_config.futu_cache_budget
+        self._data_cache = DataCache(int(budget.max_instruments), int(budget.max_bytes))
 
         # 需要在用户的策略脚本中配置不加载mod_sys_simulation
         if self._env.config.mod.sys_simulation.enabled or self._env.broker or self._env.event_source:
@@ -69,6 +70,9 @@ class FUTUMod(AbstractMod):
         self._set_data_source()
         self._set_event_source()
         self._env.set_position_model(DEFAULT_ACCOUNT_TYPE.STOCK.name, FUTUStockPosition)
+
+        # 注册扩展API, 如 change_order
+        from . import futu_api
         print(">>> FUTUMod.start_up")
 
     def tear_down(self, success, exception=None):
@@ -101,17 +105,18 @@ class FUTUMod(AbstractMod):
             self._env.set_event_source(event_source)
         elif IsRuntype_RealtimeStrategy():
             market_state_source = FUTUMarketStateSource(self._env, self._quote_context)
-            event_source = FUTUEventForRealtime(self._env, self._mod_config, market_state_source)
+            event_source = FUTUEventForRealtime(self._env, self._mod_config, market_state_source,
+                                                self._data_cache.bar_queue)
             self._env.set_event_source(event_source)
         else:
             raise RuntimeError("_set_event_source err param")
 
     def _set_data_source(self):
-        data_source = FUTUDataSource(self._env, self._quote_context, self._data_cache)  # 支持回测和实时
+        data_source = FUTUDataSource(self._env, self._mod_config, self._quote_context, self._data_cache)  # 支持回测和实时
         if data_source is None:
             raise RuntimeError("_set_data_source err param")
         self._env.set_data_source(data_source)
 
     def _init_quote_context(self):
-        self._quote_context = OpenQuoteContext(str(self._mod_config.api_svr.ip), int(self._mod_config.api_svr.port))
+        self._quote_context = OpenCNQuoteContext(str(self._mod_config.api_svr.ip), int(self._mod_config.api_svr.port))
         return self._quote_context
@@ -2,8 +2,13 @@ import pandas as pd
 
 from futuquant.open_context import *
 from .trade_query_cn import *
+from .quote_query_cn import MultiPointsHisKLine
 from .constant_cn import *
 
+# 多点历史K线每次请求返回的最大K线数, 以及每次请求的最大时间点数
+MULTI_POINTS_MAX_KL_NUM = 10000
+MULTI_POINTS_MAX_DATE_NUM = 250
+
 
 class CNTradeOrderHandlerBase(RspHandlerBase):
     """Base class for handle trader order push"""
@@ -30,6 +35,30 @@ class CNTradeOrderHandlerBase(RspHandlerBase):
         return error_str
 
 
+class CNTradeDealHandlerBase(RspHandlerBase):
+    """Base class for handle trader deal push"""
+
+    def on_recv_rsp(self, rsp_str):
+        """receive response callback function"""
+        ret_code, msg, deal_info = TradePushQueryCN.cn_unpack_deal_push_rsp(rsp_str)
+        deal_list = [deal_info]
+
+        if ret_code == RET_ERROR:
+            return ret_code, msg
+        else:
+            col_list = ['envtype', 'code', 'stock_name', 'dealid', 'orderid',
+                        'qty', 'price', 'order_side', 'time', 'contra_broker_id', 'contra_broker_name'
+                        ]
+
+            trade_frame_table = pd.DataFrame(deal_list, columns=col_list)
+
+            return RET_OK, trade_frame_table
+
+    def on_error(self, error_str):
+        """error callback function"""
+        return error_str
+
+
 class CNTradeOrderPreHandler(RspHandlerBase):
     """class for pre handle trader order push"""
 
@@ -51,6 +80,62 @@ class CNTradeOrderPreHandler(RspHandlerBase):
         return ret_code, None
 
 
+class OpenCNQuoteContext(OpenQuoteContext):
+    """在futuquant行情接口的基础上补充多股票多时间点的历史K线查询(Protocol 1038)"""
+
+    def get_multi_points_history_kline(self, codes, dates, fields=None, ktype='K_DAY', autype='qfq', no_data_mode=0,
+                                       call=None):
+        """
+        一次请求多只股票在多个时间点上的历史K线
+        服务器每次返回的K线数有上限, HasNext 为真时从第一只没有返回完整的股票开始继续请求;
+        时间点按 MULTI_POINTS_MAX_DATE_NUM 分段, 保证每次至少能返回一只股票的完整数据
+        :param codes: 股票代码列表
+        :param dates: 时间点列表, 格式为 'YYYY-MM-DD'
+        :param no_data_mode: 时间点上没有数据时的处理方式, 0 = 返回空数据(data_valid为0)
+        :param call: 分段和翻页产生的每次请求都通过 call(func, **kargs) 发出, 用于逐次限频; None 表示直接请求
+        :return: (ret, data) ret == 0 时, data为DataFrame, 每行对应一只股票的一个时间点
+                            ret != 0 时， data为错误字符串
+        """
+        query_processor = self._get_sync_query_processor(MultiPointsHisKLine.pack_req,
+                                                         MultiPointsHisKLine.unpack_rsp)
+
+        def request(**kargs):
+            ret_code, msg, content = query_processor(**kargs)
+            return (ret_code, content) if ret_code == RET_OK else (ret_code, msg)
+        list_ret = []
+        for i in range(0, len(dates), MULTI_POINTS_MAX_DATE_NUM):
+            req_dates = list(dates[i:i + MULTI_POINTS_MAX_DATE_NUM])
+            req_codes = list(codes)
+            while len(req_codes) > 0:
+                # the keys of kargs should be corresponding to the actual function arguments
+                kargs = {'codes': req_codes, 'dates': req_dates, 'fields': list(fields or []), 'ktype': ktype,
+                         'autype': autype, 'max_num': MULTI_POINTS_MAX_KL_NUM, 'no_data_mode': no_data_mode}
+                ret_code, content = request(**kargs) if call is None else call(request, **kargs)
+                if ret_code != RET_OK:
+                    return RET_ERROR, content
+
+                list_kline, has_next = content
+                if not has_next:
+                    list_ret.extend(list_kline)
+                    break
+
+                # 只保留返回了全部时间点的股票, 其余的下次重新请求
+                point_count = {}
+                for kline in list_kline:
+                    point_count[kline['code']] = point_count.get(kline['code'], 0) + 1
+                finished = set(code for code in point_count if point_count[code] >= len(req_dates))
+                if len(finished) == 0:
+                    return RET_ERROR, ERROR_STR_PREFIX + "multi points kline has no progress"
+                list_ret.extend(kline for kline in list_kline if kline['code'] in finished)
+                req_codes = [code for code in req_codes if code not in finished]
+
+        col_list = ['code', 'time_point', 'data_valid', 'time_key', 'open', 'close', 'high', 'low',
+                    'volume', 'turnover', 'pe_ratio', 'turnover_rate', 'change_rate']
+        kline_frame_table = pd.DataFrame(list_ret, columns=col_list)
+
+        return RET_OK, kline_frame_table
+
+
 class OpenCNTradeContext(OpenContextBase):
     """自定义A股交易接口，这里使用easytrader作为实盘交易接口，统一采用FUTU API定义的通信结构进行交互
     不一样的在于A股的Protocol 为500x，参见trade_query_cn.py
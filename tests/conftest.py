@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+#
+# broker 测试用的 rqalpha 环境和 futu 交易接口替身
+
+import datetime
+import threading
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+
+from rqalpha.const import DEFAULT_ACCOUNT_TYPE, INSTRUMENT_TYPE, RUN_TYPE, SIDE, POSITION_EFFECT
+from rqalpha.environment import Environment
+from rqalpha.model.order import Order, LimitOrder
+from rqalpha.mod.rqalpha_mod_sys_accounts.account_model.stock_account import StockAccount
+from rqalpha.utils import RqAttrDict
+
+from rqalpha_mod_futu_cn.futu_broker_hk import FUTUBrokerHK
+from rqalpha_mod_futu_cn.futu_position import FUTUStockPosition
+
+ROUND_LOT = 100
+
+
+class FakeTradeContext(object):
+    """按调用顺序记录请求的futu交易接口, 订单状态由测试直接修改 self.orders"""
+
+    def __init__(self):
+        self.orders = {}  # futu订单号 -> {'status', 'dealt_qty', 'qty', 'price'}
+        self.deals = []  # (dealid, orderid, qty, price)
+        self.positions = []  # (code, qty, cost_price, can_sell_qty)
+        self.calls = []
+        self.place_gate = None  # 设置为 threading.Event 时 place_order 等待其 set 后才返回
+        self._next_id = 1000
+
+    def place_order(self, price, qty, strcode, orderside, ordertype=0, envtype=0, order_deal_push=False):
+        self.calls.append(('place_order', strcode, qty, price))
+        if self.place_gate is not None:
+            self.place_gate.wait(5)
+        self._next_id += 1
+        fid = str(self._next_id)
+        self.orders[fid] = {'status': 1, 'dealt_qty': 0, 'qty': qty, 'price': price}
+        return 0, self._order_frame([fid])
+
+    def set_order_status(self, status, orderid, envtype=0):
+        self.calls.append(('set_order_status', status, str(orderid)))
+        return 0, None
+
+    def change_order(self, price, qty, orderid, envtype=0):
+        self.calls.append(('change_order', str(orderid), qty, price))
+        self.orders[str(orderid)].update(qty=qty, price=price)
+        return 0, None
+
+    def order_list_query(self, envtype=0):
+        self.calls.append(('order_list_query',))
+        return 0, self._order_frame(list(self.orders))
+
+    def deal_list_query(self, envtype=0):
+        self.calls.append(('deal_list_query',))
+        return 0, self.deal_frame(self.deals)
+
+    def position_list_query(self, envtype=0):
+        return 0, pd.DataFrame(self.positions, columns=['code', 'qty', 'cost_price', 'can_sell_qty'])
+
+    def fill(self, fid, qty, price, status=2):
+        """在futu端成交一笔, 返回对应的成交推送数据"""
+        deal = ('d{}'.format(len(self.deals) + 1), fid, qty, price)
+        self.deals.append(deal)
+        self.orders[fid]['dealt_qty'] += qty
+        self.orders[fid]['status'] = status
+        return self.deal_frame([deal])
+
+    def _order_frame(self, fids):
+        return pd.DataFrame({
+            'orderid': fids,
+            'status': [self.orders[fid]['status'] for fid in fids],
+            'dealt_qty': [self.orders[fid]['dealt_qty'] for fid in fids],
+        })
+
+    @staticmethod
+    def deal_frame(deals):
+        return pd.DataFrame(list(deals), columns=['dealid', 'orderid', 'qty', 'price'])
+
+
+class FakeBroker(FUTUBrokerHK):
+    """换上 FakeTradeContext 的港股 broker, 推送由测试直接调用 _on_order_push/_on_deal_push, 不启动兜底对账"""
+    MARKET = "TEST"
+
+    def __init__(self, env, mod_config, trade_context):
+        self._fake_context = trade_context
+        super(FakeBroker, self).__init__(env, mod_config)
+
+    def _create_trade_context(self):
+        return self._fake_context
+
+    def _thread_order_check(self):
+        pass
+
+
+def make_mod_config(**kwargs):
+    config = {
+        'api_svr': {'ip': '127.0.0.1', 'port': 11111},
+        'futu_order_journal': False,
+        'futu_data_store': None,
+        'futu_order_reconcile_interval': 3600,
+        'futu_position_reconcile_interval': 0,
+        'futu_order_risk': {'max_notional': 0, 'max_open_orders': 0, 'account_rate': None, 'symbol_rate': None},
+    }
+    config.update(kwargs)
+    return RqAttrDict(config)
+
+
+@pytest.fixture
+def env():
+    config = RqAttrDict({
+        'base': {'run_type': RUN_TYPE.PAPER_TRADING, 'start_date': datetime.date(2018, 1, 2),
+                 'accounts': {DEFAULT_ACCOUNT_TYPE.STOCK.name: 1000000}},
+        'mod': {'futu': {'futu_market': 'HK'}},
+    })
+    env = Environment(config)
+    env.calendar_dt = env.trading_dt = datetime.datetime(2018, 1, 2, 10, 0)
+    env.data_proxy = SimpleNamespace(
+        instruments=lambda order_book_id: SimpleNamespace(round_lot=ROUND_LOT, enum_type=INSTRUMENT_TYPE.CS))
+    env.set_account_model(DEFAULT_ACCOUNT_TYPE.STOCK.name, StockAccount)
+    env.set_position_model(DEFAULT_ACCOUNT_TYPE.STOCK.name, FUTUStockPosition)
+    return env
+
+
+@pytest.fixture
+def trade_context():
+    return FakeTradeContext()
+
+
+def create_broker(env, trade_context, **mod_config):
+    broker = FakeBroker(env, make_mod_config(**mod_config), trade_context)
+    env.broker = broker
+    env.portfolio = broker.get_portfolio()
+    return broker
+
+
+@pytest.fixture
+def broker(env, trade_context):
+    return create_broker(env, trade_context)
+
+
+def make_order(order_book_id, quantity, price, side=SIDE.BUY):
+    return Order.__from_create__(order_book_id, quantity, side, LimitOrder(price), POSITION_EFFECT.OPEN)
+
+
+def wait_until(predicate, timeout=5):
+    event = threading.Event()
+    deadline = datetime.datetime.now() + datetime.timedelta(seconds=timeout)
+    while not predicate():
+        if datetime.datetime.now() > deadline:
+            raise AssertionError("timeout")
+        event.wait(0.01)
@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+
+import threading
+
+from rqalpha.const import ORDER_STATUS, SIDE
+
+from rqalpha_mod_futu_cn import futu_broker_base
+from rqalpha_mod_futu_cn.futu_order_journal import FUTUOrderJournal
+
+from conftest import create_broker, make_order, wait_until
+
+
+def _stock_account(env):
+    return env.portfolio.accounts['STOCK']
+
+
+def test_cancel_inflight_order_is_sent_after_place_returns(env, broker, trade_context):
+    trade_context.place_gate = threading.Event()
+    order = make_order('HK.00700', 200, 300.)
+    broker.submit_order(order)
+    wait_until(lambda: len(trade_context.calls) > 0)
+
+    # 下单请求还没返回, 订单仍是未完成订单
+    assert broker.get_open_orders() == [order]
+    broker.cancel_order(order)
+    assert trade_context.calls == [('place_order', 'HK.00700', 200, 300.)]
+
+    trade_context.place_gate.set()
+    wait_until(lambda: ('set_order_status', 0, '1001') in trade_context.calls)
+    assert broker.get_open_orders() == [order]
+
+    trade_context.orders['1001']['status'] = 6
+    broker._on_order_push(trade_context._order_frame(['1001']))
+    assert order.status == ORDER_STATUS.CANCELLED
+    assert broker.get_open_orders() == []
+    assert _stock_account(env).frozen_cash == 0
+
+
+def test_place_order_exception_rejects_order(env, broker, trade_context):
+    def place_order(*args, **kwargs):
+        raise IOError("connection lost")
+
+    trade_context.place_order = place_order
+    order = make_order('HK.00700', 100, 300.)
+    broker.submit_order(order)
+    wait_until(lambda: order.is_final())
+    assert order.status == ORDER_STATUS.REJECTED
+    assert broker.get_open_orders() == []
+    assert _stock_account(env).frozen_cash == 0
+
+
+def test_cancel_queued_order_is_not_sent(env, broker, trade_context):
+    trade_context.place_gate = threading.Event()
+    first = make_order('HK.00700', 100, 300.)
+    second = make_order('HK.00700', 100, 301.)
+    broker.submit_order(first)
+    broker.submit_order(second)
+    wait_until(lambda: len(trade_context.calls) > 0)
+
+    broker.cancel_order(second)
+    assert second.status == ORDER_STATUS.CANCELLED
+    trade_context.place_gate.set()
+    wait_until(lambda: len(broker._submitter) == 0)
+    assert [call for call in trade_context.calls if call[0] == 'place_order'] == [
+        ('place_order', 'HK.00700', 100, 300.)]
+    assert _stock_account(env).frozen_cash == 100 * 300.
+
+
+def test_cancel_orders_waits_for_inflight_order_before_reconcile(env, broker, trade_context):
+    trade_context.place_gate = threading.Event()
+    order = make_order('HK.00700', 100, 300.)
+    broker.submit_order(order)
+    wait_until(lambda: len(trade_context.calls) > 0)
+
+    threading.Timer(0.05, trade_context.place_gate.set).start()
+    assert broker.cancel_orders() == [order]
+    assert [call[0] for call in trade_context.calls] == ['place_order', 'set_order_status', 'order_list_query']
+
+
+def test_market_close_sweep_covers_inflight_order(env, broker, trade_context):
+    trade_context.place_gate = threading.Event()
+    order = make_order('HK.00700', 100, 300.)
+    broker.submit_order(order)
+    wait_until(lambda: len(trade_context.calls) > 0)
+
+    threading.Timer(0.05, trade_context.place_gate.set).start()
+    broker._pre_after_trading(None)
+    assert ('set_order_status', 0, '1001') in trade_context.calls
+    assert order.is_final()
+    assert broker.get_open_orders() == []
+    assert _stock_account(env).frozen_cash == 0
+
+
+def _place(broker, order):
+    broker.submit_order(order)
+    wait_until(lambda: broker._open_orders.get_futu_order_id(order) is not None)
+    return broker._open_orders.get_futu_order_id(order)
+
+
+def test_order_push_applies_status_of_each_order(env, broker, trade_context):
+    expired, deleted, working = [make_order('HK.00700', 100, 10.) for __ in range(3)]
+    fids = [_place(broker, order) for order in (expired, deleted, working)]
+    trade_context.orders[fids[0]]['status'] = 4
+    trade_context.orders[fids[1]]['status'] = 7
+    trade_context.orders['9999'] = {'status': 6, 'dealt_qty': 0, 'qty': 100, 'price': 10.}  # 其他客户端的订单
+
+    broker._on_order_push(trade_context._order_frame(fids + ['9999']))
+    assert expired.status == ORDER_STATUS.REJECTED and deleted.status == ORDER_STATUS.REJECTED
+    assert working.status == ORDER_STATUS.ACTIVE
+    assert broker.get_open_orders() == [working]
+    assert _stock_account(env).frozen_cash == 100 * 10.
+    assert [call[0] for call in trade_context.calls].count('order_list_query') == 0
+
+
+def test_amend_buy_after_partial_fill_freezes_unfilled_only(env, broker, trade_context):
+    order = make_order('HK.00700', 300, 10.)
+    fid = _place(broker, order)
+    broker._on_deal_push(trade_context.fill(fid, 100, 9.9))
+    assert _stock_account(env).frozen_cash == 200 * 10.
+
+    assert broker.change_order(order, 11., 500)
+    assert order.quantity == 500 and order.filled_quantity == 100
+    assert _stock_account(env).frozen_cash == 400 * 11.
+
+    broker._on_deal_push(trade_context.fill(fid, 400, 11., status=3))
+    assert order.status == ORDER_STATUS.FILLED
+    assert _stock_account(env).frozen_cash == 0
+
+
+def test_amend_buy_uses_account_frozen_cash_formula(env, broker, trade_context, monkeypatch):
+    # 含预估交易费用的帐户算法, 与 rqalpha 新版本 StockAccount._frozen_cash_of_order 一样
+    def frozen_cash_of_order(account, order):
+        return order.frozen_price * order.unfilled_quantity * 1.001
+
+    monkeypatch.setattr(type(_stock_account(env)), '_frozen_cash_of_order', frozen_cash_of_order, raising=False)
+    order = make_order('HK.00700', 300, 10.)
+    fid = _place(broker, order)
+    broker._on_deal_push(trade_context.fill(fid, 100, 10.))
+    frozen_cash = _stock_account(env).frozen_cash
+
+    assert broker.change_order(order, 11., 500)
+    assert abs(_stock_account(env).frozen_cash - frozen_cash - (400 * 11. - 200 * 10.) * 1.001) < 1e-6
+
+
+def test_amend_sell_after_partial_fill_freezes_unfilled_only(env, trade_context):
+    trade_context.positions = [('HK.00700', 1000, 8., 1000)]
+    broker = create_broker(env, trade_context)
+    position = _stock_account(env).positions['HK.00700']
+    order = make_order('HK.00700', 300, 10., side=SIDE.SELL)
+    fid = _place(broker, order)
+    broker._on_deal_push(trade_context.fill(fid, 100, 10.))
+    assert position.quantity == 900 and position.sellable == 700
+
+    assert broker.change_order(order, 10.5, 200)
+    assert position.sellable == 800
+
+    trade_context.orders[fid]['status'] = 6
+    broker._on_order_push(trade_context._order_frame([fid]))
+    assert order.status == ORDER_STATUS.CANCELLED
+    assert position.sellable == 900
+
+
+def test_amend_queued_order(env, broker, trade_context):
+    trade_context.place_gate = threading.Event()
+    first = make_order('HK.00700', 100, 10.)
+    second = make_order('HK.00700', 100, 10.)
+    broker.submit_order(first)
+    broker.submit_order(second)
+    wait_until(lambda: len(trade_context.calls) > 0)
+
+    assert broker.change_order(second, 12., 200)
+    assert _stock_account(env).frozen_cash == 100 * 10. + 200 * 12.
+    trade_context.place_gate.set()
+    wait_until(lambda: len(broker._submitter) == 0)
+    assert trade_context.calls[-1] == ('place_order', 'HK.00700', 200, 12.)
+
+
+def test_restored_buy_order_keeps_frozen_cash_consistent(env, trade_context, tmp_path):
+    journal = FUTUOrderJournal(str(tmp_path), "TEST_1")
+    journal_order = make_order('HK.00700', 300, 10.)
+    journal_order.active()
+    journal.record('submit', journal_order, 1001)
+    wait_until(lambda: len(FUTUOrderJournal(str(tmp_path), "TEST_1").replay()) == 1)
+
+    # 停机期间成交了100股
+    trade_context.orders['1001'] = {'status': 2, 'dealt_qty': 0, 'qty': 300, 'price': 10.}
+    deal_push = trade_context.fill('1001', 100, 10.)
+    trade_context.positions = [('HK.00700', 100, 10., 100)]
+    broker = create_broker(env, trade_context, futu_order_journal=True, futu_data_store=str(tmp_path))
+    order, = broker.get_open_orders()
+    assert order.filled_quantity == 100
+    assert _stock_account(env).frozen_cash == 200 * 10.
+
+    broker._on_deal_push(deal_push)  # 推送重发, 不重复记账
+    assert order.filled_quantity == 100
+    broker._on_deal_push(trade_context.fill('1001', 100, 10.))
+    assert _stock_account(env).frozen_cash == 100 * 10.
+
+    trade_context.orders['1001']['status'] = 6
+    broker._on_order_push(trade_context._order_frame(['1001']))
+    assert order.status == ORDER_STATUS.CANCELLED
+    assert _stock_account(env).frozen_cash == 0
+
+
+def test_amend_goes_through_risk_gate(env, trade_context):
+    broker = create_broker(env, trade_context, futu_order_risk={
+        'max_notional': 5000, 'max_open_orders': 0, 'account_rate': (2, 3600), 'symbol_rate': None})
+    order = make_order('HK.00700', 300, 10.)
+    _place(broker, order)
+
+    assert not broker.change_order(order, 10., 600)  # 超过单笔金额上限
+    assert broker.change_order(order, 10., 450)  # 买单按每手取整为 400
+    assert order.quantity == 400
+    assert not broker.change_order(order, 11., 400)  # 帐户令牌已用完
+    assert order.price == 10.
+    assert [call[0] for call in trade_context.calls] == ['place_order', 'change_order']
+
+
+def test_final_status_before_deal_push_waits_for_deals(env, broker, trade_context):
+    order = make_order('HK.00700', 300, 10.)
+    fid = _place(broker, order)
+
+    deal_push = trade_context.fill(fid, 300, 9.9, status=3)
+    broker._on_order_push(trade_context._order_frame([fid]))
+    assert not order.is_final()
+    assert broker.get_open_orders() == [order]
+
+    broker._on_deal_push(deal_push)
+    assert order.status == ORDER_STATUS.FILLED
+    assert broker.get_open_orders() == []
+    assert _stock_account(env).frozen_cash == 0
+    assert ('deal_list_query',) not in trade_context.calls
+
+
+def test_cancelled_status_before_deal_push_books_partial_fill(env, broker, trade_context):
+    order = make_order('HK.00700', 300, 10.)
+    fid = _place(broker, order)
+
+    deal_push = trade_context.fill(fid, 100, 10., status=6)
+    broker._on_order_push(trade_context._order_frame([fid]))
+    assert not order.is_final()
+
+    broker._on_deal_push(deal_push)
+    assert order.status == ORDER_STATUS.CANCELLED and order.filled_quantity == 100
+    assert _stock_account(env).positions['HK.00700'].quantity == 100
+    assert _stock_account(env).frozen_cash == 0
+
+
+def test_missing_deal_push_is_queried_after_timeout(env, broker, trade_context, monkeypatch):
+    monkeypatch.setattr(futu_broker_base, 'DEAL_WAIT_TIMEOUT', 0.05)
+    order = make_order('HK.00700', 300, 10.)
+    fid = _place(broker, order)
+
+    trade_context.fill(fid, 300, 10., status=3)  # 成交推送丢失
+    broker._on_order_push(trade_context._order_frame([fid]))
+    assert ('deal_list_query',) not in trade_context.calls
+
+    wait_until(lambda: order.is_final())
+    assert order.status == ORDER_STATUS.FILLED
+    assert ('deal_list_query',) in trade_context.calls
+    assert broker.get_open_orders() == []
+
+
+def test_full_reconcile_joins_order_list_by_order_id(env, broker, trade_context):
+    cancelled, working, duplicated = [make_order('HK.00700', 100, 10.) for __ in range(3)]
+    fids = [_place(broker, order) for order in (cancelled, working, duplicated)]
+    trade_context.orders[fids[0]]['status'] = 6
+    trade_context.orders['9999'] = {'status': 3, 'dealt_qty': 100, 'qty': 100, 'price': 10.}
+
+    broker._check_open_orders()
+    assert cancelled.status == ORDER_STATUS.CANCELLED
+    assert broker.get_open_orders() == [working, duplicated]
+
+    # 同一订单号有多条, 无法确定状态, 本次跳过
+    pd_data = trade_context._order_frame([fids[2], fids[2]])
+    pd_data.loc[0, 'status'] = 6
+    broker._update_open_orders(pd_data)
+    assert duplicated.status == ORDER_STATUS.ACTIVE
+
+    trade_context.orders[fids[2]]['status'] = 6
+    broker._update_open_orders(trade_context._order_frame(fids))
+    assert duplicated.status == ORDER_STATUS.CANCELLED
+    assert broker.get_open_orders() == [working]
+    assert _stock_account(env).frozen_cash == 100 * 10.
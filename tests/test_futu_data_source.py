@@ -0,0 +1,325 @@
+# -*- coding: utf-8 -*-
+
+import threading
+from datetime import date, datetime, timedelta
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+
+from rqalpha_mod_futu_cn import futu_data_source, futu_request_scheduler
+from rqalpha_mod_futu_cn.futu_data_source import FUTUDataSource, RET_OK
+from rqalpha_mod_futu_cn.futu_data_store import KLINE_DTYPE, TICK_DTYPE, KlineStore, InstrumentStore, TickStore
+from rqalpha_mod_futu_cn.futu_request_scheduler import FUTURequestScheduler
+
+
+def _minute_source(bars_of_day):
+    """只替换按天取分钟K线块的部分, 记录请求过的日期"""
+    ds = FUTUDataSource.__new__(FUTUDataSource)
+    ds.requested_days = []
+
+    def get_minute_chunk(instrument, ktype, day):
+        ds.requested_days.append(day)
+        bars = np.zeros(bars_of_day(day) if day.weekday() < 5 else 0, dtype=KLINE_DTYPE)
+        bars['datetime'] = int(day.strftime('%Y%m%d')) * 1000000 + 93000 + np.arange(len(bars))
+        return RET_OK, bars
+
+    ds._get_minute_chunk = get_minute_chunk
+    ds.available_data_range = lambda frequency: (date(2000, 1, 4), date.today())
+    return ds
+
+
+_INSTRUMENT = SimpleNamespace(order_book_id='HK.00700', listed_date=datetime(2004, 6, 16))
+
+
+def test_minute_walk_back_stops_after_empty_days():
+    ds = _minute_source(lambda day: 0)  # 长期停牌
+    ret_code, bars = ds._get_minute_bars(_INSTRUMENT, 'K_1M', datetime(2018, 6, 1, 15, 0), 10)
+    assert ret_code == RET_OK and len(bars) == 0
+    weekdays = [day for day in ds.requested_days if day.weekday() < 5]
+    assert len(weekdays) == futu_data_source.MINUTE_MAX_EMPTY_DAYS
+
+
+def test_minute_walk_back_is_capped_by_bar_count():
+    # 每个工作日只有1根bar, 远少于估算用的每天240根, 最多只往前找估算出的天数
+    ds = _minute_source(lambda day: 1)
+    dt = datetime(2018, 6, 1, 15, 0)
+    ret_code, bars = ds._get_minute_bars(_INSTRUMENT, 'K_1M', dt, 480)
+    assert ret_code == RET_OK and len(bars) < 480
+    assert dt.date() - min(ds.requested_days) <= timedelta(days=3 * 7 // 5 + futu_data_source.MINUTE_WALK_BACK_MARGIN)
+
+
+def test_minute_walk_back_returns_last_bars():
+    ds = _minute_source(lambda day: 240)
+    ret_code, bars = ds._get_minute_bars(_INSTRUMENT, 'K_1M', datetime(2018, 6, 4, 9, 31), 300)
+    assert ret_code == RET_OK and len(bars) == 300
+    assert bars['datetime'][-1] == 20180604093100
+    assert np.all(np.diff(bars['datetime']) > 0)
+
+
+def _tick_source(tmp_path, ticks_by_code, day):
+    ds = FUTUDataSource.__new__(FUTUDataSource)
+    ds._tick_store = TickStore(str(tmp_path))
+    ds._tick_replay_date = None
+    ds._tick_replay_pos = {}
+    for code, datetimes in ticks_by_code.items():
+        ticks = np.zeros(len(datetimes), dtype=TICK_DTYPE)
+        ticks['datetime'] = datetimes
+        ds._tick_store.append_day(code, day, ticks)
+    return ds
+
+
+def test_merge_ticks_resumes_per_code_after_universe_change(tmp_path):
+    day = date(2018, 1, 2)
+    t1, t2 = 20180102093000000, 20180102093001000
+    ds = _tick_source(tmp_path, {'A': [t1, t2], 'B': [t1, t2], 'C': [t1, t2]}, day)
+
+    replayed = []
+    for tick in ds.get_merge_ticks(['A', 'B'], day):
+        replayed.append((tick.order_book_id, tick.datetime))
+        break  # 产出 A@t1 后股票池加入 C
+    last_dt = replayed[-1][1]
+    replayed += [(tick.order_book_id, tick.datetime) for tick in ds.get_merge_ticks(['A', 'B', 'C'], day, last_dt)]
+
+    dt1, dt2 = datetime(2018, 1, 2, 9, 30, 0), datetime(2018, 1, 2, 9, 30, 1)
+    assert replayed == [('A', dt1), ('B', dt1), ('C', dt1), ('A', dt2), ('B', dt2), ('C', dt2)]
+
+
+def test_merge_ticks_restarts_code_that_rejoins_universe(tmp_path):
+    day = date(2018, 1, 2)
+    t1, t2, t3 = 20180102093000000, 20180102093001000, 20180102093002000
+    ds = _tick_source(tmp_path, {'A': [t1, t2, t3], 'B': [t1, t2, t3]}, day)
+
+    def replay(codes, last_dt, count):
+        ticks = ds.get_merge_ticks(codes, day, last_dt)
+        return [(tick.order_book_id, tick.datetime) for __, tick in zip(range(count), ticks)]
+
+    replayed = replay(['A', 'B'], None, 2)  # A@t1, B@t1
+    replayed += replay(['A'], replayed[-1][1], 2)  # 移出 B 后产出 A@t2, A@t3
+    replayed += replay(['A', 'B'], replayed[-1][1], 10)  # B 重新加入
+
+    dt1, dt3 = datetime(2018, 1, 2, 9, 30, 0), datetime(2018, 1, 2, 9, 30, 2)
+    assert replayed[-1] == ('B', dt3)
+    assert [dt for __, dt in replayed] == sorted(dt for __, dt in replayed)
+    assert ('B', dt1) not in replayed[2:]
+
+
+def _array(nbytes):
+    return np.zeros(nbytes, dtype=np.uint8)
+
+
+def test_lru_kline_cache_get_updates_recency():
+    evicted = []
+    cache = futu_data_source.LRUKlineCache(max_instruments=2, on_evict=evicted.append)
+    cache['A'] = _array(1)
+    cache['B'] = _array(1)
+    assert cache.get('A') is not None
+    assert cache.get('C') is None
+    cache['C'] = _array(1)
+    assert evicted == ['B'] and list(cache) == ['A', 'C']
+
+
+def test_lru_kline_cache_byte_budget():
+    cache = futu_data_source.LRUKlineCache(max_bytes=10)
+    cache['A'] = _array(4)
+    cache['B'] = _array(4)
+    cache['A'] = _array(6)  # 覆盖写入时先扣掉旧值
+    assert cache.nbytes == 10 and list(cache) == ['B', 'A']
+    cache['C'] = _array(20)  # 超出预算时至少保留刚写入的
+    assert list(cache) == ['C'] and cache.nbytes == 20
+    cache.pop('C')
+    assert cache.nbytes == 0
+
+
+def _daily_bars(days, close=1.):
+    bars = np.zeros(len(days), dtype=KLINE_DTYPE)
+    bars['datetime'] = [int(day.strftime('%Y%m%d')) * 1000000 for day in days]
+    bars['close'] = close
+    return bars
+
+
+def test_prefetch_merges_tail_of_evicted_code_into_store(tmp_path):
+    today = date.today()
+    stored_days = [today - timedelta(days=i) for i in range(400, 1, -1)]
+    codes = ['HK.0000{}'.format(i) for i in range(5)]
+    ds = FUTUDataSource.__new__(FUTUDataSource)
+    ds._cache = futu_data_source.DataCache(max_instruments=2)._cache
+    ds._incremental_sync = True
+    ds._kline_store = KlineStore(str(tmp_path))
+    ds._scheduler = FUTURequestScheduler({}, 2)
+    for code in codes:
+        ds._kline_store.save(code, 'K_DAY', 'qfq', _daily_bars(stored_days))
+
+    def request_multi_points_kline(market, start, end, request_codes):
+        tail_days = [stored_days[-1], today - timedelta(days=1)]
+        return RET_OK, pd.DataFrame({
+            'code': [code for code in request_codes for __ in tail_days],
+            'time_key': [day.strftime('%Y-%m-%d 00:00:00') for __ in request_codes for day in tail_days],
+            'open': 1., 'high': 1., 'low': 1., 'close': 1., 'volume': 0, 'turnover': 0., 'data_valid': 1,
+        })
+
+    ds._request_multi_points_kline = request_multi_points_kline
+    ds.prefetch_history(codes)
+
+    # 缓存只能放2只股票, 其余在合并时被淘汰, 落盘的仍是完整历史加上新的一天
+    assert len(ds._cache['history_kline']) == 2
+    for code in codes:
+        assert len(ds._kline_store.load(code)) == len(stored_days) + 1
+
+
+def test_trading_calendar_retries_through_scheduler(monkeypatch):
+    monkeypatch.setattr(futu_request_scheduler, 'BACKOFF_BASE', 0)
+    replies = [(futu_data_source.RET_ERROR, "network error"), (RET_OK, ['2018-01-03', '2018-01-02'])]
+    calls = []
+
+    def get_trading_days(market, start_date, end_date):
+        calls.append((market, start_date, end_date))
+        return replies.pop(0)
+
+    ds = FUTUDataSource.__new__(FUTUDataSource)
+    ds._env = SimpleNamespace(config=SimpleNamespace(base=SimpleNamespace(
+        start_date=date(2018, 1, 2), end_date=date(2018, 1, 3))))
+    ds._cache = futu_data_source.DataCache()._cache
+    ds._quote_context = SimpleNamespace(get_trading_days=get_trading_days)
+    ds._scheduler = FUTURequestScheduler({'get_trading_days': (10, 30)}, 1)
+
+    calendar = ds.get_trading_calendar()
+    assert calls == [('HK', '2018-01-02', '2018-01-03')] * 2
+    assert list(calendar) == [pd.Timestamp('2018-01-02'), pd.Timestamp('2018-01-03')]
+
+
+def test_missing_snapshot_is_cached_until_ttl(monkeypatch):
+    now = [1000.]
+    monkeypatch.setattr(futu_data_source.time, 'time', lambda: now[0])
+    requests = []
+
+    def get_market_snapshot(codes):
+        requests.append(codes)
+        return RET_OK, pd.DataFrame({'code': [code for code in codes if code != 'HK.00001'], 'suspension': False})
+
+    ds = FUTUDataSource.__new__(FUTUDataSource)
+    ds._env = SimpleNamespace(get_universe=lambda: ['HK.00700', 'HK.00001'])
+    ds._mod_config = SimpleNamespace(futu_snapshot_ttl=3)
+    ds._cache = futu_data_source.DataCache()._cache
+    ds._quote_context = SimpleNamespace(get_market_snapshot=get_market_snapshot)
+    ds._scheduler = FUTURequestScheduler({}, 1)
+
+    # 已退市的股票没有快照, 过期前重复访问不再刷新
+    assert ds._get_snapshot('HK.00001') is None
+    assert ds._get_snapshot('HK.00001') is None
+    assert ds._get_snapshot('HK.00700')['code'] == 'HK.00700'
+    assert requests == [['HK.00001', 'HK.00700']]
+
+    now[0] += 4
+    assert ds._get_snapshot('HK.00001') is None
+    assert len(requests) == 2
+
+
+def _history_source(history_days, close=1.):
+    ds = FUTUDataSource.__new__(FUTUDataSource)
+    ds._cache = futu_data_source.DataCache()._cache
+    ds._kline_store = None
+    ds._set_history_data('HK.00700', _daily_bars(history_days, close))
+    return ds
+
+
+def test_merge_history_tail_appends_new_bars():
+    today = date.today()
+    days = [today - timedelta(days=i) for i in range(5, 1, -1)]
+    ds = _history_source(days)
+    tail = _daily_bars([days[-1], today - timedelta(days=1), today])
+
+    assert ds._merge_history_tail('HK.00700', tail)
+    history = ds._cache['history_kline']['HK.00700']
+    assert len(history) == len(days) + 2
+    assert ds._cache['history_kline_last']['HK.00700'] == tail['datetime'][1]
+    assert ds._cache['history_kline_synced']['HK.00700'] == today
+
+
+def test_merge_history_tail_detects_qfq_change():
+    today = date.today()
+    days = [today - timedelta(days=i) for i in range(5, 1, -1)]
+    ds = _history_source(days)
+    # 重叠的那一天前复权价格变了(除权除息), 需要重新全量拉取
+    tail = _daily_bars([days[-1], today - timedelta(days=1)], close=0.9)
+
+    assert not ds._merge_history_tail('HK.00700', tail)
+    assert len(ds._cache['history_kline']['HK.00700']) == len(days)
+    assert 'HK.00700' not in ds._cache['history_kline_synced']
+
+
+def test_sync_history_tail_refetches_after_qfq_change():
+    today = date.today()
+    days = [today - timedelta(days=i) for i in range(5, 1, -1)]
+    ds = _history_source(days)
+    ds._incremental_sync = True
+    ds._scheduler = FUTURequestScheduler({}, 1)
+    ds._drop_minute_history = lambda order_book_id: None
+    full_history = _daily_bars(days + [today - timedelta(days=1)], close=0.9)
+    ds._get_history_cache = lambda instrument, use_store=True: (RET_OK, full_history)
+    ds._request_history_kline = lambda order_book_id, start, end, ktype='K_DAY': \
+        (RET_OK, _daily_bars([days[-1]], close=0.9))
+
+    ret_code, history = ds._get_history_data(_INSTRUMENT)
+    assert ret_code == RET_OK and history is full_history
+
+
+def test_history_bars_returns_view_of_cache():
+    days = [date(2018, 1, d) for d in range(2, 10)]
+    ds = _history_source(days)
+    ds._incremental_sync = False
+    history = ds._cache['history_kline']['HK.00700']
+
+    bars = ds.history_bars(_INSTRUMENT, 3, '1d', None, datetime(2018, 1, 6, 15, 0))
+    assert bars['datetime'].tolist() == [20180104000000, 20180105000000, 20180106000000]
+    assert np.shares_memory(bars, history)
+    assert len(ds.history_bars(_INSTRUMENT, 100, '1d', 'close', datetime(2018, 1, 3))) == 2
+    assert len(ds.history_bars(_INSTRUMENT, 3, '1d', None, datetime(2018, 1, 1))) == 0
+
+
+def test_instrument_cache_uses_store_until_ttl(tmp_path):
+    fetched = []
+    ds = FUTUDataSource.__new__(FUTUDataSource)
+    ds._cache = futu_data_source.DataCache()._cache
+    ds._mod_config = SimpleNamespace(futu_instrument_ttl=SimpleNamespace(HK=3600))
+    ds._instrument_store = InstrumentStore(str(tmp_path))
+    ds._get_basicinfo_cache = lambda market: fetched.append(market) or (RET_OK, [{'order_book_id': 'HK.00700'}])
+
+    assert ds._get_instrument_cache('HK') == (RET_OK, [{'order_book_id': 'HK.00700'}])
+    # 新进程只有本地存储, 未过期时不再从futu拉取
+    ds._cache = futu_data_source.DataCache()._cache
+    assert ds._get_instrument_cache('HK') == (RET_OK, [{'order_book_id': 'HK.00700'}])
+    assert fetched == ['HK']
+
+    ds._cache = futu_data_source.DataCache()._cache
+    ds._mod_config.futu_instrument_ttl.HK = -1
+    ds._get_instrument_cache('HK')
+    assert fetched == ['HK', 'HK']
+
+
+def test_basicinfo_types_are_fetched_concurrently():
+    stock_types = [stock_type for stock_type, __ in futu_data_source.BASICINFO_STOCK_TYPES['HK']]
+    barrier = threading.Barrier(len(stock_types), timeout=5)
+    requested = []
+
+    def get_stock_basicinfo(market, stock_type):
+        if stock_type not in requested:  # 各类型的第一次请求全部同时在途, 逐个请求时这里会超时
+            requested.append(stock_type)
+            barrier.wait()
+        if stock_type == 'BOND':
+            return futu_data_source.RET_ERROR, "bond error"
+        return RET_OK, pd.DataFrame({
+            'code': ['HK.{}'.format(stock_type)], 'name': [stock_type], 'stock_type': [stock_type],
+            'listing_date': ['2004-06-16'], 'lot_size': [100], 'stock_child_type': [''], 'owner_stock_code': [''],
+        })
+
+    ds = FUTUDataSource.__new__(FUTUDataSource)
+    ds._cache = futu_data_source.DataCache()._cache
+    ds._quote_context = SimpleNamespace(get_stock_basicinfo=get_stock_basicinfo)
+    ds._scheduler = FUTURequestScheduler({}, len(stock_types))
+
+    ret_code, records = ds._get_basicinfo_cache('HK')
+    assert ret_code == futu_data_source.RET_ERROR  # 有类型拉取失败, 不落盘
+    assert [(r['order_book_id'], r['type']) for r in records] == [
+        ('HK.STOCK', 'CS'), ('HK.IDX', 'INDX'), ('HK.ETF', 'ETF'), ('HK.WARRANT', 'CS')]
+    assert records[0]['de_listed_date'] == '2999-12-31' and records[0]['round_lot'] == 100
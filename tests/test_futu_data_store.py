@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+from datetime import date
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from rqalpha_mod_futu_cn.futu_data_store import KlineStore, InstrumentStore, TickStore, KLINE_DTYPE, TICK_DTYPE, \
+    time_key_to_int, frame_to_kline_array, merge_tick_streams
+
+
+def _bars(datetimes, close=1.):
+    bars = np.zeros(len(datetimes), dtype=KLINE_DTYPE)
+    bars['datetime'] = datetimes
+    bars['close'] = close
+    return bars
+
+
+def test_time_key_to_int():
+    result = time_key_to_int(['2018-01-02 09:30:00', '1999-12-31 23:59:59'])
+    assert result.dtype == np.int64
+    assert result.tolist() == [20180102093000, 19991231235959]
+
+
+@pytest.mark.parametrize('time_keys', [
+    ['2018-01-02'],
+    ['2018-01-02 09:30:00', '2018-01-02'],
+    ['2018-01-02 09:30:00.000'],
+    ['2018-01-02 09:3x:00'],
+])
+def test_time_key_to_int_rejects_other_formats(time_keys):
+    with pytest.raises(ValueError):
+        time_key_to_int(time_keys)
+
+
+def test_frame_to_kline_array_sorts_by_datetime():
+    frame = pd.DataFrame({
+        'time_key': ['2018-01-03 00:00:00', '2018-01-02 00:00:00'],
+        'open': [2., 1.], 'high': [2., 1.], 'low': [2., 1.], 'close': [2., 1.],
+        'volume': [200, 100], 'turnover': [400., 100.],
+    })
+    bars = frame_to_kline_array(frame)
+    assert bars.dtype == KLINE_DTYPE
+    assert bars['datetime'].tolist() == [20180102000000, 20180103000000]
+    assert bars['close'].tolist() == [1., 2.]
+    assert bars['total_turnover'].tolist() == [100., 400.]
+
+
+def test_merge_tick_streams_orders_by_time_then_stream():
+    a = np.zeros(3, dtype=TICK_DTYPE)
+    a['datetime'] = [1, 3, 5]
+    b = np.zeros(3, dtype=TICK_DTYPE)
+    b['datetime'] = [2, 3, 4]
+    assert list(merge_tick_streams([(a, 0), (b, 1)])) == [(0, 0), (0, 1), (1, 1), (1, 2), (0, 2)]
+
+
+def test_kline_store_rewrites_loaded_daily_file(tmp_path):
+    store = KlineStore(str(tmp_path))
+    assert store.load('HK.00700') is None
+    store.save('HK.00700', 'K_DAY', 'qfq', _bars([20180102000000]))
+    loaded = store.load('HK.00700')
+    assert not isinstance(loaded, np.memmap)
+
+    # 已读取的日K在同步尾部后整体重写
+    store.save('HK.00700', 'K_DAY', 'qfq', np.concatenate([loaded, _bars([20180103000000])]))
+    assert store.load('HK.00700')['datetime'].tolist() == [20180102000000, 20180103000000]
+
+
+def test_kline_store_day_chunks_are_written_once(tmp_path):
+    store = KlineStore(str(tmp_path))
+    day = date(2018, 1, 2)
+    assert store.load_day('HK.00700', 'K_1M', 'qfq', day) is None
+    store.save_day('HK.00700', 'K_1M', 'qfq', day, _bars([20180102093000]))
+    chunk = store.load_day('HK.00700', 'K_1M', 'qfq', day)
+    store.save_day('HK.00700', 'K_1M', 'qfq', day, _bars([20180102093000], close=2.))
+    assert store.load_day('HK.00700', 'K_1M', 'qfq', day)['close'].tolist() == [1.]
+    assert chunk['close'].tolist() == [1.]
+
+    store.remove_days('HK.00700')
+    del chunk
+    assert store.load_day('HK.00700', 'K_1M', 'qfq', day) is None
+
+
+def test_tick_store_appends(tmp_path):
+    store = TickStore(str(tmp_path))
+    day = date(2018, 1, 2)
+    ticks = np.zeros(2, dtype=TICK_DTYPE)
+    ticks['datetime'] = [20180102093000000, 20180102093001000]
+    store.append_day('HK.00700', day, ticks[:1])
+    store.append_day('HK.00700', day, ticks[1:])
+    assert store.load_day('HK.00700', day)['datetime'].tolist() == ticks['datetime'].tolist()
+
+
+def test_instrument_store_expires_after_ttl(tmp_path):
+    store = InstrumentStore(str(tmp_path))
+    assert store.load('HK', 3600) is None
+    records = [{'order_book_id': 'HK.00700', 'round_lot': 100}]
+    store.save('HK', records)
+    assert store.load('HK', 3600) == records
+    assert store.load('US', 3600) is None
+
+    path = str(tmp_path / 'instruments' / 'HK.pkl')
+    mtime = time.time() - 7200
+    os.utime(path, (mtime, mtime))
+    assert store.load('HK', 3600) is None
+    assert store.load('HK', 86400) == records
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+from datetime import date, datetime, timedelta
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+
+from futuquant.open_context import CurKlineHandlerBase
+from rqalpha.const import DEFAULT_ACCOUNT_TYPE, RUN_TYPE
+from rqalpha.environment import Environment
+from rqalpha.events import EVENT
+from rqalpha.utils import RqAttrDict
+
+from rqalpha_mod_futu_cn.futu_data_source import DataCache
+from rqalpha_mod_futu_cn.futu_event_source import FUTUEventForBacktest, FUTUEventForRealtime
+from rqalpha_mod_futu_cn.futu_market_state import Futu_Market_State
+
+
+def _kline_push(code):
+    return pd.DataFrame({
+        'code': [code], 'time_key': ['2018-01-02 00:00:00'], 'open': [1.], 'close': [1.], 'high': [1.],
+        'low': [1.], 'volume': [100], 'turnover': [100.], 'k_type': ['K_DAY'],
+    })
+
+
+def test_push_mode_coalesces_kline_pushes_into_one_bar(env, monkeypatch):
+    # 推送内容直接作为解析结果, 不经过futu的报文解析
+    monkeypatch.setattr(CurKlineHandlerBase, 'on_recv_rsp', lambda self, rsp_str: (0, rsp_str))
+    data_cache = DataCache()
+    env.data_proxy = SimpleNamespace(get_trading_dates=lambda start, end: [date.today()])
+    market_state = SimpleNamespace(get_futu_market_state=lambda: Futu_Market_State.MARKET_OPEN)
+    mod_config = SimpleNamespace(futu_bar_mode='push', futu_bar_fps=1)
+    events = FUTUEventForRealtime(env, mod_config, market_state, data_cache.bar_queue).events(
+        date.today(), date.today() + timedelta(days=1), '1m')
+    assert next(events).event_type == EVENT.BEFORE_TRADING
+
+    # event source 取走之前的多次推送合并成一个 BAR 事件
+    data_cache.on_recv_rsp(_kline_push('HK.00700'))
+    data_cache.on_recv_rsp(_kline_push('HK.00005'))
+    assert data_cache.bar_queue.qsize() == 1
+    assert next(events).event_type == EVENT.BAR
+    assert data_cache.bar_queue.empty()
+    assert sorted(data_cache._cache['cur_kline']) == ['HK.00005', 'HK.00700']
+
+    data_cache.on_recv_rsp(_kline_push('HK.00700'))
+    assert next(events).event_type == EVENT.BAR
+
+
+def _backtest_env(market):
+    return Environment(RqAttrDict({
+        'base': {'run_type': RUN_TYPE.BACKTEST, 'accounts': {DEFAULT_ACCOUNT_TYPE.STOCK.name: 1000000}},
+        'mod': {'futu': {'futu_market': market}},
+    }))
+
+
+@pytest.mark.parametrize('market, count, first, last, lunch', [
+    ('HK', 151 + 180, (9, 30), (16, 0), [(12, 0), (13, 1)]),
+    ('SH', 120 + 120, (9, 31), (15, 0), [(11, 30), (13, 1)]),
+    ('US', 390, (9, 31), (16, 0), []),
+])
+def test_backtest_trading_minutes_per_market(market, count, first, last, lunch):
+    event_source = FUTUEventForBacktest(_backtest_env(market))
+    day = datetime(2018, 1, 2)
+    minutes = event_source._get_trading_minutes(day)
+
+    assert len(minutes) == count and minutes == sorted(minutes)
+    assert minutes[0] == day.replace(hour=first[0], minute=first[1])
+    assert minutes[-1] == day.replace(hour=last[0], minute=last[1])
+    if lunch:
+        pos = minutes.index(day.replace(hour=lunch[0][0], minute=lunch[0][1]))
+        assert minutes[pos + 1] == day.replace(hour=lunch[1][0], minute=lunch[1][1])
+    # 同一天重复取时直接复用, 换一天重新生成
+    assert event_source._get_trading_minutes(day) is minutes
+    assert event_source._get_trading_minutes(day + timedelta(days=1))[0] == minutes[0] + timedelta(days=1)
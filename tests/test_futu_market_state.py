@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+
+from rqalpha_mod_futu_cn import futu_market_state
+from rqalpha_mod_futu_cn.futu_market_state import FUTUMarketStateSource, Futu_Market_State
+
+
+class FakeQuoteContext(object):
+    def __init__(self, state):
+        self.state = state
+
+    def get_global_state(self):
+        return 0, {'Market_HK': str(self.state)}
+
+
+def _state_source(monkeypatch, quote_context):
+    # 不启动定时查询线程, 由测试直接调用 _query_futu_market_state
+    monkeypatch.setattr(futu_market_state, 'IsRuntype_RealtimeStrategy', lambda: False)
+    return FUTUMarketStateSource(None, quote_context)
+
+
+def test_wait_state_change_wakes_on_state_change(env, monkeypatch):
+    quote_context = FakeQuoteContext(2)
+    source = _state_source(monkeypatch, quote_context)
+    assert source.get_futu_market_state() == Futu_Market_State.MARKET_PRE_OPEN
+    version = source.wait_state_change(None)
+
+    woken = []
+    waiter = threading.Thread(target=lambda: woken.append(source.wait_state_change(version, 5)))
+    waiter.start()
+    time.sleep(0.05)
+    quote_context.state = 3
+    started = time.time()
+    source._query_futu_market_state()
+    waiter.join(5)
+    assert woken == [version + 1]
+    assert time.time() - started < 1
+    assert source.get_futu_market_state() == Futu_Market_State.MARKET_OPEN
+
+
+def test_wait_state_change_times_out_without_change(env, monkeypatch):
+    quote_context = FakeQuoteContext(3)
+    source = _state_source(monkeypatch, quote_context)
+    version = source.wait_state_change(None)
+
+    # 早盘和午盘都映射为开盘, 状态没有变化, 不唤醒等待方
+    quote_context.state = 5
+    source._query_futu_market_state()
+    assert source.wait_state_change(version, 0.05) == version
+    assert source.wait_state_change(version - 1, 5) == version
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+
+import sqlite3
+
+from rqalpha.const import ORDER_STATUS
+
+from rqalpha_mod_futu_cn.futu_order_journal import FUTUOrderJournal
+
+from conftest import make_order, wait_until
+
+
+def _row_count(journal):
+    conn = sqlite3.connect(journal._path)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM journal").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_replay_restores_last_state_of_open_orders(env, tmp_path):
+    journal = FUTUOrderJournal(str(tmp_path), "HK_1")
+    open_order = make_order('HK.00700', 300, 10.)
+    open_order.active()
+    cancelled = make_order('HK.00700', 100, 10.)
+    cancelled.active()
+    queued = make_order('HK.00005', 100, 50.)
+
+    journal.record('submit', open_order, 1001)
+    journal.record('submit', cancelled, 1002)
+    journal.record('queued', queued)
+    state = open_order.get_state()
+    state['filled_quantity'] = 100
+    open_order.set_state(state)
+    journal.record('deal_d1', open_order, 1001)
+    cancelled.mark_cancelled("cancelled")
+    journal.record('status_6', cancelled, 1002)
+    wait_until(lambda: _row_count(journal) == 5)
+
+    restored = FUTUOrderJournal(str(tmp_path), "HK_1").replay()
+    assert [(fid, order.order_id) for fid, order in restored] == [('1001', open_order.order_id)]
+    order = restored[0][1]
+    assert order.status == ORDER_STATUS.ACTIVE
+    assert order.quantity == 300 and order.filled_quantity == 100 and order.frozen_price == 10.
+
+    # 压缩后只保留未完成订单的最后一条记录
+    assert _row_count(journal) == 1
+    assert [fid for fid, __ in journal.replay()] == ['1001']
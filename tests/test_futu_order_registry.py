@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+
+from rqalpha_mod_futu_cn.futu_order_registry import FUTUOrderRegistry
+
+from conftest import make_order
+
+
+def test_registry_normalizes_futu_order_id(env):
+    registry = FUTUOrderRegistry()
+    order = make_order('HK.00700', 100, 10.)
+    registry.add(1001, order)
+    assert registry.get_order('1001') is order
+    assert registry.get_order(1001) is order
+    assert registry.get_futu_order_id(order) == '1001'
+    assert registry.futu_order_ids() == ['1001']
+
+
+def test_registry_keeps_order_and_filters_by_code(env):
+    registry = FUTUOrderRegistry()
+    first = make_order('HK.00700', 100, 10.)
+    second = make_order('HK.00005', 100, 50.)
+    third = make_order('HK.00700', 200, 10.)
+    for fid, order in [(3, first), (1, second), (2, third)]:
+        registry.add(fid, order)
+    assert registry.orders() == [first, second, third]
+    assert registry.orders('HK.00700') == [first, third]
+    assert len(registry) == 3
+
+
+def test_registry_remove_and_clear(env):
+    registry = FUTUOrderRegistry()
+    order = make_order('HK.00700', 100, 10.)
+    other = make_order('HK.00005', 100, 50.)
+    registry.add('1001', order)
+    registry.add('1002', other)
+    assert registry.remove(1001) is order
+    assert registry.remove(1001) is None
+    assert registry.get_futu_order_id(order) is None
+    registry.clear()
+    assert len(registry) == 0 and registry.get_futu_order_id(other) is None
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+from threading import RLock
+
+import pandas as pd
+
+from rqalpha.model.base_position import Positions
+
+from rqalpha_mod_futu_cn.futu_position import FUTUStockPosition
+from rqalpha_mod_futu_cn.futu_position_reconciler import FUTUPositionReconciler
+
+
+class FakePositionQuery(object):
+    def __init__(self):
+        self.positions = []
+
+    def __call__(self):
+        return 0, pd.DataFrame(self.positions, columns=['code', 'qty', 'cost_price'])
+
+
+def _positions(**quantities):
+    positions = Positions(FUTUStockPosition)
+    for order_book_id, quantity in quantities.items():
+        state = positions.get_or_create(order_book_id).get_state()
+        state['quantity'] = quantity
+        positions[order_book_id].set_state(state)
+    return positions
+
+
+def test_drift_is_corrected_after_two_runs():
+    query = FakePositionQuery()
+    query.positions = [('A', 100, 10.), ('B', 300, 5.)]
+    reconciler = FUTUPositionReconciler(query, RLock())
+    positions = _positions(A=100, B=200)
+
+    assert len(reconciler.reconcile(positions)) == 0  # 第一次发现偏差只记下
+    assert positions['B'].quantity == 200
+    drift = reconciler.reconcile(positions)
+    assert drift.values.tolist() == [['B', 200, 300]]
+    assert positions['B'].quantity == 300 and positions['B'].avg_price == 5.
+
+    metrics = reconciler.get_metrics()
+    assert metrics['reconcile_count'] == 2
+    assert metrics['drift_count'] == 1 and metrics['drift_quantity'] == 100
+    assert metrics['last_drift'].values.tolist() == [['B', 200, 300]]
+
+
+def test_skipped_and_transient_drift_are_not_corrected():
+    query = FakePositionQuery()
+    query.positions = [('A', 200, 10.), ('C', 100, 1.)]
+    reconciler = FUTUPositionReconciler(query, RLock())
+    positions = _positions(A=100)
+
+    reconciler.reconcile(positions, skip_order_book_ids=['A'])
+    query.positions = [('A', 200, 10.)]  # C 的偏差只出现一次
+    assert len(reconciler.reconcile(positions, skip_order_book_ids=['A'])) == 0
+    assert positions['A'].quantity == 100 and 'C' not in positions
+    assert reconciler.get_metrics()['last_drift'] is None
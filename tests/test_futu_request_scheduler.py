@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+from rqalpha_mod_futu_cn import futu_request_scheduler
+from rqalpha_mod_futu_cn.futu_request_scheduler import TokenBucket, FUTURequestScheduler, MAX_RETRY, RET_ERROR
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def _patch_time(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(futu_request_scheduler.time, 'monotonic', clock.monotonic)
+    monkeypatch.setattr(futu_request_scheduler.time, 'sleep', clock.sleep)
+    return clock
+
+
+def test_token_bucket_refills_at_rate(monkeypatch):
+    clock = _patch_time(monkeypatch)
+    bucket = TokenBucket(2, 1)
+    assert bucket.try_acquire() and bucket.try_acquire()
+    assert not bucket.available() and not bucket.try_acquire()
+    clock.now += 0.5
+    assert bucket.available()
+    assert bucket.available()  # available 不消耗令牌
+    assert bucket.try_acquire() and not bucket.try_acquire()
+
+
+def test_token_bucket_acquire_waits_for_next_token(monkeypatch):
+    clock = _patch_time(monkeypatch)
+    bucket = TokenBucket(1, 2)
+    bucket.acquire()
+    bucket.acquire()
+    assert sum(clock.sleeps) == 2.
+
+
+def test_token_bucket_drain(monkeypatch):
+    _patch_time(monkeypatch)
+    bucket = TokenBucket(5, 1)
+    bucket.drain()
+    assert not bucket.try_acquire()
+
+
+def test_scheduler_call_sleeps_only_between_attempts(monkeypatch):
+    clock = _patch_time(monkeypatch)
+    scheduler = FUTURequestScheduler({}, 1)
+    attempts = []
+
+    def fail():
+        attempts.append(1)
+        return RET_ERROR, "error"
+
+    assert scheduler.call('api', fail) == (RET_ERROR, "error")
+    assert len(attempts) == MAX_RETRY
+    assert len(clock.sleeps) == MAX_RETRY - 1
+
+
+def test_scheduler_call_returns_after_retry_success(monkeypatch):
+    _patch_time(monkeypatch)
+    scheduler = FUTURequestScheduler({'api': (10, 1)}, 1)
+    results = [(RET_ERROR, "freq limit"), (0, "data")]
+    assert scheduler.call('api', lambda: results.pop(0)) == (0, "data")
+    assert results == []
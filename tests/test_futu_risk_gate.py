@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+from rqalpha.const import SIDE
+from rqalpha.utils import RqAttrDict
+
+from rqalpha_mod_futu_cn.futu_risk_gate import FUTURiskGate
+
+from conftest import make_order
+
+
+def _gate(max_notional=0, max_open_orders=0, account_rate=None, symbol_rate=None):
+    return FUTURiskGate(RqAttrDict({'max_notional': max_notional, 'max_open_orders': max_open_orders,
+                                    'account_rate': account_rate, 'symbol_rate': symbol_rate}))
+
+
+def test_round_lot_rounds_buy_down_and_keeps_odd_lot_sell(env):
+    buy = make_order('HK.00700', 250, 10.)
+    FUTURiskGate.round_lot(buy, 100)
+    assert buy.quantity == 200
+
+    sell = make_order('HK.00700', 250, 10., side=SIDE.SELL)
+    FUTURiskGate.round_lot(sell, 100)
+    assert sell.quantity == 250
+
+
+def test_check_rejects_less_than_one_lot(env):
+    order = make_order('HK.00700', 50, 10.)
+    FUTURiskGate.round_lot(order, 100)
+    assert 'less than one lot' in _gate().check(order, 0)
+
+
+def test_check_notional_and_open_orders(env):
+    gate = _gate(max_notional=5000, max_open_orders=2)
+    order = make_order('HK.00700', 400, 10.)
+    assert gate.check(order, 0) is None
+    assert 'max_notional' in gate.check(order, 0, quantity=600)
+    assert 'max_notional' in gate.check(order, 0, price=13.)
+    assert 'max_open_orders' in gate.check(order, 2)
+
+
+def test_symbol_rate_reject_does_not_consume_account_token(env):
+    gate = _gate(account_rate=(2, 3600), symbol_rate=(1, 3600))
+    assert gate.check(make_order('HK.00700', 100, 10.), 0) is None
+    assert 'HK.00700 order rate exceeded' in gate.check(make_order('HK.00700', 100, 10.), 0)
+    assert 'HK.00700 order rate exceeded' in gate.check(make_order('HK.00700', 100, 10.), 0)
+    # 帐户的第二个令牌仍然可用
+    assert gate.check(make_order('HK.00005', 100, 10.), 0) is None
+    assert 'account order rate exceeded' in gate.check(make_order('HK.00388', 100, 10.), 0)
+
+
+def test_account_rate_reject_does_not_consume_symbol_token(env):
+    gate = _gate(account_rate=(1, 3600), symbol_rate=(1, 3600))
+    assert gate.check(make_order('HK.00700', 100, 10.), 0) is None
+    assert 'account order rate exceeded' in gate.check(make_order('HK.00005', 100, 10.), 0)
+    assert gate._get_symbol_bucket('HK.00005').available()
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+
+from futuquant.constant import RET_OK
+
+from rqalpha_mod_futu_cn import open_context_cn
+from rqalpha_mod_futu_cn.open_context_cn import OpenCNQuoteContext
+
+
+def _kline(code, date):
+    return {'code': code, 'time_point': date, 'data_valid': 1, 'time_key': date + ' 00:00:00'}
+
+
+class FakeMultiPointsServer(object):
+    """每次最多返回 max_num 根K线, 返回不完整时 HasNext 为真"""
+
+    def __init__(self, max_num):
+        self.max_num = max_num
+        self.requests = []
+
+    def query(self, codes, dates, fields, ktype, autype, max_num, no_data_mode):
+        self.requests.append((list(codes), list(dates)))
+        klines = [_kline(code, date) for code in codes for date in dates]
+        return RET_OK, "", (klines[:self.max_num], len(klines) > self.max_num)
+
+
+def _quote_context(server):
+    ctx = OpenCNQuoteContext.__new__(OpenCNQuoteContext)
+    ctx._get_sync_query_processor = lambda pack, unpack: server.query
+    return ctx
+
+
+def test_multi_points_kline_calls_once_per_request(monkeypatch):
+    monkeypatch.setattr(open_context_cn, 'MULTI_POINTS_MAX_DATE_NUM', 2)
+    server = FakeMultiPointsServer(max_num=5)
+    calls = []
+
+    def call(func, **kargs):
+        calls.append(kargs['codes'])
+        return func(**kargs)
+
+    dates = ['2018-01-02', '2018-01-03', '2018-01-04']
+    ret_code, data = _quote_context(server).get_multi_points_history_kline(['A', 'B', 'C'], dates, call=call)
+    assert ret_code == RET_OK
+    assert len(data) == 9 and not data.duplicated(['code', 'time_point']).any()
+    # 前两个时间点分两页, 第三个时间点一页
+    assert len(server.requests) == 3 and len(calls) == 3
+    assert calls == [['A', 'B', 'C'], ['C'], ['A', 'B', 'C']]